@@ -0,0 +1,235 @@
+"""
+Database access for the Advertiser.
+
+Blocking DB-API calls run on a small thread pool so the asyncio loop (and
+every websocket on it) never waits on PostgreSQL. Connections are pooled,
+broken ones are discarded and re-opened with exponential backoff, and the
+LISTEN connection re-subscribes by itself after the server comes back.
+
+`connect` can be any DB-API connect callable, so the layer runs against a
+local PostgreSQL or an in-process stand-in: sqliteConnect opens sqlite3
+connections that may move between the executor threads.
+"""
+
+import asyncio
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+import psycopg2.extensions
+
+from logsetup import getLogger
+
+log = getLogger('advdb')
+
+#dbip = os.environ['SHELTER_DB']
+
+DB_PARAMS = dict(
+        host="127.0.0.1",
+        port="5433",
+        user="shelter",
+        password="20121208",
+        dbname="cms_shelter_server",
+        connect_timeout=5
+        )
+
+
+def sqliteConnect(database):
+    """`connect` for a sqlite3 stand-in. The pool lends a connection to one
+    executor thread at a time, but not always to the same one, which sqlite3
+    refuses unless check_same_thread is off.
+    """
+    return sqlite3.connect(database, check_same_thread=False)
+
+
+class DatabaseUnavailable(Exception):
+    """Raised when a query could not run because of the connection
+    """
+
+
+class Backoff:
+    def __init__(self, initial=0.5, maximum=30.0, factor=2.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.delay = initial
+
+    def next(self):
+        delay = self.delay
+        self.delay = min(self.delay * self.factor, self.maximum)
+        return delay
+
+    def reset(self):
+        self.delay = self.initial
+
+
+class QueryStats:
+    def __init__(self, keep=100):
+        self.queries = 0
+        self.errors = 0
+        self.connects = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=keep)
+
+    def add(self, sql, elapsed):
+        self.queries += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.recent.append((sql, elapsed))
+
+    def summary(self):
+        return {
+            'queries': self.queries,
+            'errors': self.errors,
+            'connects': self.connects,
+            'mean': self.total / self.queries if self.queries else None,
+            'max': self.max,
+        }
+
+
+class AdvDatabase:
+    def __init__(self, params=None, connect=psycopg2.connect, maxconn=2):
+        self.params = DB_PARAMS if params is None else params
+        self.connect = connect
+        self.maxconn = maxconn
+        self.idle = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(maxconn)
+        self.executor = ThreadPoolExecutor(max_workers=maxconn, thread_name_prefix='advdb')
+        self.stats = QueryStats()
+        self.backoff = Backoff()
+
+        self.listen_conn = None
+        self.listen_task = None
+
+    # ---- pool (executor threads) ----
+    def acquire(self):
+        self.slots.acquire()
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        try:
+            conn = self.connect(**self.params)
+        except Exception:
+            self.slots.release()
+            raise
+        self.stats.connects += 1
+        return conn
+
+    def release(self, conn, broken=False):
+        if broken:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        else:
+            with self.lock:
+                self.idle.append(conn)
+        self.slots.release()
+
+    def run(self, sql, args):
+        start = time.monotonic()
+        try:
+            conn = self.acquire()
+        except Exception as e:
+            self.stats.errors += 1
+            raise DatabaseUnavailable(e)
+        try:
+            cur = conn.cursor()
+            cur.execute(sql, args)
+            columns = [d[0] for d in cur.description] if cur.description else []
+            rows = cur.fetchall() if cur.description else []
+            cur.close()
+            # end the read transaction so the next query sees new rows
+            conn.commit()
+        except Exception as e:
+            self.stats.errors += 1
+            self.release(conn, broken=True)
+            raise DatabaseUnavailable(e)
+        self.release(conn)
+        self.stats.add(sql, time.monotonic() - start)
+        return columns, rows
+
+    # ---- asyncio side ----
+    async def query(self, sql, args=()):
+        """Rows of sql, run without blocking the event loop
+        """
+        columns, rows = await asyncio.get_running_loop().run_in_executor(self.executor, self.run, sql, args)
+        self.backoff.reset()
+        return rows
+
+    async def columns(self, sql, args=()):
+        columns, rows = await asyncio.get_running_loop().run_in_executor(self.executor, self.run, sql, args)
+        self.backoff.reset()
+        return columns
+
+    async def retryDelay(self):
+        await asyncio.sleep(self.backoff.next())
+
+    def listen(self, channel, callback):
+        """Keep a LISTEN subscription on channel alive, calling callback()
+        on every notification and once after each (re)connect, since changes
+        may have been missed while disconnected
+        """
+        self.listen_task = asyncio.ensure_future(self.listenLoop(channel, callback))
+
+    async def listenLoop(self, channel, callback):
+        loop = asyncio.get_running_loop()
+        backoff = Backoff()
+        while True:
+            lost = loop.create_future()
+            try:
+                lconn = await loop.run_in_executor(self.executor, self.openListen, channel)
+            except NotImplementedError:
+                return  # the stand-in cannot LISTEN: stay on polling
+            except Exception as e:
+                log.warning('LISTEN unavailable', channel=channel, error=e)
+                await asyncio.sleep(backoff.next())
+                continue
+            backoff.reset()
+            self.listen_conn = lconn
+            loop.add_reader(lconn.fileno(), self.onNotify, lconn, callback, lost)
+            callback()
+            await lost
+            loop.remove_reader(lconn.fileno())
+            self.listen_conn = None
+            try:
+                lconn.close()
+            except Exception:
+                pass
+            callback()
+
+    def openListen(self, channel):
+        lconn = self.connect(**self.params)
+        self.stats.connects += 1
+        if not hasattr(lconn, 'poll'):
+            lconn.close()
+            raise NotImplementedError('connection has no notification support')
+        lconn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        lconn.cursor().execute('LISTEN ' + channel)
+        return lconn
+
+    def onNotify(self, lconn, callback, lost):
+        try:
+            lconn.poll()
+        except Exception as e:
+            log.warning('notification connection lost', error=e)
+            if not lost.done():
+                lost.set_result(None)
+            return
+        if lconn.notifies:
+            lconn.notifies.clear()
+            callback()
+
+    def close(self):
+        if self.listen_task is not None:
+            self.listen_task.cancel()
+        self.executor.shutdown(wait=False)
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
@@ -1,109 +1,356 @@
+import argparse
 import asyncio
 import json
 import random
-import psycopg2
 import socket
 import os
 import time
-from websockets.exceptions import ConnectionClosedOK
+from collections import deque
+from websockets.exceptions import ConnectionClosed
 
-#dbip = os.environ['SHELTER_DB']
+from advdb import AdvDatabase, DatabaseUnavailable
+from advprotocol import AdListHistory
+import logsetup
+
+log = logsetup.getLogger('advertiser')
+
+ADV_TABLE = '"Updator_advertisement_media"'
+
+# NOTIFY channel raised by the trigger on ADV_TABLE
+ADV_CHANNEL = 'advertisement_media_changed'
+
+# optional ADV_TABLE column naming the shelter group an ad is meant for; ads
+# without a group (or a table without the column) go to every group
+GROUP_COLUMN = 'shelter_group'
+
+# group of clients that register without one
+DEFAULT_GROUP = ''
+
+# installed once, by installNotify() (`python advertiser.py --install-notify`, run
+# as a role allowed to alter the CMS table); any insert/update/delete on the table
+# then notifies ADV_CHANNEL (statement level, so bulk edits notify once)
+NOTIFY_TRIGGER_SQL = '''
+CREATE OR REPLACE FUNCTION shelter_notify_advertisement() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('{channel}', TG_OP);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS shelter_advertisement_notify ON {table};
+CREATE TRIGGER shelter_advertisement_notify
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+    FOR EACH STATEMENT EXECUTE PROCEDURE shelter_notify_advertisement();
+'''.format(channel=ADV_CHANNEL, table=ADV_TABLE)
+
+class AdGroup:
+    """Clients sharing one ad list: the list's history, its serialized
+    messages and the timings of the sends to the group
+    """
+    def __init__(self, key):
+        self.key = key
+        self.history = AdListHistory()
+        self.clients = dict()   # client id -> client
+        self.payloads = dict()  # client state -> serialized message, None if nothing to send
+        # (clients, evicted, seconds) of the recent sends to this group
+        self.send_stats = deque(maxlen=100)
+
+    def stats(self):
+        sends = list(self.send_stats)
+        return {
+            'clients': [cli.origin for cli in self.clients.values()],
+            'epoch': self.history.epoch,
+            'version': self.history.version,
+            'items': len(self.history.items),
+            'sends': len(sends),
+            'last_send': sends[-1][2] if sends else None,
+            'max_send': max((s[2] for s in sends), default=None),
+        }
 
-conn = psycopg2.connect(
-        host="127.0.0.1",
-        port="5433",
-        user="shelter",
-        password="20121208",
-        dbname="cms_shelter_server"
-        )
 
 class Advertiser:
-    def __init__(self):
+    def __init__(self, use_notify=True, db=None, group_column=GROUP_COLUMN):
         self.temp = 0
         self.clients = dict()
 
+        # queries run off the event loop; the advertiser starts and serves
+        # clients even while the database is down
+        self.db = db if db is not None else AdvDatabase()
+
         # flag variable for websocket msg send.
         # True : send messages
         # False : do not send messages
 
+        # set by a database notification or a new client, wakes runAdvertiser
+        # (created in init_adv, inside the running event loop)
+        self.changed = None
+        self.db_changed = True
+        self.use_notify = use_notify
+
+        # re-query interval without notifications, and the safety re-query
+        # interval while listening (in case a notification is ever missed)
+        self.poll_interval = 5
+        self.notify_fallback = 60
+
+        # a versioned ad list per group key; delta clients are sent what
+        # changed since their version, legacy clients the full JSON array.
+        # Lists and payloads are built once per group, whatever its size.
+        self.group_column = group_column
+        self.groups = dict()        # group key -> AdGroup
+        self.rows = None            # (path, group) of the last query
+        self.client_state = dict()  # client id -> (delta protocol?, epoch, version)
+        self.client_group = dict()  # client id -> group key
+        self.joined = []            # clients waiting for their first message
+
+        # a client that takes longer than this to accept a message is evicted
+        self.send_timeout = 2.0
+        # (clients, evicted, seconds) of the recent broadcasts
+        self.broadcast_stats = deque(maxlen=100)
+
     async def init_adv(self):
-        print('Advertiser has been ready')
+        if logsetup.service is None:
+            logsetup.configure()
+        log.info('advertiser ready')
+        self.changed = asyncio.Event()
+        if self.use_notify:
+            self.db.listen(ADV_CHANNEL, self.onNotify)
         asyncio.create_task(self.runAdvertiser())
-        print('advertiser is running')
+        log.info('advertiser running', notify=self.use_notify)
 
-    async def addClient(self, cl_socket):
+    async def addClient(self, cl_socket, resume=None, group=None):
+        """Register a client. Legacy clients (resume None) get the plain JSON
+        array on every change; delta clients pass their registration message,
+        {"epoch": ..., "version": ...} of the last list they hold, or {} for none.
+        The group key (or the registration message's "group") selects the ad
+        list the client is sent.
+        """
         if cl_socket.id in self.clients.keys():
-            print(cl_socket.origin, 'is already added')
+            log.warning('client already added', origin=cl_socket.origin, id=cl_socket.id)
         else:
+            if group is None:
+                group = (resume or {}).get('group', DEFAULT_GROUP)
+            group = self.group(str(group))
             self.clients[cl_socket.id] = cl_socket
+            group.clients[cl_socket.id] = cl_socket
+            self.client_group[cl_socket.id] = group.key
+            if resume is None:
+                self.client_state[cl_socket.id] = (False, None, None)
+            else:
+                self.client_state[cl_socket.id] = (True, resume.get('epoch'), resume.get('version'))
+            self.joined.append(cl_socket)
+            if self.changed is not None:
+                self.changed.set()
+
+    def removeClient(self, cli):
+        self.clients.pop(cli.id, None)
+        self.client_state.pop(cli.id, None)
+        key = self.client_group.pop(cli.id, None)
+        if key is not None:
+            self.groups[key].clients.pop(cli.id, None)
+
+    def group(self, key):
+        """AdGroup of key, created with its list from the last query
+        """
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = AdGroup(key)
+            if self.rows is not None:
+                group.history.update(self.groupList(key))
+        return group
+
+    def groupList(self, key):
+        """Paths for group key from the last query: the ads for every group
+        and those for key, in query order
+        """
+        return [path for path, group in self.rows if group is None or group == '' or str(group) == key]
+
+    def groupStats(self):
+        """Membership, list version and send timings of every group
+        """
+        return {key: group.stats() for key, group in self.groups.items()}
 
     async def printClients(self):
         for idx, cli in enumerate(self.clients.values()):
-            print(idx, cli.origin, cli.id)
+            log.debug('client', index=idx, origin=cli.origin, id=cli.id, group=self.client_group.get(cli.id))
 
-    async def runAdvertiser(self):
-        print("runAdvertiser called.")
+    async def sendOne(self, cli, data):
+        try:
+            await asyncio.wait_for(cli.send(data), self.send_timeout)
+            return True
+        except (ConnectionClosed, asyncio.TimeoutError):
+            return False
 
-        cur = conn.cursor()
+    async def broadcast(self, message, clients=None):
+        """Send message to every client concurrently, serialized once.
+        Slow or closed clients are dropped without holding up the others.
+        """
+        data = message if isinstance(message, str) else json.dumps(message)
+        if clients is None:
+            clients = list(self.clients.values())
+        return await self.deliver([(data, clients)])
 
-        sql = 'SELECT * FROM \"Updator_advertisement_media\"'
+    async def deliver(self, plan):
+        """Send each (serialized payload, clients) pair of plan, all
+        concurrently in one round
+        """
+        sends = [(cli, data) for data, clients in plan for cli in clients]
+        clients = [cli for cli, data in sends]
+        start = time.monotonic()
+        results = await asyncio.gather(*(self.sendOne(cli, data) for cli, data in sends))
+        elapsed = time.monotonic() - start
 
-        cur.execute(sql)
+        evicted = [cli for cli, ok in zip(clients, results) if not ok]
+        for cli in evicted:
+            log.warning('client evicted (closed or slow)', origin=cli.origin, id=cli.id)
+            self.removeClient(cli)
+            # a hung connection must not linger in the background
+            asyncio.ensure_future(cli.close())
+        if evicted:
+            await self.printClients()
 
-        advlist = []
+        self.broadcast_stats.append((len(clients), len(evicted), elapsed))
+        log.info('broadcast', clients=len(clients), ms=round(elapsed * 1000, 1), evicted=len(evicted))
+        return evicted
 
-        ftp_path = "/ftp/"
+    def payloadFor(self, cli):
+        """Serialized message bringing cli up to date with its group's list,
+        None if it already is
+        """
+        group = self.groups[self.client_group[cli.id]]
+        history = group.history
+        delta, epoch, version = self.client_state[cli.id]
+        if not delta:
+            key = ('legacy',)
+        else:
+            if epoch == history.epoch and version == history.version:
+                return None
+            key = ('delta', epoch, version)
+        if key not in group.payloads:
+            if delta:
+                # None: up to date, e.g. resumed with the version but no epoch
+                msg = history.since(version, epoch)
+            else:
+                msg = history.items
+            group.payloads[key] = None if msg is None else json.dumps(msg)
+        return group.payloads[key]
 
-        interval = 5
+    async def publish(self, clients):
+        """Send each of clients what it is missing. Clients are split by
+        group and, within a group, by the payload they need, so each payload
+        is serialized once; the groups are sent concurrently.
+        """
+        members = dict()
+        for cli in clients:
+            if cli.id in self.client_state:
+                members.setdefault(self.client_group[cli.id], []).append(cli)
+        await asyncio.gather(*(self.publishGroup(self.groups[key], group_clients)
+                               for key, group_clients in members.items()))
 
-        for rst in cur:
-            advlist.append(ftp_path + rst[1])
+    async def publishGroup(self, group, clients):
+        plan = dict()
+        for cli in clients:
+            data = self.payloadFor(cli)
+            if data is not None:
+                plan.setdefault(data, []).append(cli)
+        if not plan:
+            return
+        start = time.monotonic()
+        evicted = await self.deliver(list(plan.items()))
+        group.send_stats.append((sum(len(c) for c in plan.values()), len(evicted), time.monotonic() - start))
+        for cli in clients:
+            if cli.id in self.client_state:
+                delta = self.client_state[cli.id][0]
+                self.client_state[cli.id] = (delta, group.history.epoch, group.history.version)
 
-        while True:
-            if len(self.clients) > 0: # 최소 1개의 클라이언트가 있는 경우에 동작
-                for idx, cli in enumerate(self.clients.values()):
-                    adv_string = json.dumps(advlist)
-                    try:
-                        print("send?")
-                        await cli.send(adv_string)
-                    # await cli.send(data_string)
-                    except ConnectionClosedOK:
-                        print(idx, cli.origin, 'data sended', adv_string)
-                        del self.clients[cli.id]
-                        self.printClients()
-                        break
-                break
-            await asyncio.sleep(3) # 클라이언트가 하나도 ㅇ벗는 경우, 비동기적으로 대기합니다.
-
-        initclients = len(self.clients)
+    def onNotify(self):
+        """The table changed, or the LISTEN connection was (re)established
+        or lost and changes may have been missed
+        """
+        self.db_changed = True
+        self.changed.set()
 
-        while True:
-            print("runadv while loop, loop interval :", interval)
+    async def resolveQuery(self):
+        """SELECT of the media path column (second column of the table) and
+        the group column, NULL when the table has none
+        """
+        columns = await self.db.columns('SELECT * FROM ' + ADV_TABLE + ' LIMIT 0')
+        group = '"{}"'.format(self.group_column) if self.group_column in columns else 'NULL'
+        return 'SELECT "{}", {} FROM {}'.format(columns[1], group, ADV_TABLE)
+
+    async def fetchAdvRows(self, sql, ftp_path):
+        """(path, group) of every ad
+        """
+        return [(ftp_path + rst[0], rst[1]) for rst in await self.db.query(sql)]
+
+    async def runAdvertiser(self):
+        log.debug('runAdvertiser started')
 
-            new_advlist = []
+        sql = None
 
-            cur.execute(sql)
+        ftp_path = "/ftp/"
 
-            for rst in cur:
-                new_advlist.append(ftp_path + rst[1])
+        while True:
+            listening = self.db.listen_conn is not None
+            interval = self.notify_fallback if listening else self.poll_interval
+            log.debug('advertiser cycle', interval=interval, listening=listening)
 
-            if (new_advlist != advlist) or (initclients != len(self.clients)):
-                initclients = len(self.clients)
-                for idx, cli in enumerate(self.clients.values()):
+            if self.db_changed or not listening:
+                try:
+                    if sql is None:
+                        # select only the path and group columns
+                        sql = await self.resolveQuery()
+                    self.rows = await self.fetchAdvRows(sql, ftp_path)
+                    self.db_changed = False
+                except DatabaseUnavailable as e:
+                    # keep serving the last list, catch up once the DB is back
+                    log.warning('database unavailable', error=e)
+                    await self.db.retryDelay()
+                    continue
+                # one list per group, re-sent to the groups whose list changed
+                changed = []
+                for key, group in self.groups.items():
+                    if group.history.update(self.groupList(key)) is not None:
+                        group.payloads.clear()
+                        changed.extend(group.clients.values())
+                if changed:
                     #여기에 사진 링크 보내면 될듯
                     # data = random.sample(advlist, len(advlist))
-                    # data_string = json.dumps(four_icon)
-                    adv_string = json.dumps(new_advlist)
-                    try:
-                        await cli.send(adv_string)
-                    # await cli.send(data_string)
-                    except ConnectionClosedOK:
-                        print(idx, cli.origin, 'data sended', adv_string)
-                        del self.clients[cli.id]
-                        self.printClients()
-                        break
-
-                #1초 주기로 데이터 변경됨 -> 주기 변경 갥
-            else:
-                pass
-            await asyncio.sleep(interval)
+                    sent = set(cli.id for cli in changed)
+                    self.joined = [cli for cli in self.joined if cli.id not in sent]
+                    await self.publish(changed)
+
+            if self.joined and self.rows is not None:
+                # new clients only: a snapshot/array, or a resume delta
+                joined, self.joined = self.joined, []
+                await self.publish(joined)
+
+            # sleep until a notification/new client arrives, or fall back to polling
+            try:
+                await asyncio.wait_for(self.changed.wait(), interval)
+            except asyncio.TimeoutError:
+                self.db_changed = True
+            self.changed.clear()
+
+
+def installNotify(db=None):
+    """Create the trigger behind ADV_CHANNEL. A one-off step: at runtime the
+    advertiser only LISTENs, and without the trigger it re-queries every
+    notify_fallback seconds instead
+    """
+    db = db if db is not None else AdvDatabase()
+    try:
+        db.run(NOTIFY_TRIGGER_SQL, ())
+    finally:
+        db.close()
+    log.info('notify trigger installed', table=ADV_TABLE, channel=ADV_CHANNEL)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Advertiser database setup')
+    parser.add_argument('--install-notify', action='store_true',
+                        help='create the trigger notifying %s on %s' % (ADV_CHANNEL, ADV_TABLE))
+    args = parser.parse_args()
+    logsetup.configure()
+    if args.install_notify:
+        installNotify()
+    else:
+        parser.print_help()
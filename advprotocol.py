@@ -0,0 +1,88 @@
+"""
+Versioned advertisement list protocol.
+
+Every change of the ad list gets a new version. A client receives one
+snapshot and afterwards only the paths added/removed since its version:
+
+    {"type": "snapshot", "epoch": e, "version": 7, "items": [...]}
+    {"type": "delta", "epoch": e, "base": 7, "version": 9, "add": [...], "remove": [...]}
+
+Clients apply a delta by dropping `remove` and appending `add`, which is
+exactly how the server builds its own list, so both stay in the same order.
+A client reconnecting with {"epoch": e, "version": v} gets a single delta
+from v, or a snapshot when v is older than the kept history or belongs to
+an earlier server run (different epoch).
+"""
+
+import itertools
+import time
+from collections import OrderedDict, deque
+
+# histories created in this process: two of them may start in the same ms
+serials = itertools.count()
+
+
+class AdListHistory:
+    def __init__(self, keep=64):
+        self.epoch = '%x.%x' % (int(time.time() * 1000), next(serials))
+        self.version = 0
+        self.items = []
+        self.history = deque(maxlen=keep)  # (version, add, remove)
+
+    def update(self, new_items):
+        """Move to new_items; returns the new version, or None if the set
+        of paths did not change (order-only changes are ignored)
+        """
+        old = set(self.items)
+        new = set(new_items)
+        if old == new:
+            return None
+        add = [x for x in new_items if x not in old]
+        remove = [x for x in self.items if x not in new]
+        removed = set(remove)
+        self.items = [x for x in self.items if x not in removed] + add
+        self.version += 1
+        self.history.append((self.version, add, remove))
+        return self.version
+
+    def snapshot(self):
+        return {'type': 'snapshot', 'epoch': self.epoch, 'version': self.version, 'items': list(self.items)}
+
+    def since(self, version, epoch=None):
+        """Message bringing a client at (epoch, version) up to date, None if
+        it already is
+        """
+        if epoch is not None and epoch != self.epoch:
+            return self.snapshot()
+        if version == self.version:
+            return None
+        if version is None or version > self.version or not self.history \
+                or version < self.history[0][0] - 1:
+            return self.snapshot()
+
+        adds = OrderedDict()
+        removes = OrderedDict()
+        for v, add, remove in self.history:
+            if v <= version:
+                continue
+            for r in remove:
+                adds.pop(r, None)
+                removes[r] = None
+            for a in add:
+                adds[a] = None
+        if len(adds) + len(removes) >= len(self.items):
+            # the delta would not be smaller than a snapshot
+            return self.snapshot()
+        return {'type': 'delta', 'epoch': self.epoch, 'base': version, 'version': self.version,
+                'add': list(adds), 'remove': list(removes)}
+
+
+def applyMessage(items, msg):
+    """Client side: the list after applying a snapshot or delta message
+    """
+    if msg['type'] == 'snapshot':
+        return list(msg['items'])
+    removed = set(msg['remove'])
+    kept = [x for x in items if x not in removed]
+    present = set(kept)
+    return kept + [x for x in msg['add'] if x not in present]
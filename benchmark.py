@@ -0,0 +1,227 @@
+"""
+Microbenchmarks for the player's hot paths, without a display or libVLC:
+a stub `vlc` module (vlcstub) and the offscreen Qt platform are used.
+
+    python benchmark.py [--sizes 100,1000,10000,100000] [--output bench.json]
+
+Covers the content catalog behind Playlist.syncContentHndl/syncEventHndl on
+synthetic trees, configFile lookups, MsgQueueEvt dispatch through the IPC
+reactor (a private System V queue) and the advertiser's list diff and JSON
+serialization. Results are written as JSON so runs on different commits can
+be compared.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import vlcstub
+vlcstub.install()
+
+from PyQt5.QtCore import QCoreApplication
+import sysv_ipc
+
+from advprotocol import AdListHistory
+from catalog import ContentCatalog, scanContEntry
+from ipcreactor import POLICY_ALL, IpcReactor
+from media_player import MsgQueueEvt, Playlist, configFile
+
+DEFAULT_SIZES = (100, 1000, 10000, 100000)
+
+
+def measure(fn, min_time=0.2, min_runs=3, max_runs=100000):
+    """Per-call timings of fn, repeated for at least min_time seconds
+    """
+    times = []
+    deadline = time.perf_counter() + min_time
+    while len(times) < max_runs and (len(times) < min_runs or time.perf_counter() < deadline):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summarize(name, params, times, ops=1):
+    ordered = sorted(times)
+    mean = sum(times) / len(times)
+    return {
+        'name': name,
+        'params': params,
+        'runs': len(times),
+        'mean_s': mean,
+        'median_s': ordered[len(ordered) // 2],
+        'min_s': ordered[0],
+        'p95_s': ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+        'ops_per_s': ops / mean if mean else None,
+    }
+
+
+def buildTree(root, ncid):
+    """Contents/CID-<n>/{Video,Thumbnail} for ncid CIDs and one AID per ten
+    CIDs with three files each, like the shelter layout
+    """
+    adv = os.path.join(root, 'Advertisement')
+    cont = os.path.join(root, 'Contents')
+    for i in range(ncid):
+        video = os.path.join(cont, 'CID-%d' % i, 'Video')
+        thumb = os.path.join(cont, 'CID-%d' % i, 'Thumbnail')
+        os.makedirs(video)
+        os.makedirs(thumb)
+        open(os.path.join(video, 'content.mp4'), 'w').close()
+        open(os.path.join(thumb, 'thumb.jpg'), 'w').close()
+    for i in range(max(1, ncid // 10)):
+        aid = os.path.join(adv, 'AID-%d' % i)
+        os.makedirs(aid)
+        for name in ('a.mp4', 'b.mp4', 'c.jpg'):
+            open(os.path.join(aid, name), 'w').close()
+    return adv + '/', cont + '/'
+
+
+def writeConfig(root, adv, cont):
+    path = os.path.join(root, 'bench_config.ini')
+    with open(path, 'w') as f:
+        f.write('[ADVERTISEMENT]\npath = %s\nmsgqueueid = 1\n\n'
+                '[CONTENTS]\npath = %s\nmsgqueueid = 2\n' % (adv, cont))
+    return path
+
+
+def benchTree(results, ncid):
+    root = tempfile.mkdtemp(prefix='shelter-bench-')
+    try:
+        start = time.perf_counter()
+        adv, cont = buildTree(root, ncid)
+        print('tree of %d CIDs built in %.1f s' % (ncid, time.perf_counter() - start), file=sys.stderr)
+        params = {'cids': ncid}
+
+        catalog = ContentCatalog(adv, cont, watch=False)
+        results.append(summarize('catalog.rescan', params, measure(catalog.rescan, min_time=0, min_runs=1)))
+
+        config = configFile(writeConfig(root, adv, cont))
+        playlist = Playlist(None, config, catalog)
+        cids = [str(random.randrange(ncid)) for i in range(1000)]
+        aids = [str(random.randrange(max(1, ncid // 10))) for i in range(1000)]
+
+        it = iter(cids * 1000)
+        results.append(summarize('Playlist.syncContentHndl', params,
+                                 measure(lambda: playlist.syncContentHndl(next(it)))))
+        it = iter(aids * 1000)
+        results.append(summarize('Playlist.syncEventHndl', params,
+                                 measure(lambda: playlist.syncEventHndl(next(it)))))
+        # what every content event used to cost: a walk of the CID directory
+        it = iter(cids * 1000)
+        results.append(summarize('scanContEntry (per-event walk)', params,
+                                 measure(lambda: scanContEntry(cont + 'CID-' + next(it)))))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def benchConfig(results):
+    root = tempfile.mkdtemp(prefix='shelter-bench-')
+    try:
+        config = configFile(writeConfig(root, '/adv/', '/cont/'))
+        n = 10000
+
+        def lookups():
+            for i in range(n):
+                config.getAdvPath()
+                config.getContPath()
+                config.getAdvMsgQueueID()
+                config.getContMsgQeueID()
+        results.append(summarize('configFile getters', {'lookups': 4 * n}, measure(lookups), ops=4 * n))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def benchQueue(results, count=20000):
+    qid = random.randrange(0x50000000, 0x5fffffff)
+    mq = sysv_ipc.MessageQueue(qid, mode=0o600, flags=sysv_ipc.IPC_CREX)
+    reactor = IpcReactor()
+    evt = MsgQueueEvt(reactor, qid, policy=POLICY_ALL)
+    reactor.start()
+    try:
+        def burst():
+            before = evt.route.received
+            for i in range(count):
+                mq.send(str(i % 1000), type=1)
+            while evt.route.received < before + count:
+                time.sleep(0.0005)
+        times = measure(burst, min_time=0, min_runs=3, max_runs=3)
+        results.append(summarize('MsgQueueEvt dispatch', {'messages': count}, times, ops=count))
+        results[-1]['reactor'] = evt.stats()
+    finally:
+        reactor.stop()
+        mq.remove()
+
+
+def benchAdvertiser(results, sizes):
+    for n in sizes:
+        params = {'ads': n}
+        base = ['/ftp/advertisement/%d/media_%d.mp4' % (i // 10, i) for i in range(n)]
+        changed = base[n // 100:] + ['/ftp/advertisement/new/media_%d.mp4' % i for i in range(n // 100)]
+
+        def diff():
+            history = AdListHistory()
+            history.update(base)
+            history.update(changed)
+        results.append(summarize('AdListHistory.update x2 (1% change)', params, measure(diff)))
+
+        history = AdListHistory()
+        history.update(base)
+        history.update(changed)
+        results.append(summarize('AdListHistory.since (delta)', params, measure(lambda: history.since(1))))
+        results.append(summarize('json.dumps snapshot', params, measure(lambda: json.dumps(history.snapshot()))))
+        results.append(summarize('json.dumps list (legacy payload)', params, measure(lambda: json.dumps(base))))
+
+
+def gitCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='CID directory counts / ad list sizes to run')
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    parser.add_argument('--skip-queue', action='store_true', help='skip the System V queue benchmark')
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+
+    app = QCoreApplication(sys.argv)
+    random.seed(0)
+    results = []
+    for n in sizes:
+        benchTree(results, n)
+    benchConfig(results)
+    if not args.skip_queue:
+        benchQueue(results)
+    benchAdvertiser(results, sizes)
+
+    report = {
+        'commit': gitCommit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'results': results,
+    }
+    out = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(out)
+    else:
+        print(out)
+
+if __name__ == "__main__":
+    main()
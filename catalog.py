@@ -0,0 +1,382 @@
+"""
+In-memory index of the AID-*/CID-* directories under the Advertisement and
+Contents paths, kept current with inotify so event handlers only do a dict
+lookup instead of scanning the tree.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+from time import monotonic
+
+from logsetup import getLogger
+
+log = getLogger('catalog')
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+EVENT_HEADER = struct.Struct('iIII')
+
+ADV = 'AID-'
+CONT = 'CID-'
+THUMBNAIL_DIR = 'Thumbnail'
+
+
+class Inotify:
+    """Minimal ctypes binding for inotify (Linux only)
+    """
+    def __init__(self):
+        libname = ctypes.util.find_library('c')
+        self.libc = ctypes.CDLL(libname, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def addWatch(self, path, mask=WATCH_MASK):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed', path)
+        return wd
+
+    def readEvents(self):
+        """Read every pending event as (wd, mask, name) tuples
+        """
+        events = []
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            off = 0
+            while off < len(buf):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(buf, off)
+                off += EVENT_HEADER.size
+                name = buf[off:off + length].rstrip(b'\0')
+                off += length
+                events.append((wd, mask, os.fsdecode(name)))
+
+    def close(self):
+        os.close(self.fd)
+
+
+def scanAdvEntry(path):
+    """Files of an AID directory, in playback order
+    """
+    try:
+        return tuple(sorted(e.path for e in os.scandir(path) if e.is_file()))
+    except OSError:
+        return None
+
+
+def scanContEntry(path):
+    """First file of every non thumbnail directory under a CID directory
+    (same selection syncContentHndl used to make with os.walk)
+    """
+    if not os.path.isdir(path):
+        return None
+    found = []
+    for p, subdirs, files in os.walk(path):
+        if len(files) > 0 and os.path.basename(p) != THUMBNAIL_DIR:
+            found.append(p + '/' + files[0])
+    return tuple(found)
+
+
+class ContentCatalog:
+    """Index of AID/CID directories.
+
+    The index is built once by rescan() and then maintained incrementally
+    from inotify events on a background thread. Without inotify (or after a
+    kernel queue overflow) the catalog falls back to a full rescan, every
+    `rescanInterval` seconds when watching is unavailable. Directories that
+    could not be watched (max_user_watches reached, say) are rescanned on
+    their own at the same interval, and their watches retried.
+    """
+    def __init__(self, advPath, contPath, watch=True, rescanInterval=30.0, metrics=None):
+        self.roots = {ADV: advPath.rstrip('/') + '/', CONT: contPath.rstrip('/') + '/'}
+        self.index = {ADV: dict(), CONT: dict()}
+        self.lock = threading.Lock()
+        self.watch = watch
+        self.rescanInterval = rescanInterval
+        self.metrics = metrics
+
+        self.inotify = None
+        self.watches = dict()  # wd -> (kind, key or None for root, dir path)
+        self.dirty = set()
+        self.thread = None
+        self.working = False
+        self.wakeup = None
+        # called as listener(kind, key) after an entry changed, and
+        # listener(None, None) after a full rescan (catalog thread)
+        self.listeners = []
+
+        # staleness bookkeeping
+        self.lastRescan = 0.0
+        self.rescanCount = 0
+        self.pendingEvents = 0
+        self.appliedEvents = 0
+        self.overflows = 0
+        self.unwatched = set()  # (kind, key or None for root) without a watch
+        self.watchFailures = 0
+
+    # ---- lookups ----
+    def getAdvFiles(self, aid):
+        return self.lookup(ADV, aid)
+
+    def getContFiles(self, cid):
+        return self.lookup(CONT, cid)
+
+    def lookup(self, kind, key):
+        files = self.index[kind].get(key)
+        if files is None and (self.inotify is None or not self.rescanCount):
+            # not watching, or the first rescan still runs: a miss may simply
+            # be a directory not indexed yet, so index that entry on demand
+            files = self.refreshEntry(kind, key)
+        return files or ()
+
+    def peek(self, kind, key):
+        """Indexed files of an entry, without the on-demand fallback
+        """
+        return self.index[kind].get(key) or ()
+
+    def entries(self, kind):
+        return list(self.index[kind].keys())
+
+    def staleness(self):
+        """How far the index may lag the disk.
+
+        age     : seconds since the last full rescan
+        pending : filesystem events seen but not yet applied to the index
+        watching: False when only periodic rescans keep the index current
+        unwatched: entries (or roots) only periodic rescans keep current
+        """
+        return {
+            'age': monotonic() - self.lastRescan,
+            'pending': self.pendingEvents,
+            'applied': self.appliedEvents,
+            'rescans': self.rescanCount,
+            'overflows': self.overflows,
+            'watching': self.inotify is not None,
+            'unwatched': len(self.unwatched),
+            'watchFailures': self.watchFailures,
+        }
+
+    def addListener(self, listener):
+        self.listeners.append(listener)
+
+    def notify(self, kind, key):
+        for listener in self.listeners:
+            listener(kind, key)
+
+    # ---- indexing ----
+    def entryPath(self, kind, key):
+        return self.roots[kind] + kind + key
+
+    def scanEntry(self, kind, key):
+        path = self.entryPath(kind, key)
+        if kind == ADV:
+            return scanAdvEntry(path)
+        return scanContEntry(path)
+
+    def refreshEntry(self, kind, key):
+        files = self.scanEntry(kind, key)
+        with self.lock:
+            if files is None:
+                self.index[kind].pop(key, None)
+            else:
+                self.index[kind][key] = files
+        if files is None:
+            self.unwatched.discard((kind, key))
+        if files is not None and self.inotify is not None:
+            self.watchEntry(kind, key)
+        self.notify(kind, key)
+        return files
+
+    def rescan(self):
+        """Full rescan of both trees, replacing the whole index
+        """
+        start = monotonic()
+        fresh = {ADV: dict(), CONT: dict()}
+        for kind, root in self.roots.items():
+            try:
+                names = [e.name for e in os.scandir(root) if e.is_dir() and e.name.startswith(kind)]
+            except OSError:
+                names = []
+            for name in names:
+                key = name[len(kind):]
+                files = self.scanEntry(kind, key)
+                if files is not None:
+                    fresh[kind][key] = files
+        with self.lock:
+            self.index = fresh
+            self.dirty.clear()
+            self.pendingEvents = 0
+            self.appliedEvents = 0
+        self.lastRescan = monotonic()
+        self.rescanCount += 1
+        if self.metrics is not None:
+            self.metrics.observe('shelter_catalog_scan_seconds', self.lastRescan - start)
+        if self.inotify is not None:
+            self.watchAll()
+        self.notify(None, None)
+
+    # ---- inotify ----
+    def addWatch(self, path, kind, key):
+        try:
+            wd = self.inotify.addWatch(path)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return  # already gone, its parent's watch reports that
+            # ENOSPC: fs.inotify.max_user_watches reached
+            self.watchFailures += 1
+            if (kind, key) not in self.unwatched:
+                log.warning('cannot watch directory, rescanned periodically', path=path, error=e)
+            self.unwatched.add((kind, key))
+            return
+        self.watches[wd] = (kind, key, path)
+
+    def watchEntry(self, kind, key):
+        """Watch the directories of an entry; it stays in `unwatched` while
+        one of them cannot be watched
+        """
+        failures = self.watchFailures
+        path = self.entryPath(kind, key)
+        self.addWatch(path, kind, key)
+        if kind == CONT:
+            for p, subdirs, files in os.walk(path):
+                # thumbnails/posters never change the entry
+                subdirs[:] = [d for d in subdirs if d != THUMBNAIL_DIR]
+                for d in subdirs:
+                    self.addWatch(os.path.join(p, d), kind, key)
+        if self.watchFailures == failures:
+            self.unwatched.discard((kind, key))
+
+    def watchAll(self):
+        self.unwatched = set()
+        for kind, root in self.roots.items():
+            self.addWatch(root, kind, None)
+            for key in list(self.index[kind].keys()):
+                self.watchEntry(kind, key)
+
+    def handleEvent(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            self.overflows += 1
+            return True
+        target = self.watches.get(wd)
+        if target is None:
+            return False
+        if mask & IN_IGNORED:
+            del self.watches[wd]
+            return False
+        kind, key, path = target
+        if key is None:
+            # event in a root directory: an entry appeared or went away
+            if not (mask & IN_ISDIR) or not name.startswith(kind):
+                return False
+            key = name[len(kind):]
+        self.dirty.add((kind, key))
+        self.pendingEvents += 1
+        return False
+
+    def rescanUnwatched(self):
+        """Periodic stand-in for the watches that could not be added
+        """
+        unwatched = list(self.unwatched)
+        if any(key is None for kind, key in unwatched):
+            # a root without a watch: new entries only show up in a full rescan
+            self.rescan()
+            return
+        for kind, key in unwatched:
+            if self.scanEntry(kind, key) != self.index[kind].get(key):
+                self.refreshEntry(kind, key)
+            else:
+                # unchanged: only try the watch again
+                self.watchEntry(kind, key)
+
+    def applyDirty(self):
+        dirty, self.dirty = self.dirty, set()
+        for kind, key in dirty:
+            self.refreshEntry(kind, key)
+        self.appliedEvents += self.pendingEvents
+        self.pendingEvents = 0
+
+    def start(self):
+        """Build the index and keep it current, both in the background:
+        listeners get (None, None) once the first rescan is done
+        """
+        if self.watch:
+            try:
+                self.inotify = Inotify()
+            except (OSError, AttributeError):
+                self.inotify = None
+        self.working = True
+        self.wakeup = os.pipe()
+        self.thread = threading.Thread(target=self.run, name='ContentCatalog', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.working = False
+        if self.wakeup is not None:
+            os.write(self.wakeup[1], b'x')
+        if self.thread is not None:
+            self.thread.join()
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+    def run(self):
+        # not on the caller's thread: the first frame does not wait for the walk
+        self.rescan()
+        fds = [self.wakeup[0]]
+        if self.inotify is not None:
+            fds.append(self.inotify.fd)
+        nextRescan = monotonic() + self.rescanInterval
+        while self.working:
+            timeout = None
+            if self.inotify is None or self.unwatched:
+                timeout = max(0.0, nextRescan - monotonic())
+            else:
+                nextRescan = monotonic() + self.rescanInterval
+            ready, _, _ = select.select(fds, [], [], timeout)
+            if not self.working:
+                break
+            if timeout is not None and monotonic() >= nextRescan:
+                nextRescan = monotonic() + self.rescanInterval
+                if self.inotify is None:
+                    # no inotify: periodic fallback rescan
+                    self.rescan()
+                    continue
+                self.rescanUnwatched()
+            if self.inotify is None or self.inotify.fd not in ready:
+                continue
+            overflow = False
+            for wd, mask, name in self.inotify.readEvents():
+                overflow = self.handleEvent(wd, mask, name) or overflow
+            if overflow:
+                self.rescan()
+            else:
+                self.applyDirty()
+        os.close(self.wakeup[0])
+        os.close(self.wakeup[1])
+        self.wakeup = None
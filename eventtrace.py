@@ -0,0 +1,42 @@
+"""
+Opt-in event trace for latency measurement.
+
+When SHELTER_TRACE_SOCKET names a Unix datagram socket (bound by
+loadgen.py), the player sends one JSON datagram per traced step:
+
+    {"ev": "dispatch", "t": ..., "queue": 3880, "value": "12"}
+    {"ev": "open",     "t": ..., "path": "..."}
+    {"ev": "playing",  "t": ..., "path": "..."}
+
+`t` is time.monotonic(), which is system wide on Linux, so it compares
+directly with the load generator's send timestamps. Sending never blocks
+and is silently skipped while nobody listens.
+"""
+
+import json
+import os
+import socket
+from time import monotonic
+
+TRACE_ENV = 'SHELTER_TRACE_SOCKET'
+
+
+class Tracer:
+    def __init__(self, path):
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.dropped = 0
+
+    @classmethod
+    def fromEnv(cls):
+        path = os.environ.get(TRACE_ENV)
+        return cls(path) if path else None
+
+    def emit(self, ev, t=None, **fields):
+        fields['ev'] = ev
+        fields['t'] = monotonic() if t is None else t
+        try:
+            self.sock.sendto(json.dumps(fields).encode(), self.path)
+        except OSError:
+            self.dropped += 1
@@ -0,0 +1,308 @@
+"""
+One IPC reactor serving every configured message queue.
+
+Messages arrive from System V message queues (the IDLE page's transport)
+and, optionally, from Unix-domain datagram sockets carrying the same message
+body. The reactor thread coalesces bursts per queue, calls the handler
+registered for that queue and keeps per-queue counters and latency stats.
+
+System V queues have no file descriptor to select() on, so each one is
+read by a small daemon pump that blocks in receive() and hands batches to
+the reactor; stop() unblocks the pumps with a reserved message type.
+"""
+
+import os
+import selectors
+import socket
+import threading
+from collections import deque
+from time import monotonic
+
+import sysv_ipc
+
+from logsetup import getLogger
+
+log = getLogger('ipcreactor')
+
+# queue burst policies
+POLICY_ALL = 'all'            # dispatch every message, minus repeated duplicates
+POLICY_LATEST = 'latest'      # dispatch only the last message of a burst
+POLICY_DEBOUNCE = 'debounce'  # like latest, once the queue stays quiet for a while
+
+# message type used to wake pumps on shutdown
+STOP_MTYPE = 0x7ffffff0
+
+MAX_DATAGRAM = 4096
+
+
+def coalesce(values, policy):
+    """Reduce a drained burst of queue values to the ones worth dispatching
+    """
+    if policy in (POLICY_LATEST, POLICY_DEBOUNCE):
+        return values[-1:]
+    kept = []
+    for v in values:
+        if not kept or kept[-1] != v:
+            kept.append(v)
+    return kept
+
+
+def decodeId(raw):
+    """Default message type: the decimal AID/CID sent by the IDLE page
+    """
+    return str(int(raw))
+
+
+class LatencyStats:
+    """Arrival-to-dispatch latency of one queue, in seconds
+    """
+    def __init__(self, keep=1000):
+        self.samples = deque(maxlen=keep)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(p / 100.0 * len(ordered)))]
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'max': self.max,
+        }
+
+
+class QueueRoute:
+    """Handler, decoder, policy and counters of one queue id
+    """
+    def __init__(self, qid, handler, decode, policy, debounce):
+        self.qid = qid
+        self.handler = handler
+        self.decode = decode
+        self.policy = policy
+        self.debounce = debounce / 1000.0
+        self.held = []          # (value, arrival) waiting for the debounce window
+        self.deadline = None
+        self.received = 0
+        self.coalesced = 0
+        self.dispatched = 0
+        self.errors = 0
+        self.latency = LatencyStats()
+
+    def stats(self):
+        return {
+            'received': self.received,
+            'coalesced': self.coalesced,
+            'dispatched': self.dispatched,
+            'errors': self.errors,
+            'latency': self.latency.summary(),
+        }
+
+
+class SysVPump(threading.Thread):
+    def __init__(self, reactor, qid):
+        super().__init__(name='SysVPump-%d' % qid, daemon=True)
+        self.reactor = reactor
+        self.qid = qid
+        self.mq = sysv_ipc.MessageQueue(qid, mode=0o660, flags=sysv_ipc.IPC_CREAT)
+
+    def run(self):
+        while True:
+            batch = [self.mq.receive(type=0)]
+            while True:
+                try:
+                    batch.append(self.mq.receive(block=False, type=0))
+                except sysv_ipc.BusyError:
+                    break
+            if not self.reactor.working:
+                return
+            now = monotonic()
+            self.reactor.post(self.qid, [(raw, now) for raw, mtype in batch if mtype != STOP_MTYPE])
+
+    def wake(self):
+        self.mq.send(b'', block=False, type=STOP_MTYPE)
+
+
+class IpcReactor:
+    """Multiplexes all queues onto one dispatch thread.
+
+    register() a handler per queue id, optionally addSocket() a Unix-domain
+    transport for it, then start(). Handlers run on the reactor thread.
+    """
+    def __init__(self, socketDir=None, metrics=None):
+        self.socketDir = socketDir
+        self.metrics = metrics
+        self.routes = dict()
+        self.pumps = []
+        self.sockets = []
+        self.selector = selectors.DefaultSelector()
+        self.inbox = deque()
+        self.wakeR, self.wakeW = socket.socketpair()
+        self.wakeR.setblocking(False)
+        self.wakeW.setblocking(False)
+        self.selector.register(self.wakeR, selectors.EVENT_READ, None)
+        self.thread = None
+        self.working = False
+
+    def register(self, qid, handler, decode=decodeId, policy=POLICY_LATEST, debounce=0, sysv=True):
+        qid = int(qid)
+        self.routes[qid] = QueueRoute(qid, handler, decode, policy, debounce)
+        if sysv:
+            self.pumps.append(SysVPump(self, qid))
+        if self.socketDir:
+            self.addSocket(qid, os.path.join(self.socketDir, '%d.sock' % qid))
+        return self.routes[qid]
+
+    def addSocket(self, qid, path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(path)
+        os.chmod(path, 0o660)
+        sock.setblocking(False)
+        self.selector.register(sock, selectors.EVENT_READ, int(qid))
+        self.sockets.append((sock, path))
+
+    def setPolicy(self, qid, policy, debounce=0):
+        """Change the burst policy of a registered queue; messages held for
+        a debounce window are dispatched by the new policy's rules
+        """
+        route = self.routes[int(qid)]
+        route.policy = policy
+        route.debounce = debounce / 1000.0
+        if policy != POLICY_DEBOUNCE and route.held:
+            route.deadline = monotonic()
+            self.post(None, [])
+
+    def post(self, qid, batch):
+        """Hand a batch of (raw message, arrival time) over to the reactor
+        thread; safe to call from any thread
+        """
+        self.inbox.append((qid, batch))
+        try:
+            self.wakeW.send(b'x')
+        except BlockingIOError:
+            pass  # wake-up already pending
+
+    def stats(self, qid=None):
+        if qid is not None:
+            return self.routes[int(qid)].stats()
+        return {qid: route.stats() for qid, route in self.routes.items()}
+
+    def start(self):
+        self.working = True
+        self.thread = threading.Thread(target=self.run, name='IpcReactor', daemon=True)
+        self.thread.start()
+        for pump in self.pumps:
+            pump.start()
+
+    def stop(self):
+        self.working = False
+        for pump in self.pumps:
+            pump.wake()
+        self.post(None, [])
+        if self.thread is not None:
+            self.thread.join()
+        for pump in self.pumps:
+            pump.join(1.0)
+        for sock, path in self.sockets:
+            self.selector.unregister(sock)
+            sock.close()
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        self.sockets = []
+
+    # ---- reactor thread ----
+    def nextTimeout(self):
+        deadlines = [r.deadline for r in self.routes.values() if r.deadline is not None]
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - monotonic())
+
+    def run(self):
+        while self.working:
+            for key, mask in self.selector.select(self.nextTimeout()):
+                if key.data is None:
+                    try:
+                        while self.wakeR.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    self.readSocket(key.fileobj, key.data)
+            while self.inbox:
+                qid, batch = self.inbox.popleft()
+                if qid is not None and batch:
+                    self.accept(qid, batch)
+            self.flushDue()
+
+    def readSocket(self, sock, qid):
+        batch = []
+        while True:
+            try:
+                raw = sock.recv(MAX_DATAGRAM)
+            except BlockingIOError:
+                break
+            batch.append((raw, monotonic()))
+        if batch:
+            self.accept(qid, batch)
+
+    def accept(self, qid, batch):
+        route = self.routes.get(qid)
+        if route is None:
+            return
+        values = []
+        for raw, arrival in batch:
+            try:
+                values.append((route.decode(raw), arrival))
+            except ValueError:
+                route.errors += 1
+        route.received += len(batch)
+        if route.policy == POLICY_DEBOUNCE:
+            route.held.extend(values)
+            route.deadline = monotonic() + route.debounce
+            return
+        self.dispatch(route, values)
+
+    def flushDue(self):
+        now = monotonic()
+        for route in self.routes.values():
+            if route.deadline is not None and route.deadline <= now:
+                held, route.held, route.deadline = route.held, [], None
+                self.dispatch(route, held)
+
+    def dispatch(self, route, values):
+        kept = coalesce([v for v, arrival in values], route.policy)
+        route.coalesced += len(values) - len(kept)
+        if not kept:
+            return
+        # latency is measured from the arrival of the message that won
+        arrivals = {v: arrival for v, arrival in values}
+        for v in kept:
+            try:
+                route.handler(v)
+            except Exception as e:
+                route.errors += 1
+                log.error('ipc handler failed', queue=route.qid, value=v, error=e)
+                continue
+            route.dispatched += 1
+            latency = monotonic() - arrivals[v]
+            route.latency.add(latency)
+            if self.metrics is not None:
+                self.metrics.observe('shelter_queue_latency_seconds', latency, queue=route.qid)
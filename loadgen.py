@@ -0,0 +1,254 @@
+"""
+Event-to-first-frame load generator for the IDLE page queues.
+
+Pushes synthetic AID/CID events into the System V queues (or the IPC
+reactor's Unix sockets) at a configurable rate and burst pattern, or
+replays a recorded trace, while collecting the player's event trace
+(see eventtrace.py). Each sent event is matched to the player's dispatch,
+open_file and first Playing event, and the report gives p50/p95/p99
+latencies plus how many events were coalesced or dropped.
+
+Headless run under Xvfb with a dummy VLC output:
+
+    Xvfb :99 &
+    DISPLAY=:99 SHELTER_VLC_ARGS="--vout=dummy --aout=dummy" \\
+        SHELTER_TRACE_SOCKET=/tmp/shelter-trace.sock python media_player.py &
+    python loadgen.py --queue 3880 --ids 1,2,3 --rate 2 --count 100
+
+Trace files (--record / --replay) are JSON lines {"t": offset s, "queue": id, "id": "12"}.
+"""
+
+import argparse
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from time import monotonic
+
+from eventtrace import TRACE_ENV
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100.0 * len(ordered)))]
+
+
+def latencySummary(values):
+    ms = [v * 1000 for v in values]
+    return {
+        'count': len(ms),
+        'mean_ms': sum(ms) / len(ms) if ms else None,
+        'p50_ms': percentile(ms, 50),
+        'p95_ms': percentile(ms, 95),
+        'p99_ms': percentile(ms, 99),
+        'max_ms': max(ms) if ms else None,
+    }
+
+
+# ---- schedules: lists of (offset seconds, queue id, event id) ----
+def synthetic(queues, ids, rate, count, burst, poisson, seed):
+    rng = random.Random(seed)
+    events = []
+    t = 0.0
+    while len(events) < count:
+        for i in range(min(burst, count - len(events))):
+            events.append((t, rng.choice(queues), rng.choice(ids)))
+        gap = burst / rate
+        t += rng.expovariate(1.0 / gap) if poisson else gap
+    return events
+
+
+def loadTrace(path):
+    events = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                rec = json.loads(line)
+                events.append((float(rec['t']), int(rec['queue']), str(rec['id'])))
+    events.sort(key=lambda e: e[0])
+    return events
+
+
+def saveTrace(path, events):
+    with open(path, 'w') as f:
+        for t, queue, value in events:
+            f.write(json.dumps({'t': t, 'queue': queue, 'id': value}) + '\n')
+
+
+# ---- transports ----
+class SysVSender:
+    def __init__(self):
+        import sysv_ipc
+        self.sysv_ipc = sysv_ipc
+        self.queues = dict()
+
+    def send(self, queue, value):
+        mq = self.queues.get(queue)
+        if mq is None:
+            mq = self.queues[queue] = self.sysv_ipc.MessageQueue(queue, mode=0o660, flags=self.sysv_ipc.IPC_CREAT)
+        mq.send(value.encode(), type=1)
+
+
+class UnixSender:
+    def __init__(self, socketDir):
+        self.socketDir = socketDir
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    def send(self, queue, value):
+        self.sock.sendto(value.encode(), os.path.join(self.socketDir, '%d.sock' % queue))
+
+
+class TraceCollector(threading.Thread):
+    def __init__(self, path):
+        super().__init__(name='TraceCollector', daemon=True)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(path)
+        self.sock.settimeout(0.2)
+        self.records = []
+        self.working = True
+
+    def run(self):
+        while self.working:
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                continue
+            self.records.append(json.loads(data))
+
+    def stop(self):
+        self.working = False
+        self.join()
+        self.sock.close()
+        os.unlink(self.path)
+
+
+def run(events, sender):
+    """Send events on schedule; returns [(send time, queue, id)]
+    """
+    sent = []
+    start = monotonic() + 0.1
+    for offset, queue, value in events:
+        delay = start + offset - monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        t = monotonic()
+        sender.send(queue, value)
+        sent.append((t, queue, value))
+    return sent
+
+
+def analyze(sent, records):
+    dispatches = sorted((r for r in records if r['ev'] == 'dispatch'), key=lambda r: r['t'])
+    opens = sorted((r for r in records if r['ev'] == 'open'), key=lambda r: r['t'])
+    playings = sorted((r for r in records if r['ev'] == 'playing'), key=lambda r: r['t'])
+
+    # each dispatch answers the latest not yet answered send of the same
+    # queue/value sent before it
+    matched = dict()  # send index -> dispatch record
+    for d in dispatches:
+        candidates = [i for i, (t, q, v) in enumerate(sent)
+                      if q == d['queue'] and v == d['value'] and t <= d['t'] and i not in matched]
+        if candidates:
+            matched[candidates[-1]] = d
+
+    toOpen, toFrame = [], []
+    noFrame = 0
+    dispatchTimes = [d['t'] for d in dispatches]
+    for i, d in matched.items():
+        later = [t for t in dispatchTimes if t > d['t']]
+        until = later[0] if later else float('inf')
+        opened = [o for o in opens if d['t'] <= o['t'] < until]
+        if opened:
+            toOpen.append(opened[0]['t'] - sent[i][0])
+        paths = set(o['path'] for o in opened)
+        frame = next((p for p in playings if p['t'] >= d['t'] and p['path'] in paths), None)
+        if frame is None:
+            noFrame += 1
+        else:
+            toFrame.append(frame['t'] - sent[i][0])
+
+    coalesced = dropped = 0
+    for i, (t, q, v) in enumerate(sent):
+        if i in matched:
+            continue
+        # superseded by a later event on the same queue that went through
+        if any(j > i and sent[j][1] == q for j in matched):
+            coalesced += 1
+        else:
+            dropped += 1
+
+    return {
+        'sent': len(sent),
+        'dispatched': len(matched),
+        'coalesced': coalesced,
+        'dropped': dropped,
+        'no_frame': noFrame,
+        'event_to_open': latencySummary(toOpen),
+        'event_to_first_frame': latencySummary(toFrame),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queue', type=int, action='append', help='queue id (repeatable), default 3880')
+    parser.add_argument('--ids', default='1', help='comma separated AID/CID values to send')
+    parser.add_argument('--rate', type=float, default=1.0, help='events per second')
+    parser.add_argument('--count', type=int, default=50, help='events to send')
+    parser.add_argument('--burst', type=int, default=1, help='events sent back to back per tick')
+    parser.add_argument('--poisson', action='store_true', help='exponential instead of fixed gaps')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--replay', help='send the events of a recorded trace file instead')
+    parser.add_argument('--record', help='write the schedule that was sent to this trace file')
+    parser.add_argument('--transport', choices=('sysv', 'unix'), default='sysv')
+    parser.add_argument('--socket-dir', help='IPC socket directory for --transport unix')
+    parser.add_argument('--trace-socket', default=os.environ.get(TRACE_ENV, '/tmp/shelter-trace.sock'),
+                        help='socket the player sends its trace to (%s)' % TRACE_ENV)
+    parser.add_argument('--settle', type=float, default=5.0, help='seconds to wait for frames after the last send')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    if args.replay:
+        events = loadTrace(args.replay)
+    else:
+        queues = args.queue or [3880]
+        ids = [v.strip() for v in args.ids.split(',') if v.strip()]
+        events = synthetic(queues, ids, args.rate, args.count, args.burst, args.poisson, args.seed)
+    if args.record:
+        saveTrace(args.record, events)
+
+    if args.transport == 'unix':
+        if not args.socket_dir:
+            parser.error('--transport unix needs --socket-dir')
+        sender = UnixSender(args.socket_dir)
+    else:
+        sender = SysVSender()
+
+    collector = TraceCollector(args.trace_socket)
+    collector.start()
+    print('sending %d events' % len(events), file=sys.stderr)
+    sent = run(events, sender)
+    time.sleep(args.settle)
+    collector.stop()
+
+    report = analyze(sent, collector.records)
+    report['schedule'] = {'replay': args.replay, 'rate': args.rate, 'burst': args.burst,
+                          'poisson': args.poisson, 'transport': args.transport}
+    out = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(out)
+    else:
+        print(out)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""
+Logging for the player and the advertiser, configured from the [LOGGING]
+section of media_config.ini.
+
+Records carry key=value fields next to a short constant message
+
+    log = getLogger('advertiser')
+    log.info('broadcast', clients=12, ms=3.1, evicted=0)
+
+    2026-10-18T09:12:03.512 level=info logger=advertiser msg=broadcast clients=12 ms=3.1 evicted=0
+
+and are only queued by the calling thread: a listener thread formats and
+writes them, so a slow tty or journald never blocks the Qt thread or the
+asyncio loop. When the queue is full, records are dropped (and counted)
+rather than waited for. Repeats of one message are rate limited per
+logger and message; the next record let through reports how many were
+suppressed.
+"""
+
+import atexit
+import configparser
+import copy
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from collections import namedtuple
+
+LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+    'critical': logging.CRITICAL,
+}
+
+# [LOGGING]: root level, per logger levels, output (stderr or a file path),
+# records per second and burst per message (0 = unlimited), queue length
+LogSettings = namedtuple('LogSettings', ['level', 'modules', 'output', 'rate', 'burst', 'queueSize'])
+
+DEFAULTS = LogSettings('info', {}, 'stderr', 5.0, 20, 10000)
+
+
+def parseSettings(filename='media_config.ini'):
+    """LogSettings of filename's [LOGGING] section; the defaults when the
+    file or section is missing. Entries that do not parse are logged and
+    replaced by their default; a file that does not parse raises
+    configparser.Error.
+    """
+    prop = configparser.ConfigParser()
+    prop.read(filename)
+    if not prop.has_section('LOGGING'):
+        return DEFAULTS
+    section = prop['LOGGING']
+    modules = dict()
+    for item in section.get('modules', '').split(','):
+        if not item.strip():
+            continue
+        name, sep, level = item.partition(':')
+        level = level.strip().lower()
+        if not sep or not name.strip() or level not in LEVELS:
+            log.warning('bad [LOGGING] modules entry skipped', entry=item.strip())
+            continue
+        modules[name.strip()] = level
+    level = section.get('level', DEFAULTS.level).lower()
+    if level not in LEVELS:
+        log.warning('bad [LOGGING] level ignored', value=level)
+        level = DEFAULTS.level
+    return LogSettings(
+        level=level,
+        modules=modules,
+        output=section.get('output', DEFAULTS.output) or DEFAULTS.output,
+        rate=number(section, 'ratelimit', section.getfloat, DEFAULTS.rate),
+        burst=number(section, 'burst', section.getint, DEFAULTS.burst),
+        queueSize=number(section, 'queuesize', section.getint, DEFAULTS.queueSize),
+    )
+
+
+def number(section, key, get, default):
+    try:
+        return get(key, default)
+    except ValueError:
+        log.warning('bad [LOGGING] value ignored', key=key, value=section.get(key))
+        return default
+
+
+def formatValue(value):
+    text = str(value)
+    if not text or any(c in text for c in ' "=\n\t'):
+        return '"%s"' % text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return text
+
+
+class KeyValueFormatter(logging.Formatter):
+    def format(self, record):
+        stamp = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created))
+        parts = ['%s.%03d' % (stamp, record.msecs),
+                 'level=' + record.levelname.lower(),
+                 'logger=' + record.name,
+                 'msg=' + formatValue(record.getMessage())]
+        for key, value in getattr(record, 'fields', {}).items():
+            parts.append('%s=%s' % (key, formatValue(value)))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            parts.append('exc=' + formatValue(record.exc_text))
+        return ' '.join(parts)
+
+
+class FieldsAdapter(logging.LoggerAdapter):
+    """log.info(msg, key=value, ...): keyword arguments become fields
+    """
+    RESERVED = ('exc_info', 'stack_info', 'stacklevel', 'extra')
+
+    def process(self, msg, kwargs):
+        fields = {k: kwargs.pop(k) for k in list(kwargs) if k not in self.RESERVED}
+        kwargs['extra'] = dict(kwargs.get('extra') or {}, fields=fields)
+        return msg, kwargs
+
+
+def getLogger(name):
+    return FieldsAdapter(logging.getLogger(name), {})
+
+
+log = getLogger('logsetup')
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per (logger, message template): `rate` records a second
+    with bursts of `burst`. Warnings and errors are limited as well, a
+    failing handler in a loop is exactly what floods a log.
+    """
+    MAX_KEYS = 4096
+
+    def __init__(self, rate, burst):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.buckets = dict()  # key -> [tokens, last refill, suppressed]
+
+    def filter(self, record):
+        if self.rate <= 0:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.MAX_KEYS:
+                    self.buckets.clear()
+                bucket = self.buckets[key] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+        if suppressed:
+            record.fields = dict(getattr(record, 'fields', {}), suppressed=suppressed)
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Never blocks the caller: a full queue drops the record
+    """
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # merge the arguments now, they may change before the listener
+        # runs; the traceback stays apart for the exc field
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class LogService:
+    """The queue handler on the root logger and the listener thread
+    writing its records
+    """
+    def __init__(self, settings):
+        if settings.output == 'stderr':
+            target = logging.StreamHandler()
+        else:
+            target = logging.FileHandler(settings.output)
+        target.setFormatter(KeyValueFormatter())
+        self.handler = DroppingQueueHandler(queue.Queue(settings.queueSize))
+        self.limiter = RateLimitFilter(settings.rate, settings.burst)
+        self.handler.addFilter(self.limiter)
+        self.listener = logging.handlers.QueueListener(self.handler.queue, target)
+        self.listener.start()
+        self.settings = None
+        self.apply(settings)
+
+    def apply(self, settings):
+        """Levels and rate limits of settings; the output stays as started
+        """
+        root = logging.getLogger()
+        root.setLevel(LEVELS.get(settings.level, logging.INFO))
+        previous = self.settings.modules if self.settings is not None else {}
+        for name in previous:
+            if name not in settings.modules:
+                logging.getLogger(name).setLevel(logging.NOTSET)
+        for name, level in settings.modules.items():
+            logging.getLogger(name).setLevel(LEVELS.get(level, logging.INFO))
+        self.limiter.rate = settings.rate
+        self.limiter.burst = settings.burst
+        self.settings = settings
+
+    def stats(self):
+        return {'queued': self.handler.queue.qsize(), 'dropped': self.handler.dropped}
+
+    def stop(self):
+        self.listener.stop()
+
+
+service = None
+
+
+def configure(filename='media_config.ini'):
+    """Start queued logging from filename's [LOGGING] section, or re-apply
+    its levels and rate limits when it already runs
+    """
+    global service
+    try:
+        settings = parseSettings(filename)
+    except configparser.Error as e:
+        log.warning('logging settings unreadable', file=filename, error=e)
+        if service is not None:
+            return service  # keep the current ones
+        settings = DEFAULTS
+    if service is not None:
+        service.apply(settings)
+        return service
+    service = LogService(settings)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(service.handler)
+    atexit.register(shutdown)
+    return service
+
+
+def shutdown():
+    """Write out what is still queued
+    """
+    global service
+    if service is not None:
+        service.stop()
+        service = None
@@ -0,0 +1,229 @@
+"""
+Persistent media manifest.
+
+A SQLite file keyed by path with the mtime and size each entry was probed
+at, holding duration, title, codecs and resolution. The player loads it at
+startup instead of parsing media while playing; the scanner re-probes only
+new or changed files, with a process pool.
+
+Offline / cron use:
+
+    python manifest.py [media_config.ini]
+"""
+
+import multiprocessing
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from catalog import THUMBNAIL_DIR
+from logsetup import getLogger
+
+log = getLogger('manifest')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS media (
+    path     TEXT PRIMARY KEY,
+    mtime    INTEGER NOT NULL,
+    size     INTEGER NOT NULL,
+    duration INTEGER,
+    title    TEXT,
+    vcodec   TEXT,
+    acodec   TEXT,
+    width    INTEGER,
+    height   INTEGER,
+    tracks   INTEGER,
+    probed   REAL
+)
+'''
+
+COLUMNS = ('path', 'mtime', 'size', 'duration', 'title', 'vcodec', 'acodec',
+           'width', 'height', 'tracks', 'probed')
+
+ManifestEntry = namedtuple('ManifestEntry', COLUMNS)
+
+PROBE_TIMEOUT = 5000  # ms
+
+
+def fourcc(code):
+    return struct.pack('<I', code).decode('ascii', 'replace').strip()
+
+
+# ---- probing, runs in the pool's worker processes ----
+probeInstance = None
+
+def initProbe():
+    global probeInstance
+    import vlc
+    probeInstance = vlc.Instance('--quiet', '--no-video', '--aout=dummy')
+
+
+def probe(path, mtime, size):
+    """ManifestEntry of path; None when the parse did not finish
+    """
+    import vlc
+    media = probeInstance.media_new(path)
+    done = threading.Event()
+    vlc.libvlc_media_event_manager(media).event_attach(vlc.EventType.MediaParsedChanged, lambda e: done.set())
+    media.parse_with_options(vlc.MediaParseFlag.local, PROBE_TIMEOUT)
+    done.wait(PROBE_TIMEOUT / 1000.0 + 1)
+
+    if media.get_parsed_status() != vlc.MediaParsedStatus.done:
+        # timed out or failed (a slow share, say): nothing is known yet
+        media.release()
+        return None
+    vcodec = acodec = width = height = None
+    ntracks = 0
+    for t in media.tracks_get() or ():
+        ntracks += 1
+        kind = int(getattr(t.type, 'value', t.type))
+        if kind == vlc.TrackType.video.value and vcodec is None:
+            vcodec = fourcc(t.codec)
+            video = getattr(t, 'u', t).video.contents
+            width, height = video.width, video.height
+        elif kind == vlc.TrackType.audio.value and acodec is None:
+            acodec = fourcc(t.codec)
+    entry = ManifestEntry(path, mtime, size, media.get_duration(), media.get_meta(vlc.Meta.Title),
+                          vcodec, acodec, width, height, ntracks, time.time())
+    media.release()
+    return entry
+
+
+def walkMedia(roots):
+    """(path, mtime_ns, size) of every media file under roots
+    """
+    for root in roots:
+        for p, subdirs, files in os.walk(root):
+            if os.path.basename(p) == THUMBNAIL_DIR:
+                subdirs[:] = []
+                continue
+            for name in files:
+                path = os.path.join(p, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, st.st_mtime_ns, st.st_size
+
+
+class Manifest:
+    def __init__(self, dbPath):
+        self.dbPath = dbPath
+        self.entries = dict()
+        self.lock = threading.Lock()
+
+    def connect(self):
+        db = sqlite3.connect(self.dbPath)
+        db.execute(SCHEMA)
+        return db
+
+    def load(self):
+        db = self.connect()
+        rows = db.execute('SELECT %s FROM media' % ', '.join(COLUMNS)).fetchall()
+        db.close()
+        with self.lock:
+            self.entries = {row[0]: ManifestEntry(*row) for row in rows}
+        return self
+
+    def get(self, path):
+        """Entry of path if the file has not changed since it was probed
+        """
+        entry = self.entries.get(path)
+        if entry is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if st.st_mtime_ns != entry.mtime or st.st_size != entry.size:
+            return None
+        return entry
+
+    def duration(self, path):
+        """Probed duration in ms, None when unknown
+        """
+        entry = self.entries.get(path)
+        if entry is None or entry.duration is None or entry.duration < 0:
+            return None
+        return entry.duration
+
+    def playable(self, path):
+        """False only for files the probe found no track in
+        """
+        entry = self.entries.get(path)
+        return entry is None or entry.tracks > 0
+
+    def scan(self, roots, workers=None):
+        """Re-probe new/changed files under roots and forget removed ones.
+        Returns (probed, removed) counts.
+        """
+        found = {path: (mtime, size) for path, mtime, size in walkMedia(roots)}
+        stale = [(path, mtime, size) for path, (mtime, size) in found.items()
+                 if path not in self.entries
+                 or (self.entries[path].mtime, self.entries[path].size) != (mtime, size)]
+        removed = [path for path in self.entries if path not in found]
+
+        probed = []
+        unknown = []  # not probed this time: forgotten, so tried again next scan
+        if stale:
+            # spawn, not fork: the player process is multi-threaded (Qt, libVLC)
+            ctx = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=initProbe) as pool:
+                futures = [pool.submit(probe, *args) for args in stale]
+                for (path, mtime, size), future in zip(stale, futures):
+                    try:
+                        entry = future.result()
+                    except Exception as e:
+                        log.warning('probe failed', path=path, error=e)
+                        entry = None
+                    if entry is None:
+                        unknown.append(path)
+                    else:
+                        probed.append(entry)
+            if unknown:
+                log.warning('probe incomplete, retried next scan', files=len(unknown))
+        forget = removed + [path for path in unknown if path in self.entries]
+
+        db = self.connect()
+        with db:
+            db.executemany('INSERT OR REPLACE INTO media VALUES (%s)' % ', '.join('?' * len(COLUMNS)), probed)
+            db.executemany('DELETE FROM media WHERE path = ?', [(p,) for p in forget])
+        db.close()
+        with self.lock:
+            entries = dict(self.entries)
+            for entry in probed:
+                entries[entry.path] = entry
+            for path in forget:
+                entries.pop(path, None)
+            self.entries = entries
+        return len(probed), len(removed)
+
+    def scanInBackground(self, roots, done=None):
+        def run():
+            start = time.monotonic()
+            counts = self.scan(roots)
+            log.info('manifest scan', probed=counts[0], removed=counts[1],
+                     seconds=round(time.monotonic() - start, 1))
+            if done is not None:
+                done()
+        thread = threading.Thread(target=run, name='ManifestScan', daemon=True)
+        thread.start()
+        return thread
+
+
+def main():
+    from media_player import configFile
+    config = configFile(sys.argv[1] if len(sys.argv) > 1 else "media_config.ini")
+    manifest = Manifest(config.getManifestPath()).load()
+    start = time.monotonic()
+    probed, removed = manifest.scan([config.getAdvPath(), config.getContPath()])
+    print('probed %d, removed %d, %d entries in %.1f s' % (probed, removed, len(manifest.entries),
+                                                         time.monotonic() - start))
+
+if __name__ == "__main__":
+    main()
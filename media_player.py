@@ -5,60 +5,431 @@ Author: Saveliy Yusufov, Columbia University, sy2685@columbia.edu
 Date: 25 December 2018
 """
 
-import glob
 import platform
 import os
+import random
+import shlex
 import sys
-from time import sleep
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
 
-import sysv_ipc
 import configparser
 from PyQt5.QtWidgets import *
 from PyQt5.QtGui import *
-from PyQt5.QtCore import Qt, QTimer, QThread, pyqtSignal
+from PyQt5.QtCore import Qt, QFileSystemWatcher, QObject, QTimer, QThread, pyqtSignal
 import vlc
 
+import logsetup
+from catalog import ADV, CONT, ContentCatalog
+from eventtrace import Tracer
+from ipcreactor import POLICY_LATEST, IpcReactor, coalesce
+from mediacache import MediaCache
+from manifest import Manifest
+from mediainfo import MediaParser
+from medialists import MediaListCache
+from metrics import MetricsServer, Registry
+from playback import instanceArgs, mediaOptions, needsNewInstance, parseProfile
+from playerdeck import SWAP_FALLBACK_MS, VideoDeck
+from posters import PosterJob
+from sequencer import Sequencer, weightedOrder
+from startup import StartupTimeline, showSplash
+from stills import StillCache, isStill
+
+log = logsetup.getLogger('media_player')
+
+
+class Shelter(QObject):
+    """Everything the screens of one shelter share: the vlc.Instance, config,
+    manifest, parser, catalog, media cache, IPC reactor and metrics.
+
+    Create it once, attach() a Player per screen, then start(). Queue events
+    go to the screens whose [SCREEN:<n>] section routes that queue to them.
+
+    Start-up is ordered for the first frame: the vlc.Instance (plugin
+    loading) is built on a worker thread while Qt sets up the windows, and the
+    IPC readers run from the start, holding early events until start().
+    """
+    media_parsed = pyqtSignal(str, object)
+
+    def __init__(self, config, timeline=None, parent=None):
+        super().__init__(parent)
+        self.config = config
+        self.timeline = timeline if timeline is not None else StartupTimeline()
+
+        # one vlc instance for every screen, tuned by the [PLAYBACK] profile;
+        # instance blocks until it is built
+        self.vlcInstance = None
+        builder = ThreadPoolExecutor(1, thread_name_prefix='VlcInstance')
+        self.instanceFuture = builder.submit(self.build_instance)
+        builder.shutdown(wait=False)
+
+        # event -> open -> first frame timestamps for loadgen.py (opt-in)
+        self.tracer = Tracer.fromEnv()
+
+        # counters and histograms, scraped from localhost when a port is set
+        self.metrics = Registry()
+        self.metricsServer = None
+
+        #one reactor thread serves every IDLE page queue of every screen
+        self.reactor = IpcReactor(self.config.getIpcSocketDir(), metrics=self.metrics)
+        self.queues = dict()  # queue id -> (kind, MsgQueueEvt)
+        for screen in self.config.getScreens():
+            if screen.advQueueId is not None:
+                self.queue(ADV, screen.advQueueId)
+            if screen.contQueueId is not None:
+                self.queue(CONT, screen.contQueueId)
+        self.reactor.start()
+        self.timeline.mark('ipc readers')
+
+        #AID/CID directory index, kept current by inotify
+        self.catalog = ContentCatalog(self.config.getAdvPath(), self.config.getContPath(), metrics=self.metrics)
+        self.catalog.start()
+        self.timeline.mark('catalog')
+
+        # probed durations/titles/codecs of every file, refreshed in the
+        # background for new or changed files only
+        self.manifest = Manifest(self.config.getManifestPath()).load()
+        if self.config.getManifestAutoscan():
+            self.manifest.scanInBackground([self.config.getAdvPath(), self.config.getContPath()])
+        self.timeline.mark('manifest')
+
+        # metadata comes from the manifest, or is parsed asynchronously and
+        # memoized per path+mtime
+        self.parser = MediaParser(self.media_parsed.emit, manifest=self.manifest, metrics=self.metrics)
+
+        #local copies of the shared media, pre-warmed with every advertisement
+        self.cache = None
+        if self.config.getCacheDir():
+            self.cache = MediaCache(self.config.getCacheDir(), self.config.getCacheMaxBytes(),
+                                    self.config.getCacheVerify())
+            self.cache.start()
+            self.catalog.addListener(self.prewarm_cache)
+            self.prewarm_cache(None, None)
+
+        # per AID MediaLists for advertisement events, rebuilt on changes
+        self.mediaLists = MediaListCache(self, self.config.getScheduler().listShuffle)
+        self.catalog.addListener(self.mediaLists.onCatalogChange)
+
+        # poster frames painted while a video starts
+        self.posters = None
+        if self.config.getPosters():
+            self.posters = PosterJob(self.catalog, self.manifest, *self.config.getPosters())
+            self.posters.start()
+            self.posters.scanInBackground([self.config.getAdvPath(), self.config.getContPath()])
+
+        # decoded stills of every screen, bounded by [STILLS] cachebytes
+        self.stills = None
+        if self.config.getStills():
+            self.stills = StillCache(self.config.getStills().cacheBytes)
+
+        self.players = []
+        self.firstFrames = set()
+
+        # apply edits of media_config.ini without a restart; editors often
+        # write several times in a row, so reload once things settle
+        self.reloadTimer = QTimer(self)
+        self.reloadTimer.setSingleShot(True)
+        self.reloadTimer.setInterval(300)
+        self.reloadTimer.timeout.connect(self.reload_config)
+        self.configWatcher = QFileSystemWatcher([self.config.filename], self)
+        self.configWatcher.fileChanged.connect(self.reloadTimer.start)
+
+    def build_instance(self):
+        instance = vlc.Instance(*self.instance_args())
+        self.timeline.mark('vlc instance')
+        return instance
+
+    @property
+    def instance(self):
+        if self.vlcInstance is None:
+            self.vlcInstance = self.instanceFuture.result()
+        return self.vlcInstance
+
+    def queue(self, kind, qid):
+        """MsgQueueEvt of queue qid
+        """
+        if qid not in self.queues:
+            policy = self.config.getAdvQueuePolicy() if kind == ADV else self.config.getContQueuePolicy()
+            self.queues[qid] = (kind, MsgQueueEvt(self.reactor, qid, *policy, tracer=self.tracer,
+                                                  hold=True, parent=self))
+        elif self.queues[qid][0] != kind:
+            raise ValueError('queue %d is routed as both advertisement and content queue' % qid)
+        return self.queues[qid][1]
+
+    def attach(self, player):
+        """Route the queues of player's screen to its playlist worker
+        """
+        self.players.append(player)
+        screen = player.display
+        #sync with IDLE page
+        if screen.advQueueId is not None:
+            self.queue(ADV, screen.advQueueId).sync_handler.connect(player.plistwk.syncEventHndl)
+        #content event
+        if screen.contQueueId is not None:
+            self.queue(CONT, screen.contQueueId).sync_handler.connect(player.plistwk.syncContentHndl)
+
+    def start(self):
+        """Every screen is attached: deliver the events that arrived during
+        start-up and serve metrics
+        """
+        for kind, evt in self.queues.values():
+            evt.release()
+        self.timeline.mark('screens ready')
+        if self.config.getMetricsPort():
+            try:
+                self.metricsServer = MetricsServer(self.metrics, self.config.getMetricsPort(),
+                                                   self.config.getMetricsAddress())
+            except OSError as e:
+                # port taken (another instance or exporter): play without metrics
+                log.error('metrics server not started', port=self.config.getMetricsPort(), error=e)
+                return
+            self.metrics.addCollector(self.collect_metrics)
+            self.metricsServer.start()
+
+    def first_frame(self, player):
+        if player.display.index in self.firstFrames:
+            return
+        self.firstFrames.add(player.display.index)
+        self.timeline.mark('first frame, screen %d' % player.display.index)
+        if len(self.firstFrames) == len(self.players):
+            self.timeline.report()
+
+    def stop(self):
+        self.reactor.stop()
+        self.catalog.stop()
+        if self.cache is not None:
+            self.cache.stop()
+        if self.posters is not None:
+            self.posters.stop()
+        if self.stills is not None:
+            self.stills.stop()
+        if self.metricsServer is not None:
+            self.metricsServer.stop()
+
+    def instance_args(self):
+        # SHELTER_VLC_ARGS comes last so it can override the profile, e.g.
+        # "--vout=dummy --aout=dummy" for headless load tests
+        return instanceArgs(self.config.getProfile()) + shlex.split(os.environ.get("SHELTER_VLC_ARGS", ""))
+
+    def media_options(self):
+        return mediaOptions(self.config.getProfile())
+
+    def reload_config(self):
+        # a rename-over-save drops the watch, put it back
+        if self.config.filename not in self.configWatcher.files():
+            self.configWatcher.addPath(self.config.filename)
+        # [LOGGING] levels and rate limits apply right away
+        logsetup.configure(self.config.filename)
+        changed = self.config.reload()
+        if changed is None:
+            return
+        old, new = changed
+        if old == new:
+            return
+        log.info('config reloaded', file=self.config.filename)
+
+        if old.profile != new.profile:
+            if needsNewInstance(old.profile, new.profile):
+                self.recreate_instance()
+            # otherwise the caching options apply from the next opened item
+        for player in self.players:
+            player.apply_settings(old, new)
+        for qid, (kind, evt) in self.queues.items():
+            policy = new.advPolicy if kind == ADV else new.contPolicy
+            if policy != (old.advPolicy if kind == ADV else old.contPolicy):
+                self.reactor.setPolicy(qid, *policy)
+
+        # per screen rotation applies live, routing does not
+        live = ('profile', 'rotation', 'statsInterval', 'advPolicy', 'contPolicy', 'screens')
+        pending = [f for f in Settings._fields if f not in live and getattr(old, f) != getattr(new, f)]
+        if [s._replace(rotation=None) for s in old.screens] != [s._replace(rotation=None) for s in new.screens]:
+            pending.append('screens')
+        if pending:
+            log.warning('config: restart the player to apply', fields=','.join(pending))
+
+    def recreate_instance(self):
+        """Move every screen to a new vlc.Instance built from the current
+        profile and restart their current items on it
+        """
+        old = self.instance
+        self.mediaLists.clear()
+        self.vlcInstance = vlc.Instance(*self.instance_args())
+        for player in self.players:
+            player.deck.rebuild(self.instance)
+        old.release()
+        for player in self.players:
+            if player.mediapath:
+                player.open_file(player.mediapath)
+
+    def local_path(self, addr):
+        """Where to read addr from: the local cache copy when there is one
+        """
+        if self.cache is None:
+            return addr
+        return self.cache.resolve(addr)
+
+    def prewarm_cache(self, kind, key):
+        """Catalog listener: queue copies of new or changed advertisements
+        """
+        if kind is None:
+            for aid in self.catalog.entries(ADV):
+                self.cache.prewarm(self.catalog.peek(ADV, aid))
+        elif kind == ADV:
+            self.cache.prewarm(self.catalog.peek(ADV, key))
+
+    def collect_metrics(self):
+        """Scrape time view of the components' own counters
+        """
+        queues = list(self.reactor.routes.values())
+        families = [
+            ('shelter_queue_messages_total', 'counter', 'IDLE page queue messages by stage',
+             [({'queue': r.qid, 'stage': stage}, getattr(r, stage)) for r in queues
+              for stage in ('received', 'coalesced', 'dispatched', 'errors')]),
+            ('shelter_parse_cache_lookups_total', 'counter', 'Media info cache lookups',
+             [({'result': 'hit'}, self.parser.cache.hits), ({'result': 'miss'}, self.parser.cache.misses)]),
+            ('shelter_manifest_entries', 'gauge', 'Files in the media manifest',
+             [({}, len(self.manifest.entries))]),
+        ]
+        staleness = self.catalog.staleness()
+        families += [
+            ('shelter_catalog_age_seconds', 'gauge', 'Seconds since the last full catalog rescan',
+             [({}, staleness['age'])]),
+            ('shelter_catalog_pending_events', 'gauge', 'Filesystem events not yet applied',
+             [({}, staleness['pending'])]),
+            ('shelter_catalog_overflows_total', 'counter', 'inotify queue overflows',
+             [({}, staleness['overflows'])]),
+            ('shelter_catalog_unwatched_dirs', 'gauge', 'Catalog entries kept current by periodic rescans only',
+             [({}, staleness['unwatched'])]),
+            ('shelter_catalog_watch_failures_total', 'counter', 'inotify watches that could not be added',
+             [({}, staleness['watchFailures'])]),
+            ('shelter_rotation_errors_total', 'counter', 'Rotation items that failed to play',
+             [({'screen': p.display.index}, p.sequencer.errors) for p in self.players]),
+        ]
+        # from the manifest durations; items of unknown length are left out
+        rotation = [(p.display.index, p.sequencer) for p in self.players]
+        families += [
+            ('shelter_rotation_cycle_seconds', 'gauge', 'Length of one pass through the rotation',
+             [({'screen': i}, seq.cycleLength() / 1000.0) for i, seq in rotation]),
+            ('shelter_rotation_remaining_seconds', 'gauge', 'Rotation time left after the current item',
+             [({'screen': i}, seq.remaining() / 1000.0) for i, seq in rotation if seq.remaining() is not None]),
+            # grows while a screen waits for its next item: a stall shows here
+            ('shelter_gap_current_seconds', 'gauge', 'Last inter-item gap, or the time since the last end',
+             [({'screen': i}, seq.lastGap()) for i, seq in rotation if seq.lastGap() is not None]),
+        ]
+        if self.cache is not None:
+            stats = self.cache.stats()
+            families += [
+                ('shelter_cache_lookups_total', 'counter', 'Local media cache lookups',
+                 [({'result': 'hit'}, stats['hits']), ({'result': 'miss'}, stats['misses'])]),
+                ('shelter_cache_used_bytes', 'gauge', 'Bytes held by the local media cache',
+                 [({}, stats['usedBytes'])]),
+            ]
+        if self.stills is not None:
+            stats = self.stills.stats()
+            families += [
+                ('shelter_still_cache_lookups_total', 'counter', 'Decoded still cache lookups',
+                 [({'result': 'hit'}, stats['hits']), ({'result': 'miss'}, stats['misses'])]),
+                ('shelter_still_cache_bytes', 'gauge', 'Bytes of decoded stills held',
+                 [({}, stats['bytes'])]),
+            ]
+        # per media counters: they restart with every new item
+        for name, (mtype, text) in VLC_STATS.items():
+            samples = [({'screen': p.display.index}, p.vlcStats[name]) for p in self.players if name in p.vlcStats]
+            if samples:
+                families.append(('shelter_vlc_' + name, mtype, text, samples))
+        if logsetup.service is not None:
+            families.append(('shelter_log_dropped_total', 'counter', 'Log records dropped on a full queue',
+                             [({}, logsetup.service.stats()['dropped'])]))
+        families.append(('shelter_startup_seconds', 'gauge', 'Start-up phases, seconds after process start',
+                         self.timeline.samples()))
+        return families
+
 
 class Player(QMainWindow):
-    def __init__(self, master=None, screens=None, debug=False):
+    """Video window of one screen; shared services come from the Shelter
+    """
+    def __init__(self, shelter, screen, qscreen=None, splash=None, master=None, debug=False):
         QMainWindow.__init__(self, master)
         self.setWindowTitle("Media Player")
-        # Create a basic vlc instance
-        self.instance = vlc.Instance()
+        self.shelter = shelter
+        self.display = screen
+
+        self.config = shelter.config
+        self.tracer = shelter.tracer
+        self.metrics = shelter.metrics
+        self.manifest = shelter.manifest
+        self.parser = shelter.parser
+        self.catalog = shelter.catalog
 
-        self.media = None
+        self.mediapath = None
+        self.openedAt = None
+        # shown until the first video frame of this screen
+        self.splash = splash
+
+        shelter.media_parsed.connect(self.update_title)
 
-        # Create an empty vlc media player
-        self.mediaplayer = self.instance.media_player_new()
         self.setWindowFlags(Qt.WindowStaysOnTopHint | Qt.Tool | Qt.FramelessWindowHint)
         if debug is False:
-            self.move(screens[0].geometry().topLeft())
+            self.move(qscreen.geometry().topLeft())
             self.showFullScreen()
         else:
             self.resize(640, 480)
-            self.move(700,0)
+            self.move(700, 500 * screen.index)
 
 
         self.create_ui()
         self.is_paused = False
+        shelter.timeline.mark('window, screen %d' % screen.index)
+
+        # Create the vlc media player(s), double buffered when configured.
+        # The deck forwards play/pause/stop to whichever player is visible.
+        self.deck = VideoDeck(shelter.instance, self.videostack, self.videoframes, self.still, parent=self)
+        self.mediaplayer = self.deck
+        self.deck.slot_event.connect(self.measure_first_frame)
+        self.deck.slot_event.connect(self.first_frame)
+        self.deck.slot_event.connect(self.poster_slot_event)
+        if self.tracer is not None:
+            self.deck.slot_event.connect(self.trace_slot_event)
+
+        # libVLC decode statistics of the visible media, sampled periodically
+        self.vlcStats = dict()
+        self.statsTimer = QTimer(self)
+        self.statsTimer.timeout.connect(self.sample_vlc_stats)
+        self.statsTimer.start(self.config.getStatsInterval())
 
-        #config file setup
-        self.config = configFile("media_config.ini")
+        # advances the advertisement rotation on end-of-media events
+        self.sequencer = Sequencer(self.deck, metrics=self.metrics, parent=self)
+        self.sequencer.play_item.connect(self.open_file)
+        self.sequencer.preroll_item.connect(self.preroll_file)
+        self.sequencer.play_list.connect(self.open_list)
+        if self.shelter.stills is not None:
+            # a still that did not decode is reported once, then passed over
+            self.sequencer.skip = self.shelter.stills.hasFailed
 
         #contents & advertisement management
-        self.plistwk = Playlist(self.mediaplayer, self.config, parent=self)
-        self.plistwk.content_msg.connect(self.playupdater)
+        self.plistwk = Playlist(self.mediaplayer, self.config, self.catalog, shelter.mediaLists, parent=self)
+        self.plistwk.sequencer = self.sequencer
+        self.plistwk.interrupt_items.connect(self.sequencer.interrupt)
+        self.plistwk.interrupt_list.connect(self.sequencer.interruptList)
+        # rebuilt before the sequencer picks the first item of the next cycle
+        self.sequencer.cycle_end.connect(self.plistwk.onCycleEnd, Qt.DirectConnection)
+        self.catalog.addListener(self.plistwk.onCatalogChange)
         self.plistwk.start()
+        if screen.rotation:
+            self.plistwk.playlist()
 
-        #sync with IDLE page
-        self.advsync = MsgQueueEvt(self.mediaplayer, self.config.getAdvMsgQueueID(), parent=self)
-        self.advsync.sync_handler.connect(self.plistwk.syncEventHndl)
-        self.advsync.start()
+        shelter.attach(self)
 
-        #content event
-        self.contentEvt = MsgQueueEvt(self.mediaplayer, self.config.getContMsgQeueID(), parent=self)
-        self.contentEvt.sync_handler.connect(self.plistwk.syncContentHndl)
-        self.contentEvt.start()
+    @property
+    def instance(self):
+        return self.shelter.instance
+
+    def closeEvent(self, event):
+        self.plistwk.quit()
+        self.plistwk.wait()
+        event.accept()
 
     def create_ui(self):
         """Set up the user interface, signals & slots
@@ -66,28 +437,50 @@ class Player(QMainWindow):
         self.widget = QWidget(self)
         self.setCentralWidget(self.widget)
 
-        # In this widget, the video will be drawn
-        if platform.system() == "Darwin": # for MacOS
-            self.videoframe = QMacCocoaViewContainer(0)
-        else:
-            self.videoframe = QFrame()
+        # In these widgets, the video will be drawn. A double buffered
+        # player stacks two of them and raises the one showing the video.
+        self.videostack = QStackedLayout()
+        self.videostack.setStackingMode(QStackedLayout.StackAll)
+        self.videoframes = []
+        for i in range(2 if self.config.getDoubleBuffer() else 1):
+            if platform.system() == "Darwin": # for MacOS
+                frame = QMacCocoaViewContainer(0)
+            else:
+                frame = QFrame()
+
+            self.palette = frame.palette()
+            self.palette.setColor(QPalette.Window, QColor(0, 0, 0))
+            frame.setPalette(self.palette)
+            #frame.setAutoFillBackground(True)
+            self.videostack.addWidget(frame)
+            self.videoframes.append(frame)
+        self.videoframe = self.videoframes[0]
 
-        self.palette = self.videoframe.palette()
-        self.palette.setColor(QPalette.Window, QColor(0, 0, 0))
-        self.videoframe.setPalette(self.palette)
-        #self.videoframe.setAutoFillBackground(True)
+        # poster of the item being opened, on top of the video frames until
+        # its first frame; native so it can cover the video windows
+        self.poster = QLabel()
+        self.poster.setAttribute(Qt.WA_NativeWindow)
+        self.poster.setAlignment(Qt.AlignCenter)
+        self.poster.setStyleSheet("background-color: black")
+        self.poster.hide()
+        self.posterFor = None
+        self.videostack.addWidget(self.poster)
+
+        # stills are painted here by the deck instead of going through libVLC
+        self.still = QLabel()
+        self.still.setAttribute(Qt.WA_NativeWindow)
+        self.still.setAlignment(Qt.AlignCenter)
+        self.still.setStyleSheet("background-color: black")
+        self.still.hide()
+        self.videostack.addWidget(self.still)
 
         self.vboxlayout = QVBoxLayout()
-        self.vboxlayout.addWidget(self.videoframe)
+        self.vboxlayout.addLayout(self.videostack)
         self.vboxlayout.setContentsMargins(0, 0, 0, 0)
         self.widget.setLayout(self.vboxlayout)
 
 
 
-    def playupdater(self, msg):
-        self.open_file(msg)
-
-
     def play_pause(self):
         """Toggle play/pause status
         """
@@ -117,30 +510,170 @@ class Player(QMainWindow):
         if not filename:
             return
 
-        # getOpenFileName returns a tuple, so use only the actual file name
-        self.media = self.instance.media_new(filename)
+        if self.tracer is not None:
+            self.tracer.emit('open', path=filename)
+        self.metrics.inc('shelter_opens_total')
+        self.openedAt = (filename, monotonic())
+
+        if self.shelter.stills is not None and isStill(filename):
+            self.open_still(filename)
+            return
+
+        # reuse the pre-rolled media; otherwise the deck takes over the new
+        # one and releases it once it is replaced
+        media = self.deck.prerolledMedia(filename)
+        if media is None:
+            media = self.instance.media_new(self.shelter.local_path(filename), *self.shelter.media_options())
+
+        self.mediapath = filename
+
+        # Set the title of the track as window title; parse in the
+        # background unless this file was already parsed before
+        info = self.parser.lookup(filename)
+        if info is not None:
+            self.update_title(filename, info)
+        else:
+            self.parser.parse(media, filename)
+
+        # Put the media in the media player; the deck plays it on the hidden
+        # player (or the pre-rolled one) and swaps once a frame is out
+        prerolled = self.deck.load(media, filename)
+        self.is_paused = False
+        if prerolled:
+            # it was pre-rolled: the first frame is already on screen
+            self.observe_first_frame(monotonic())
+            self.hide_poster()
+        else:
+            self.show_poster(filename)
+
+    def open_still(self, filename):
+        """Show an image through Qt for the [STILLS] duration
+        """
+        self.mediapath = filename
+        image = self.shelter.stills.get(filename, self.videoframe.size())
+        self.hide_poster()
+        self.deck.loadStill(None if image.isNull() else QPixmap.fromImage(image), filename,
+                            self.config.getStills().duration)
+        self.is_paused = False
+        self.prefetch_stills()
+
+    def prefetch_stills(self):
+        """Decode the stills coming up in the rotation in the background
+        """
+        upcoming = self.sequencer.following(self.config.getStills().prefetch)
+        self.shelter.stills.prefetch([p for p in upcoming if isStill(p)], self.videoframe.size())
+
+    def open_list(self, aid):
+        """Play every file of AID-<aid> from its cached MediaList
+        """
+        entry = self.shelter.mediaLists.get(aid)
+        if entry is None:
+            return
+        mediaList, paths = entry
+        if self.tracer is not None:
+            self.tracer.emit('open', path=paths[0])
+        self.metrics.inc('shelter_opens_total')
+        self.openedAt = (paths[0], monotonic())
+        self.mediapath = paths[0]
+        info = self.parser.lookup(paths[0])
+        if info is not None:
+            self.update_title(paths[0], info)
+        self.deck.loadList(mediaList, paths[0], self.config.getScheduler().listLoop)
+        self.is_paused = False
+        self.show_poster(paths[0])
+
+    def preroll_file(self, addr):
+        """Get the next item ready on the standby player
+        """
+        if not addr:
+            return
+        if self.shelter.stills is not None:
+            self.prefetch_stills()
+            if isStill(addr):
+                return
+        if not self.deck.prerollable(addr):
+            return
+        self.deck.preroll(self.instance.media_new(self.shelter.local_path(addr), *self.shelter.media_options()), addr)
+
+    def apply_settings(self, old, new):
+        """Live part of a config reload for this screen
+        """
+        screen = new.screens[self.display.index] if self.display.index < len(new.screens) else self.display
+        if screen.rotation != self.display.rotation:
+            if screen.rotation:
+                self.plistwk.playlist()
+            else:
+                self.plistwk.stopRotation()
+        self.display = self.display._replace(rotation=screen.rotation)
+        if old.statsInterval != new.statsInterval:
+            self.statsTimer.setInterval(new.statsInterval)
+
+    def first_frame(self, idx, kind, stamp):
+        if kind != 'vout' and kind != 'playing':
+            return
+        self.deck.slot_event.disconnect(self.first_frame)
+        if self.splash is not None:
+            self.splash.finish(self)
+            self.splash = None
+        self.shelter.first_frame(self)
+
+    def show_poster(self, path):
+        posters = self.shelter.posters
+        poster = posters.lookup(path) if posters is not None else None
+        if poster is None:
+            self.hide_poster()
+            return
+        pixmap = QPixmap(poster)
+        if pixmap.isNull():
+            self.hide_poster()
+            return
+        self.posterFor = path
+        self.poster.setPixmap(pixmap.scaled(self.poster.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation))
+        self.poster.show()
+        self.poster.raise_()
 
-        # Put the media in the media player
-        self.mediaplayer.set_media(self.media)
+    def hide_poster(self, path=None):
+        if path is None or path == self.posterFor:
+            self.posterFor = None
+            self.poster.hide()
 
-        # Parse the metadata of the file
-        self.media.parse()
+    def poster_slot_event(self, idx, kind, stamp):
+        path = self.deck.slots[idx].path
+        if self.posterFor is None or path != self.posterFor:
+            return
+        if kind in ('vout', 'error'):
+            self.hide_poster()
+        elif kind == 'playing':
+            # no video output (stills, audio): the deck swaps anyway
+            QTimer.singleShot(SWAP_FALLBACK_MS, lambda: self.hide_poster(path))
 
-        # Set the title of the track as window title
-        self.setWindowTitle(self.media.get_meta(0))
+    def measure_first_frame(self, idx, kind, stamp):
+        if kind == 'playing' and self.openedAt is not None and self.deck.slots[idx].path == self.openedAt[0]:
+            self.observe_first_frame(stamp)
 
-        # The media player has to be 'connected' to the QFrame (otherwise the
-        # video would be displayed in it's own window). This is platform
-        # specific, so we must give the ID of the QFrame (or similar object) to
-        # vlc. Different platforms have different functions for this
-        if platform.system() == "Linux": # for Linux using the X Server
-            self.mediaplayer.set_xwindow(int(self.videoframe.winId()))
-        elif platform.system() == "Windows": # for Windows
-            self.mediaplayer.set_hwnd(int(self.videoframe.winId()))
-        elif platform.system() == "Darwin": # for MacOS
-            self.mediaplayer.set_nsobject(int(self.videoframe.winId()))
+    def observe_first_frame(self, stamp):
+        path, opened = self.openedAt
+        if stamp >= opened:
+            self.metrics.observe('shelter_time_to_first_frame_seconds', stamp - opened)
+            self.openedAt = None
+
+    def sample_vlc_stats(self):
+        media = self.deck.get_media()
+        if media is None:
+            self.vlcStats = dict()
+            return
+        stats = vlc.MediaStats()
+        if media.get_stats(stats):
+            self.vlcStats = {name: getattr(stats, name) for name in VLC_STATS}
+        media.release()
 
-        self.play_pause()
+    def trace_slot_event(self, idx, kind, stamp):
+        if kind == 'playing':
+            self.tracer.emit('playing', t=stamp, path=self.deck.slots[idx].path)
+
+    def update_title(self, path, info):
+        if path == self.mediapath and info.title:
+            self.setWindowTitle(info.title)
 
     def set_volume(self, volume):
         """Set the volume
@@ -161,145 +694,386 @@ class Player(QMainWindow):
         self.mediaplayer.set_position(pos / 1000.0)
         self.timer.start()
 
+# libvlc_media_stats_t fields exported as shelter_vlc_<field>
+VLC_STATS = {
+    'decoded_video': ('counter', 'Video frames decoded from the current media'),
+    'displayed_pictures': ('counter', 'Pictures displayed from the current media'),
+    'lost_pictures': ('counter', 'Pictures lost (late or dropped) from the current media'),
+    'decoded_audio': ('counter', 'Audio blocks decoded from the current media'),
+    'lost_abuffers': ('counter', 'Audio buffers lost from the current media'),
+    'input_bitrate': ('gauge', 'Input bitrate of the current media'),
+    'demux_bitrate': ('gauge', 'Demux bitrate of the current media'),
+    'demux_corrupted': ('counter', 'Corrupted demux packets of the current media'),
+    'demux_discontinuity': ('counter', 'Demux discontinuities of the current media'),
+}
+
+# typed, immutable view of media_config.ini
+Settings = namedtuple('Settings', [
+    'advPath', 'advQueueId', 'advPolicy',
+    'contPath', 'contQueueId', 'contPolicy',
+    'ipcSocketDir',
+    'cacheDir', 'cacheMaxBytes', 'cacheVerify',
+    'manifestPath', 'manifestAutoscan',
+    'doubleBuffer', 'rotation',
+    'profile',
+    'metricsPort', 'metricsAddress', 'statsInterval',
+    'screens',
+    'splash',
+    'posters',
+    'scheduler',
+    'stills',
+])
+
+# event priorities and per AID rotation weights
+SchedulerSettings = namedtuple('SchedulerSettings', ['contentPriority', 'advPriority', 'weights',
+                                                     'listLoop', 'listShuffle'])
+
+# stills shown through Qt: display time (ms), decoded image cache size and
+# how many upcoming rotation items are looked at for prefetching
+StillSettings = namedtuple('StillSettings', ['duration', 'cacheBytes', 'prefetch'])
+
+# one display: queues routed to it (None = not routed) and its rotation
+ScreenSettings = namedtuple('ScreenSettings', ['index', 'advQueueId', 'contQueueId', 'rotation'])
+
 class configFile():
+    """media_config.ini parsed once into a Settings snapshot; reload()
+    swaps in a new snapshot when the file changed
+    """
     def __init__(self, filename):
-        self.prop = configparser.ConfigParser()
-        self.prop.read(filename)
+        self.filename = filename
+        self.settings = self.parse()
 
-        self.advConfig = None
-        self.conConfig = None
-        self.getConfig()
+    def parse(self):
+        prop = configparser.ConfigParser()
+        if not prop.read(self.filename):
+            raise OSError('cannot read %s' % self.filename)
+        adv = prop["ADVERTISEMENT"]
+        con = prop["CONTENTS"]
+        rotation = prop.getboolean("PLAYER", "rotation", fallback=False)
+        return Settings(
+            advPath=adv["path"],
+            advQueueId=int(adv["msgqueueid"]),
+            advPolicy=(adv.get("policy", "latest"), adv.getint("debounce", 0)),
+            contPath=con["path"],
+            contQueueId=int(con["msgqueueid"]),
+            contPolicy=(con.get("policy", "latest"), con.getint("debounce", 0)),
+            ipcSocketDir=prop.get("IPC", "socketdir", fallback=None) or None,
+            cacheDir=prop.get("CACHE", "path", fallback=None) or None,
+            cacheMaxBytes=prop.getint("CACHE", "maxbytes", fallback=4 * 1024 ** 3),
+            cacheVerify=prop.get("CACHE", "verify", fallback="size"),
+            manifestPath=prop.get("MANIFEST", "path", fallback="media_manifest.sqlite"),
+            manifestAutoscan=prop.getboolean("MANIFEST", "autoscan", fallback=True),
+            doubleBuffer=prop.getboolean("PLAYER", "doublebuffer", fallback=False),
+            rotation=rotation,
+            profile=parseProfile(prop, prop.get("PLAYBACK", "profile", fallback="default")),
+            metricsPort=prop.getint("METRICS", "port", fallback=0),
+            metricsAddress=prop.get("METRICS", "address", fallback="127.0.0.1"),
+            statsInterval=prop.getint("METRICS", "statsinterval", fallback=5000),
+            screens=self.parseScreens(prop, int(adv["msgqueueid"]), int(con["msgqueueid"]), rotation),
+            splash=prop.get("STARTUP", "splash", fallback=None) or None,
+            posters=(prop.getint("POSTERS", "workers", fallback=2), prop.getint("POSTERS", "width", fallback=1280))
+            if prop.getboolean("POSTERS", "enabled", fallback=False) else None,
+            scheduler=SchedulerSettings(
+                contentPriority=prop.getint("SCHEDULER", "content", fallback=2),
+                advPriority=prop.getint("SCHEDULER", "advertisement", fallback=1),
+                weights=self.parseWeights(prop.get("SCHEDULER", "weights", fallback="")),
+                listLoop=prop.getboolean("SCHEDULER", "aidloop", fallback=False),
+                listShuffle=prop.getboolean("SCHEDULER", "aidshuffle", fallback=False),
+            ),
+            stills=StillSettings(
+                duration=prop.getint("STILLS", "duration", fallback=5000),
+                cacheBytes=prop.getint("STILLS", "cachebytes", fallback=64 * 1024 ** 2),
+                prefetch=prop.getint("STILLS", "prefetch", fallback=3),
+            ) if prop.getboolean("STILLS", "enabled", fallback=True) else None,
+        )
 
-    def getConfig(self):
-        self.advConfig = self.prop["ADVERTISEMENT"]
-        self.conConfig = self.prop["CONTENTS"]
+    def parseWeights(self, text):
+        """'1:3, 7:2' -> {'1': 3, '7': 2}
+        """
+        weights = dict()
+        for item in text.split(","):
+            if item.strip():
+                aid, weight = item.split(":")
+                weights[aid.strip()] = int(weight)
+        return weights
+
+    def parseScreens(self, prop, advQueueId, contQueueId, rotation):
+        """[SCREENS] count screens; each [SCREEN:<n>] may route other queues
+        (or none, when empty) to its display and set its own rotation
+        """
+        def queueId(section, key, default):
+            value = prop.get(section, key, fallback=str(default)).strip()
+            return int(value) if value else None
+
+        screens = []
+        for i in range(prop.getint("SCREENS", "count", fallback=1)):
+            section = "SCREEN:%d" % i
+            screens.append(ScreenSettings(
+                index=i,
+                advQueueId=queueId(section, "advqueue", advQueueId),
+                contQueueId=queueId(section, "contqueue", contQueueId),
+                rotation=prop.getboolean(section, "rotation", fallback=rotation),
+            ))
+        return tuple(screens)
+
+    def reload(self):
+        """Re-read the file; returns (old, new) snapshots, or None when the
+        file is unreadable or invalid (the current snapshot stays)
+        """
+        try:
+            settings = self.parse()
+        except (OSError, KeyError, ValueError, configparser.Error) as e:
+            log.error('config reload failed, keeping the current settings', error=e)
+            return None
+        old, self.settings = self.settings, settings
+        return old, settings
 
     def getAdvPath(self):
-        return self.advConfig["path"]
+        return self.settings.advPath
 
     def getAdvMsgQueueID(self):
-        return self.advConfig["msgqueueid"]
+        return self.settings.advQueueId
 
     def getContPath(self):
-        return self.conConfig["path"]
+        return self.settings.contPath
 
     def getContMsgQeueID(self):
-        return self.conConfig["msgqueueid"]
+        return self.settings.contQueueId
+
+    def getAdvQueuePolicy(self):
+        return self.settings.advPolicy
+
+    def getContQueuePolicy(self):
+        return self.settings.contPolicy
+
+    def getIpcSocketDir(self):
+        return self.settings.ipcSocketDir
+
+    def getCacheDir(self):
+        return self.settings.cacheDir
+
+    def getCacheMaxBytes(self):
+        return self.settings.cacheMaxBytes
+
+    def getCacheVerify(self):
+        return self.settings.cacheVerify
+
+    def getManifestPath(self):
+        return self.settings.manifestPath
+
+    def getManifestAutoscan(self):
+        return self.settings.manifestAutoscan
+
+    def getDoubleBuffer(self):
+        return self.settings.doubleBuffer
+
+    def getRotation(self):
+        return self.settings.rotation
+
+    def getProfile(self):
+        return self.settings.profile
+
+    def getMetricsPort(self):
+        return self.settings.metricsPort
+
+    def getMetricsAddress(self):
+        return self.settings.metricsAddress
+
+    def getStatsInterval(self):
+        return self.settings.statsInterval
+
+    def getScreens(self):
+        return self.settings.screens
+
+    def getSplash(self):
+        return self.settings.splash
+
+    def getScheduler(self):
+        return self.settings.scheduler
+
+    def getPosters(self):
+        """(workers, width) of the poster job, None when disabled
+        """
+        return self.settings.posters
+
+    def getStills(self):
+        """StillSettings, None when stills are played by libVLC
+        """
+        return self.settings.stills
 
 class Playlist(QThread):
-    content_msg = pyqtSignal(str)
+    # files to play now and their priority (see Sequencer.interrupt)
+    interrupt_items = pyqtSignal(list, int)
+    interrupt_list = pyqtSignal(str, int)
+    # the catalog changed: emitted on the catalog thread, handled on the GUI one
+    catalog_changed = pyqtSignal()
 
-    def __init__(self, mediaplayer, config: configFile, parent=None):
+    def __init__(self, mediaplayer, config: configFile, catalog: ContentCatalog, mediaLists=None, parent=None):
         super().__init__()
-        print('create playlist worker')
+        log.debug('create playlist worker')
         self.main = parent
         self.mediaplayer = mediaplayer
         self.config = config
+        self.catalog = catalog
+        # MediaListCache of the shelter; None plays every AID as a list
+        self.mediaLists = mediaLists
+        self.sequencer = None
         self.working = True
+        # the catalog changed since the rotation was built
+        self.dirty = False
+        self.rotating = False
+        self.catalog_changed.connect(self.startIdleRotation)
 
     def __del__(self):
-        print('finish thread...')
+        log.debug('finish playlist worker')
+        self.quit()
         self.wait()
 
     def syncEventHndl(self, data):
-        print('Playlist handled=',data)
-        subdir = 'AID-'+data
-        path = self.config.getAdvPath()+subdir+'/*'
-        content = glob.glob(path)
-        for var in content:
-            self.content_msg.emit(var)
+        files = list(self.catalog.getAdvFiles(data))
+        if not files:
+            return
+        mediaLists = self.mediaLists
+        if mediaLists is None or mediaLists.listable(files):
+            # played from the AID's cached MediaList
+            self.interrupt_list.emit(data, self.config.getScheduler().advPriority)
+            return
+        # file by file, its stills through the StillCache
+        if mediaLists.shuffle:
+            random.shuffle(files)
+        self.interrupt_items.emit(files, self.config.getScheduler().advPriority)
 
     def syncContentHndl(self, data):
-        print('Contents Event=', data)
-        subdir = 'CID-'+data
-        #path = self.config.getContPath() + subdir + '/*'
-
-        # print(path)
-        # content = glob.glob(path)
-        # for var in content:
-        #     self.content_msg.emit(var)
-        path = self.config.getContPath() + subdir
-        print(path)
-        for p, subdirs, files in os.walk(path):
-            sdir = p.split('/')
-            sdir = sdir[len(sdir) - 1]
-            if len(files) > 0 and sdir != 'Thumbnail':
-                print('subdirs',subdirs,p,'filess--->',files)
-                p = p+'/'+files[0]
-                self.content_msg.emit(p)
+        # first file of every non-Thumbnail directory under CID-<data>
+        self.interrupt_items.emit(list(self.catalog.getContFiles(data)), self.config.getScheduler().contentPriority)
 
 
     def run(self):
-        #self.playlist()
-        while True:
-            sleep(1)
-        pass
+        # nothing to poll: sequencing is driven by libVLC end/error events,
+        # so the thread just idles in its event loop
+        self.exec_()
 
     def playlist(self):
-        sleep(0.5)
-        while True:
-            path = self.config.getAdvPath()
-            media_list = list()
-            for path, subdirs, files in os.walk(path):
-                for name in files:
-                    fn = os.path.join(path, name)
-                    print(fn)
-                    media_list.append(fn)
-            # print(media_list)
-
-            for var in media_list:
-                # self.open_file(var)
-                self.content_msg.emit(var)
-                # player.play(var)
-                self.adStatus = 1
-                print('play media:', var)
-                sleep(0.5)
-                while True:
-                    # print('mediaplayer : ', self.mediaplayer.is_playing())
-                    if not self.mediaplayer.is_playing():
-                        break
-                    else:
-                        sleep(0.5)
-                    # if self.adStatus == 2:
-                    #     if self.conStatus == 0:
-                    #         self.open_file(var)
-                    #         #player.play(var)
-                    #         self.adStatus = 1
-                    #         print(var)
-                    #     else:
-                    #         sleep(1)
-                    #         pass
-                    # elif self.adStatus == 0:
-                    #     break
-                    # else:
-                    #     sleep(1)
-                    #     pass
-
-class MsgQueueEvt(QThread):
+        """Rotate through every advertisement file, advancing on
+        MediaPlayerEndReached instead of polling is_playing()
+        """
+        self.rotating = True
+        self.buildRotation()
+        self.sequencer.start()
+
+    def stopRotation(self):
+        self.rotating = False
+        self.sequencer.stop()
+
+    def onCatalogChange(self, kind, key):
+        """Catalog listener (catalog thread): the rotation is rebuilt once
+        the current cycle is over, not in the middle of it
+        """
+        if kind is None or kind == ADV:
+            self.dirty = True
+            self.catalog_changed.emit()
+
+    def startIdleRotation(self):
+        """A rotation that ran out of items (empty until the catalog's
+        first rescan is done, say) has no cycle end to wait for
+        """
+        if self.rotating and self.dirty and not self.sequencer.running:
+            self.playlist()
+
+    def onCycleEnd(self):
+        if self.dirty:
+            self.buildRotation()
+
+    def buildRotation(self):
+        # cleared first: a change while reading the catalog is not lost
+        self.dirty = False
+        groups = dict()
+        for aid in self.catalog.entries(ADV):
+            # skip files the manifest probe found nothing playable in
+            groups[aid] = [f for f in self.catalog.getAdvFiles(aid) if self.main.manifest.playable(f)]
+        # AIDs with a larger [SCHEDULER] weight come round more often
+        media_list = weightedOrder(groups, self.config.getScheduler().weights)
+        stills = self.config.getStills()
+        self.sequencer.setItems(media_list, durations=[
+            stills.duration if stills is not None and isStill(f) else self.main.manifest.duration(f)
+            for f in media_list])
+        log.info('rotation built', items=len(media_list), aids=len(groups))
+
+class MsgQueueEvt(QObject):
+    """Qt face of one IDLE page queue: the IPC reactor decodes, coalesces
+    and hands each message to sync_handler
+    """
     sync_handler = pyqtSignal(str)
 
-    def __init__(self, mediaplayer, msgqID, parent=None):
-        super().__init__()
-        print('create websocket worker')
-        self.main = parent
-        self.mediaplayer = mediaplayer
-        self.working = True
-        self.adv_mq = sysv_ipc.MessageQueue(int(msgqID), mode=0o660, flags=sysv_ipc.IPC_CREAT)
+    def __init__(self, reactor: IpcReactor, msgqID, policy=POLICY_LATEST, debounce=0, tracer=None,
+                 hold=False, parent=None):
+        super().__init__(parent)
+        self.msgqID = int(msgqID)
+        self.tracer = tracer
+        # with hold, messages are kept until release(): the reader can start
+        # before anything is connected to sync_handler
+        self.lock = threading.Lock()
+        self.held = [] if hold else None
+        # emitted from the reactor thread, delivered on the GUI thread
+        handler = self.sync_handler.emit if tracer is None and not hold else self.dispatch
+        self.route = reactor.register(self.msgqID, handler, policy=policy, debounce=debounce)
 
-    def run(self):
-        while True:
-            data = self.adv_mq.receive(type=0)
-            self.sync_handler.emit(str(int(data[0])))
+    def dispatch(self, value):
+        if self.tracer is not None:
+            self.tracer.emit('dispatch', queue=self.msgqID, value=value)
+        with self.lock:
+            if self.held is not None:
+                self.held.append(value)
+                return
+        self.sync_handler.emit(value)
+
+    def release(self):
+        """Stop holding; emit what was held, coalesced by the queue policy
+        """
+        with self.lock:
+            held, self.held = self.held or [], None
+        for value in coalesce(held, self.route.policy):
+            self.sync_handler.emit(value)
 
+    def stats(self):
+        return self.route.stats()
 
 
+# print the start-up timeline at the latest this long after start-up
+STARTUP_REPORT_MS = 30000
+
 
 def main():
     """Entry point for our simple vlc player
     """
+    timeline = StartupTimeline()
+    logsetup.configure("media_config.ini")
     app = QApplication(sys.argv)
-    player = Player(master=None, screens=app.screens(), debug=True)
-    player.show()
+    timeline.mark('qt')
+
+    #config file setup
+    config = configFile("media_config.ini")
+    qscreens = app.screens()
+    screens = config.getScreens()
+    if len(screens) > len(qscreens):
+        log.warning('more screens configured than connected', configured=len(screens), connected=len(qscreens))
+    screens = screens[:len(qscreens)]
+
+    # something on every screen before any heavy set-up
+    splashes = [showSplash(config.getSplash(), qscreens[screen.index]) for screen in screens]
+    app.processEvents()
+    timeline.mark('splash')
+
+    shelter = Shelter(config, timeline)
+    players = []
+    for screen, splash in zip(screens, splashes):
+        player = Player(shelter, screen, qscreens[screen.index], splash, debug=True)
+        player.show()
+        players.append(player)
+    shelter.start()
+    app.aboutToQuit.connect(shelter.stop)
+    # idle screens never show a frame, report what there is
+    QTimer.singleShot(STARTUP_REPORT_MS, timeline.report)
     sys.exit(app.exec_())
 
 if __name__ == "__main__":
@@ -0,0 +1,240 @@
+"""
+Local disk cache in front of the shared Advertisement/Contents storage.
+
+Files are copied to a local directory in the background and served from
+there once verified against the source (size + mtime, optionally a SHA-1
+of the content). The least recently played files are evicted to keep the
+cache under a byte cap. resolve() never blocks on a copy: a miss returns
+the original path and queues the fetch, and a copy due for revalidation
+is served while the fetch thread checks it against its source.
+"""
+
+import hashlib
+import json
+import os
+import queue
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+from logsetup import getLogger
+
+log = getLogger('mediacache')
+
+INDEX_FILE = 'index.json'
+COPY_CHUNK = 1024 * 1024
+
+VERIFY_SIZE = 'size'   # size + mtime of the source
+VERIFY_HASH = 'hash'   # also SHA-1 of the copied content
+
+
+def sha1File(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class MediaCache:
+    def __init__(self, cacheDir, maxBytes, verify=VERIFY_SIZE, revalidate=30.0):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.verify = verify
+        # seconds a verified entry is trusted before its source is stat()ed again
+        self.revalidate = revalidate
+
+        # source path -> entry dict, least recently played first
+        self.entries = OrderedDict()
+        self.used = 0  # sum of the entries' sizes, kept under lock
+        self.lock = threading.Lock()
+        self.fetchQueue = queue.Queue()
+        self.queued = set()
+        self.playing = None
+        self.thread = None
+
+        # counters
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.failures = 0
+        self.evictions = 0
+        self.bytesFetched = 0
+
+        os.makedirs(cacheDir, exist_ok=True)
+        self.load()
+
+    # ---- index ----
+    def load(self):
+        try:
+            with open(os.path.join(self.cacheDir, INDEX_FILE)) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = []
+        for src, entry in saved:
+            if os.path.isfile(entry['local']):
+                entry['checked'] = 0.0
+                with self.lock:
+                    self.entries[src] = entry
+                    self.used += entry['size']
+
+    def save(self):
+        with self.lock:
+            saved = [(src, {k: v for k, v in e.items() if k != 'checked'}) for src, e in self.entries.items()]
+        tmp = os.path.join(self.cacheDir, INDEX_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(saved, f)
+        os.replace(tmp, os.path.join(self.cacheDir, INDEX_FILE))
+
+    def usedBytes(self):
+        with self.lock:
+            return self.used
+
+    def localName(self, src):
+        ext = os.path.splitext(src)[1]
+        return os.path.join(self.cacheDir, hashlib.sha1(src.encode()).hexdigest() + ext)
+
+    # ---- lookups ----
+    def resolve(self, src):
+        """Path to play for src: the local copy when there is one, otherwise
+        src itself (and a fetch is queued). Never touches the share: a copy
+        due for revalidation is queued to be checked by the fetch thread.
+        """
+        with self.lock:
+            entry = self.entries.get(src)
+            if entry is not None:
+                self.entries.move_to_end(src)
+            self.playing = src
+        if entry is not None:
+            self.hits += 1
+            if monotonic() - entry['checked'] >= self.revalidate:
+                self.request(src)
+            return entry['local']
+        self.misses += 1
+        self.request(src)
+        return src
+
+    def prewarm(self, paths):
+        for src in paths:
+            if src not in self.entries:
+                self.request(src)
+
+    def request(self, src):
+        with self.lock:
+            if src in self.queued:
+                return
+            self.queued.add(src)
+        self.fetchQueue.put(src)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'fetches': self.fetches,
+            'failures': self.failures,
+            'evictions': self.evictions,
+            'bytesFetched': self.bytesFetched,
+            'usedBytes': self.usedBytes(),
+            'entries': len(self.entries),
+        }
+
+    # ---- background fetching ----
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='MediaCache', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.fetchQueue.put(None)
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        while True:
+            src = self.fetchQueue.get()
+            if src is None:
+                return
+            try:
+                self.fetch(src)
+            except OSError as e:
+                self.failures += 1
+                log.warning('media cache fetch failed', path=src, error=e)
+            except Exception:
+                # a bug in one fetch must not stop the worker for good
+                self.failures += 1
+                log.exception('media cache fetch crashed', path=src)
+            finally:
+                with self.lock:
+                    self.queued.discard(src)
+
+    def fetch(self, src):
+        with self.lock:
+            entry = self.entries.get(src)
+        try:
+            before = os.stat(src)
+        except OSError:
+            if entry is not None:
+                # source unreachable: the verified copy is all we have
+                return
+            raise
+        if entry is not None:
+            if before.st_size == entry['size'] and before.st_mtime_ns == entry['mtime']:
+                entry['checked'] = monotonic()
+                return
+            # the source changed since it was copied
+            self.drop(src)
+        if before.st_size > self.maxBytes:
+            return
+        local = self.localName(src)
+        tmp = local + '.part'
+        h = hashlib.sha1() if self.verify == VERIFY_HASH else None
+        with open(src, 'rb') as fin, open(tmp, 'wb') as fout:
+            for chunk in iter(lambda: fin.read(COPY_CHUNK), b''):
+                fout.write(chunk)
+                if h is not None:
+                    h.update(chunk)
+        self.bytesFetched += before.st_size
+        after = os.stat(src)
+        ok = (after.st_size == before.st_size and after.st_mtime_ns == before.st_mtime_ns
+              and os.path.getsize(tmp) == before.st_size)
+        digest = None
+        if ok and h is not None:
+            digest = h.hexdigest()
+            ok = sha1File(tmp) == digest
+        if not ok:
+            # source changed while copying or the copy is corrupt
+            os.unlink(tmp)
+            self.failures += 1
+            return
+        os.replace(tmp, local)
+        self.fetches += 1
+        with self.lock:
+            old = self.entries.pop(src, None)
+            if old is not None:
+                self.used -= old['size']
+            self.entries[src] = {'local': local, 'size': before.st_size, 'mtime': before.st_mtime_ns,
+                                 'sha1': digest, 'checked': monotonic()}
+            self.used += before.st_size
+        self.evict()
+        self.save()
+
+    def drop(self, src):
+        with self.lock:
+            entry = self.entries.pop(src, None)
+            if entry is not None:
+                self.used -= entry['size']
+        if entry is not None:
+            try:
+                os.unlink(entry['local'])
+            except OSError:
+                pass
+
+    def evict(self):
+        """Remove least recently played copies until under maxBytes
+        """
+        while self.usedBytes() > self.maxBytes:
+            with self.lock:
+                victim = next((s for s in self.entries if s != self.playing), None)
+            if victim is None:
+                return
+            self.drop(victim)
+            self.evictions += 1
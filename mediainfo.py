@@ -0,0 +1,151 @@
+"""
+Asynchronous libVLC media parsing with a bounded metadata cache.
+
+Player.open_file used to call media.parse() on the Qt main thread just to
+get the title. Here parsing goes through parse_with_options() and the
+MediaParsedChanged event, and the result is memoized per (path, mtime) so
+replaying the same file never parses again.
+"""
+
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from time import monotonic
+
+import vlc
+
+MediaInfo = namedtuple('MediaInfo', ['title', 'duration', 'tracks'])
+
+
+def cacheKey(path):
+    try:
+        return (path, os.stat(path).st_mtime_ns)
+    except OSError:
+        # not a local file (stream URL, missing file): key on the path only
+        return (path, None)
+
+
+def enumValue(v):
+    return int(getattr(v, 'value', v))
+
+
+def readMediaInfo(media):
+    """Collect title, duration(ms) and track descriptions from a parsed media
+    """
+    tracks = []
+    for t in media.tracks_get() or ():
+        tracks.append({'id': t.id, 'type': enumValue(t.type), 'codec': t.codec})
+    return MediaInfo(media.get_meta(vlc.Meta.Title), media.get_duration(), tuple(tracks))
+
+
+class MediaInfoCache:
+    """LRU of MediaInfo keyed by (path, mtime)
+    """
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            info = self.items.get(key)
+            if info is None:
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return info
+
+    def put(self, key, info):
+        with self.lock:
+            self.items[key] = info
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def manifestInfo(entry):
+    tracks = []
+    if entry.vcodec:
+        tracks.append({'type': vlc.TrackType.video.value, 'codec': entry.vcodec,
+                       'width': entry.width, 'height': entry.height})
+    if entry.acodec:
+        tracks.append({'type': vlc.TrackType.audio.value, 'codec': entry.acodec})
+    return MediaInfo(entry.title, entry.duration, tuple(tracks))
+
+
+class MediaParser:
+    """Non-blocking parse front end.
+
+    lookup() answers from the cache or the manifest; parse() starts an
+    asynchronous parse and calls `callback(path, info)` from the libVLC event
+    thread once done, so the callback must only hand the result over (e.g.
+    emit a Qt signal).
+    """
+    def __init__(self, callback, cache=None, timeout=5000, manifest=None, metrics=None):
+        self.callback = callback
+        self.metrics = metrics
+        self.manifest = manifest
+        self.cache = cache if cache is not None else MediaInfoCache()
+        self.timeout = timeout
+        self.pending = dict()  # path -> (media, event manager, key, start time)
+        self.retired = []  # parsed media whose reference is still to release
+        self.lock = threading.Lock()
+        self.parseTimes = []
+
+    def lookup(self, path):
+        key = cacheKey(path)
+        info = self.cache.get(key)
+        if info is None and self.manifest is not None:
+            entry = self.manifest.get(path)
+            if entry is not None:
+                info = manifestInfo(entry)
+                self.cache.put(key, info)
+        return info
+
+    def parse(self, media, path):
+        key = cacheKey(path)
+        with self.lock:
+            if path in self.pending:
+                return
+            # keep the media referenced until its parsed event fires, even
+            # when the player releases it first
+            media.retain()
+            # media.event_manager() is memoized by python-vlc and would
+            # keep every parsed media alive: one manager, dropped with it
+            em = vlc.libvlc_media_event_manager(media)
+            self.pending[path] = (media, em, key, monotonic())
+            retired, self.retired = self.retired, []
+        for done in retired:
+            done.release()
+        em.event_attach(vlc.EventType.MediaParsedChanged, self.onParsed, path)
+        if media.parse_with_options(vlc.MediaParseFlag.local, self.timeout) == -1:
+            em.event_detach(vlc.EventType.MediaParsedChanged)
+            with self.lock:
+                self.pending.pop(path, None)
+            media.release()
+
+    def onParsed(self, event, path):
+        with self.lock:
+            entry = self.pending.pop(path, None)
+        if entry is None:
+            return
+        media, em, key, start = entry
+        em.event_detach(vlc.EventType.MediaParsedChanged)
+        # not from inside the media's own event: released by the next parse()
+        with self.lock:
+            self.retired.append(media)
+        if media.get_parsed_status() != vlc.MediaParsedStatus.done:
+            return
+        info = readMediaInfo(media)
+        self.parseTimes.append(monotonic() - start)
+        del self.parseTimes[:-100]
+        if self.metrics is not None:
+            self.metrics.observe('shelter_media_parse_seconds', self.parseTimes[-1])
+        self.cache.put(key, info)
+        self.callback(path, info)
@@ -0,0 +1,80 @@
+"""
+libVLC MediaLists of the AID directories, built once per AID and dropped
+when the catalog reports the directory changed.
+
+An advertisement event then only points a MediaListPlayer at the cached
+list: the Media objects of its files are created once and libVLC walks the
+list itself. AIDs with stills are left to the player file by file while
+stills are shown through Qt.
+"""
+
+import random
+import threading
+
+from catalog import ADV
+from stills import isStill
+
+
+class MediaListCache:
+    """aid -> (vlc.MediaList, paths), in playback order (or shuffled once
+    per build). get() runs on the GUI thread; the catalog listener may drop
+    entries from the catalog thread.
+    """
+    def __init__(self, shelter, shuffle=False):
+        self.shelter = shelter
+        self.shuffle = shuffle
+        self.lists = dict()
+        self.lock = threading.Lock()
+        self.builds = 0
+
+    def get(self, aid):
+        with self.lock:
+            entry = self.lists.get(aid)
+        if entry is not None:
+            return entry
+        paths = list(self.shelter.catalog.getAdvFiles(aid))
+        if not paths or not self.listable(paths):
+            return None
+        if self.shuffle:
+            random.shuffle(paths)
+        instance = self.shelter.instance
+        options = self.shelter.media_options()
+        mediaList = instance.media_list_new()
+        mediaList.lock()
+        for path in paths:
+            media = instance.media_new(self.shelter.local_path(path), *options)
+            # the list holds its own reference
+            mediaList.add_media(media)
+            media.release()
+        mediaList.unlock()
+        self.builds += 1
+        with self.lock:
+            self.lists[aid] = (mediaList, paths)
+        return mediaList, paths
+
+    def listable(self, paths):
+        """False when paths hold stills for the shelter's StillCache, which
+        a MediaList would hand to libVLC instead
+        """
+        return self.shelter.stills is None or not any(isStill(p) for p in paths)
+
+    def drop(self, aid):
+        with self.lock:
+            entry = self.lists.pop(aid, None)
+        if entry is not None:
+            # a MediaListPlayer still playing it keeps its own reference
+            entry[0].release()
+
+    def clear(self):
+        with self.lock:
+            lists, self.lists = self.lists, dict()
+        for mediaList, paths in lists.values():
+            mediaList.release()
+
+    def onCatalogChange(self, kind, key):
+        """Catalog listener
+        """
+        if kind is None:
+            self.clear()
+        elif kind == ADV:
+            self.drop(key)
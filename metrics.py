@@ -0,0 +1,169 @@
+"""
+Runtime metrics in the Prometheus text format, served on localhost.
+
+Components that time something take an optional `metrics` Registry and
+call observe()/inc() on it; values that already live in a component's own
+stats (queue counters, cache hits, ...) are read by collectors at scrape
+time instead of being copied on every event.
+
+    curl http://127.0.0.1:9464/metrics
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from logsetup import getLogger
+
+log = getLogger('metrics')
+
+# histogram buckets, in seconds
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+SLOW_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# name -> (type, help, buckets)
+METRICS = {
+    'shelter_queue_latency_seconds':
+        ('histogram', 'IPC message arrival to handler dispatch', FAST_BUCKETS),
+    'shelter_catalog_scan_seconds':
+        ('histogram', 'Full AID/CID catalog rescan time', SLOW_BUCKETS),
+    'shelter_media_parse_seconds':
+        ('histogram', 'Asynchronous libVLC media parse time', SLOW_BUCKETS),
+    'shelter_time_to_first_frame_seconds':
+        ('histogram', 'open_file to the first Playing event of that file', SLOW_BUCKETS),
+    'shelter_gap_seconds':
+        ('histogram', 'End of one rotation item to Playing of the next', FAST_BUCKETS),
+    'shelter_resume_seconds':
+        ('histogram', 'Resume of a parked rotation item to its Playing event', FAST_BUCKETS),
+    'shelter_opens_total':
+        ('counter', 'Media opened by the player', None),
+}
+
+
+def formatLabels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                             for k, v in sorted(labels.items()))
+
+
+def formatValue(value):
+    if value is None:
+        return 'NaN'
+    if value is True or value is False:
+        return '1' if value else '0'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        out = []
+        cumulative = 0
+        for bound, n in zip(self.buckets, self.counts):
+            cumulative += n
+            out.append('%s_bucket%s %d' % (name, formatLabels(dict(labels, le=repr(bound))), cumulative))
+        out.append('%s_bucket%s %d' % (name, formatLabels(dict(labels, le='+Inf')), self.count))
+        out.append('%s_sum%s %s' % (name, formatLabels(labels), repr(self.sum)))
+        out.append('%s_count%s %d' % (name, formatLabels(labels), self.count))
+        return out
+
+
+class Registry:
+    """Metrics of METRICS plus collectors; safe to update from any thread.
+
+    A collector is called at scrape time and returns a list of
+    (name, type, help, [(labels dict, value)]).
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {name: dict() for name in METRICS}  # name -> labels tuple -> value
+        self.collectors = []
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.values[name]
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = Histogram(METRICS[name][2])
+            hist.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.values[name]
+            series[key] = series.get(key, 0) + value
+
+    def addCollector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        out = []
+        with self.lock:
+            for name, (mtype, text, buckets) in METRICS.items():
+                out.append('# HELP %s %s' % (name, text))
+                out.append('# TYPE %s %s' % (name, mtype))
+                for key, value in self.values[name].items():
+                    if mtype == 'histogram':
+                        out.extend(value.lines(name, dict(key)))
+                    else:
+                        out.append('%s%s %s' % (name, formatLabels(dict(key)), formatValue(value)))
+        for collector in self.collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                log.error('metrics collector failed', collector=getattr(collector, '__name__', collector), error=e)
+                continue
+            for name, mtype, text, samples in families:
+                out.append('# HELP %s %s' % (name, text))
+                out.append('# TYPE %s %s' % (name, mtype))
+                for labels, value in samples:
+                    out.append('%s%s %s' % (name, formatLabels(labels), formatValue(value)))
+        return '\n'.join(out) + '\n'
+
+
+class MetricsServer:
+    """GET /metrics on address:port, from a daemon thread
+    """
+    def __init__(self, registry, port, address='127.0.0.1'):
+        self.registry = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split('?')[0] != '/metrics':
+                    handler.send_error(404)
+                    return
+                body = registry.render().encode()
+                handler.send_response(200)
+                handler.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, fmt, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((address, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='MetricsServer', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
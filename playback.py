@@ -0,0 +1,84 @@
+"""
+libVLC performance profiles.
+
+[PLAYBACK] profile selects one of the built-in PROFILES, optionally
+overridden (or a new one defined) in a [PLAYBACK:<name>] section:
+
+    [PLAYBACK]
+    profile = lowpower
+
+    [PLAYBACK:lowpower]
+    threads = 2
+    vout = xcb_x11
+
+Caching values are also valid per media, so changing only those applies to
+the next opened item; every other field needs a new vlc.Instance.
+"""
+
+from collections import namedtuple
+
+PlaybackProfile = namedtuple('PlaybackProfile', [
+    'name',
+    'fileCaching',      # ms, --file-caching
+    'networkCaching',   # ms, --network-caching
+    'threads',          # decoder threads, 0 = auto (--avcodec-threads)
+    'skipLoopFilter',   # 0 none .. 4 all (--avcodec-skiploopfilter)
+    'dropLateFrames',   # --drop-late-frames
+    'vout',             # preferred video output module, '' = libVLC's choice
+])
+
+PROFILES = {
+    'default': PlaybackProfile('default', 300, 1000, 0, 0, True, ''),
+    # small boards: fewer decoder threads, cheaper H.264 decoding
+    'lowpower': PlaybackProfile('lowpower', 600, 1500, 2, 4, True, ''),
+    # shortest start-up, for local files on a fast disk
+    'lowlatency': PlaybackProfile('lowlatency', 100, 300, 0, 0, True, ''),
+}
+
+# fields that can be given as media options instead of instance arguments
+MEDIA_FIELDS = ('fileCaching', 'networkCaching')
+
+
+def parseProfile(prop, name):
+    """PlaybackProfile `name` from a ConfigParser: the built-in one (or
+    default) with the keys of [PLAYBACK:<name>] on top
+    """
+    base = PROFILES.get(name, PROFILES['default'])._replace(name=name)
+    section = 'PLAYBACK:' + name
+    if not prop.has_section(section):
+        if name not in PROFILES:
+            raise ValueError('unknown playback profile %r' % name)
+        return base
+    return base._replace(
+        fileCaching=prop.getint(section, 'filecaching', fallback=base.fileCaching),
+        networkCaching=prop.getint(section, 'networkcaching', fallback=base.networkCaching),
+        threads=prop.getint(section, 'threads', fallback=base.threads),
+        skipLoopFilter=prop.getint(section, 'skiploopfilter', fallback=base.skipLoopFilter),
+        dropLateFrames=prop.getboolean(section, 'droplateframes', fallback=base.dropLateFrames),
+        vout=prop.get(section, 'vout', fallback=base.vout),
+    )
+
+
+def instanceArgs(profile):
+    args = [
+        '--file-caching=%d' % profile.fileCaching,
+        '--network-caching=%d' % profile.networkCaching,
+        '--avcodec-threads=%d' % profile.threads,
+        '--avcodec-skiploopfilter=%d' % profile.skipLoopFilter,
+        '--drop-late-frames' if profile.dropLateFrames else '--no-drop-late-frames',
+    ]
+    if profile.vout:
+        args.append('--vout=%s' % profile.vout)
+    return args
+
+
+def mediaOptions(profile):
+    return [':file-caching=%d' % profile.fileCaching, ':network-caching=%d' % profile.networkCaching]
+
+
+def needsNewInstance(old, new):
+    """True when switching from profile old to new changes instance-only
+    settings
+    """
+    keep = dict((f, None) for f in MEDIA_FIELDS + ('name',))
+    return old._replace(**keep) != new._replace(**keep)
@@ -0,0 +1,420 @@
+"""
+Double-buffered video output: two vlc.MediaPlayer instances rendering into
+stacked video frames. The next item is loaded (or pre-rolled and paused) on
+the hidden player and a transition only raises its frame, so switching items
+does not show a black open-and-buffer gap.
+"""
+
+import platform
+from time import monotonic
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+import vlc
+
+# how long to wait for a first video frame after Playing before swapping anyway
+# (stills, audio-only media never create a video output)
+SWAP_FALLBACK_MS = 250
+
+
+def bindWindow(mediaplayer, frame):
+    """Connect a media player to a Qt widget (otherwise the video would be
+    displayed in its own window). This is platform specific.
+    """
+    if platform.system() == "Linux": # for Linux using the X Server
+        mediaplayer.set_xwindow(int(frame.winId()))
+    elif platform.system() == "Windows": # for Windows
+        mediaplayer.set_hwnd(int(frame.winId()))
+    elif platform.system() == "Darwin": # for MacOS
+        mediaplayer.set_nsobject(int(frame.winId()))
+
+
+class DeckSlot:
+    """One media player on one frame. The slot owns a reference to the
+    media it plays and releases it when the media is replaced or stopped, so
+    at most one Media per slot stays alive however long the player runs.
+    """
+    def __init__(self, instance, frame):
+        self.frame = frame
+        self.mediaplayer = instance.media_player_new()
+        self.listplayer = None  # MediaListPlayer on mediaplayer, made on first use
+        self.listMode = False
+        self.media = None
+        self.path = None
+        self.prerolled = False
+        self.ready = False     # pre-rolled and paused on its first frame
+        self.parked = False
+        self.still = None      # QPixmap shown instead of a video
+        self.stillLeft = None  # ms of the still left when it was parked
+        bindWindow(self.mediaplayer, frame)
+
+    def load(self, media, path):
+        """Put media on the player, taking over the caller's reference
+        """
+        if self.listMode:
+            self.listplayer.stop()
+            self.listMode = False
+        self.path = path
+        self.prerolled = False
+        self.ready = False
+        self.parked = False
+        self.still = None
+        # the player keeps its own reference while the media is set
+        self.mediaplayer.set_media(media)
+        self.releaseMedia()
+        self.media = media
+
+    def releaseMedia(self):
+        if self.media is not None:
+            self.media.release()
+            self.media = None
+
+    def loadList(self, mediaList, path, loop):
+        """Hand the player to a MediaListPlayer playing mediaList; path is
+        its first item
+        """
+        self.releaseMedia()
+        self.path = path
+        self.prerolled = False
+        self.ready = False
+        self.parked = False
+        self.still = None
+        self.listMode = True
+        self.listplayer.set_media_list(mediaList)
+        self.listplayer.set_playback_mode(vlc.PlaybackMode.loop if loop else vlc.PlaybackMode.default)
+
+    def play(self):
+        if self.listMode:
+            return self.listplayer.play()
+        return self.mediaplayer.play()
+
+    def stop(self):
+        if self.listMode:
+            self.listplayer.stop()
+            self.listMode = False
+        self.mediaplayer.stop()
+        self.releaseMedia()
+        self.path = None
+        self.prerolled = False
+        self.ready = False
+        self.parked = False
+        self.still = None
+
+
+# player events the deck listens to; python-vlc keeps a single callback per
+# event type, so the deck owns them and re-emits them as slot_event
+SLOT_EVENTS = {
+    vlc.EventType.MediaPlayerVout: 'vout',
+    vlc.EventType.MediaPlayerPlaying: 'playing',
+    vlc.EventType.MediaPlayerPaused: 'paused',
+    vlc.EventType.MediaPlayerEndReached: 'end',
+    vlc.EventType.MediaPlayerEncounteredError: 'error',
+}
+
+
+class VideoDeck(QObject):
+    """One or two DeckSlots behind a QStackedLayout.
+
+    With a single frame the deck behaves like the plain media player it
+    replaces. With two frames new items are started on the standby slot and
+    shown once their first frame is out. The item a swap replaces can be
+    parked (paused, muted, hidden) instead of stopped and resumed later;
+    while one is parked, new items play on the visible slot.
+
+    loadStill() shows a decoded image on the `still` label for a while
+    instead of a video; its slot reports vout/playing at once and 'end' when
+    the time is up, so the sequencer treats it like any other item.
+
+    slot_event(slot index, kind, monotonic time of the libVLC event) is
+    emitted for every event in SLOT_EVENTS.
+    """
+    slot_event = pyqtSignal(int, str, float)
+
+    def __init__(self, instance, layout, frames, still=None, parent=None):
+        super().__init__(parent)
+        self.layout = layout
+        self.slots = self.createSlots(instance, frames)
+        self.double = len(self.slots) > 1
+        self.activeIndex = 0
+        self.pending = None
+        self.parkNext = False
+        self.swapTimes = []
+        self.stillLabel = still
+        self.stillTimer = QTimer(self)
+        self.stillTimer.setSingleShot(True)
+        self.stillTimer.timeout.connect(self.stillEnded)
+
+        self.slot_event.connect(self.onSlotEvent)
+        self.layout.setCurrentWidget(self.active.frame)
+
+    def createSlots(self, instance, frames):
+        slots = [DeckSlot(instance, f) for f in frames]
+        for idx, slot in enumerate(slots):
+            em = slot.mediaplayer.event_manager()
+            # libVLC callbacks run on its own thread, hand them over to Qt
+            for etype, kind in SLOT_EVENTS.items():
+                em.event_attach(etype, self.vlcEvent, idx, kind)
+            slot.listplayer = instance.media_list_player_new()
+            slot.listplayer.set_media_player(slot.mediaplayer)
+            # the end of a list is the end of the slot's item
+            slot.listplayer.event_manager().event_attach(vlc.EventType.MediaListPlayerPlayed,
+                                                         self.vlcListEvent, idx)
+        return slots
+
+    def rebuild(self, instance):
+        """Replace the media players with ones from a new vlc.Instance, on
+        the same frames; whatever was playing is stopped
+        """
+        self.stop()
+        for slot in self.slots:
+            em = slot.mediaplayer.event_manager()
+            for etype in SLOT_EVENTS:
+                em.event_detach(etype)
+            slot.listplayer.event_manager().event_detach(vlc.EventType.MediaListPlayerPlayed)
+            slot.listplayer.release()
+            slot.mediaplayer.release()
+            slot.listplayer = slot.mediaplayer = None
+        self.slots = self.createSlots(instance, [slot.frame for slot in self.slots])
+
+    @property
+    def active(self):
+        return self.slots[self.activeIndex]
+
+    @property
+    def standby(self):
+        return self.slots[self.activeIndex ^ 1] if self.double else self.active
+
+    @property
+    def mediaplayer(self):
+        return self.active.mediaplayer
+
+    def vlcEvent(self, event, idx, kind):
+        if kind == 'end' and self.slots[idx].listMode:
+            return  # one list item done, the MediaListPlayer goes on
+        self.slot_event.emit(idx, kind, monotonic())
+
+    def vlcListEvent(self, event, idx):
+        self.slot_event.emit(idx, 'end', monotonic())
+
+    def load(self, media, path):
+        """Play media; on a double deck it replaces the visible item as soon
+        as it has a frame to show. True when it was pre-rolled and is
+        already on screen. The deck takes over the reference to media.
+        """
+        standby = self.standby
+        if self.isReady(path):
+            if media is not standby.media:
+                media.release()  # the pre-rolled copy plays instead
+            self.swap()
+            return True
+        standby = self.target()
+        if standby is self.active:
+            self.hideStill()
+        standby.load(media, path)
+        standby.mediaplayer.audio_set_mute(False)
+        standby.play()
+        self.pending = self.slots.index(standby) if standby is not self.active else None
+        return False
+
+    def loadList(self, mediaList, path, loop=False):
+        """Play a vlc.MediaList through the slot's MediaListPlayer, swapped
+        in like load(); slot_event reports 'end' once the whole list ended
+        """
+        standby = self.target()
+        if standby is self.active:
+            self.hideStill()
+        standby.loadList(mediaList, path, loop)
+        standby.mediaplayer.audio_set_mute(False)
+        standby.play()
+        self.pending = self.slots.index(standby) if standby is not self.active else None
+
+    def loadStill(self, pixmap, path, duration):
+        """Show pixmap for duration ms in place of the visible item; an
+        unreadable still (pixmap None) is reported as an error right away
+        """
+        if pixmap is None:
+            idx = self.activeIndex
+            QTimer.singleShot(0, lambda: self.slot_event.emit(idx, 'error', monotonic()))
+            return
+        slot = self.target()
+        slot.stop()
+        slot.path = path
+        slot.still = pixmap
+        if slot is not self.active:
+            self.swap()
+        self.showStill(slot, duration)
+
+    def showStill(self, slot, duration):
+        self.stillLabel.setPixmap(slot.still)
+        self.stillLabel.show()
+        self.stillLabel.raise_()
+        self.stillTimer.start(duration)
+        # nothing to decode: the first frame is out now
+        idx, stamp = self.slots.index(slot), monotonic()
+        QTimer.singleShot(0, lambda: (self.slot_event.emit(idx, 'vout', stamp),
+                                      self.slot_event.emit(idx, 'playing', stamp)))
+
+    def hideStill(self):
+        self.stillTimer.stop()
+        if self.stillLabel is not None:
+            self.stillLabel.hide()
+
+    def stillEnded(self):
+        if self.active.still is not None:
+            self.slot_event.emit(self.activeIndex, 'end', monotonic())
+
+    def target(self):
+        """Slot a new item is loaded on
+        """
+        if self.standby.parked:
+            # the other player holds a parked item: replace the visible one
+            self.parkNext = False
+            return self.active
+        return self.standby
+
+    def prerolledMedia(self, path):
+        """Media pre-rolled for path, still owned by the deck, or None
+        """
+        return self.standby.media if self.isReady(path) else None
+
+    def isReady(self, path):
+        """path is pre-rolled and paused on its first frame. Until then an
+        unpause would be lost (libVLC applies :start-paused after it), so a
+        load() of a pre-roll still opening replaces it with a normal load.
+        """
+        standby = self.standby
+        return self.double and standby.prerolled and standby.ready and standby.path == path
+
+    def prerollable(self, path):
+        """True when preroll(path) would load something on the hidden player
+        """
+        standby = self.standby
+        return (self.double and self.pending is None and not standby.parked
+                and standby.path != path)
+
+    def preroll(self, media, path):
+        """Decode the first frame of the next item on the hidden player and
+        keep it paused there until load() asks for the same path. The deck
+        takes over the reference to media.
+        """
+        if not self.prerollable(path):
+            media.release()
+            return False
+        standby = self.standby
+        media.add_option(':start-paused')
+        standby.load(media, path)
+        standby.mediaplayer.audio_set_mute(True)
+        standby.mediaplayer.play()
+        standby.prerolled = True
+        return True
+
+    def swap(self):
+        start = monotonic()
+        old, new = self.active, self.standby
+        new.mediaplayer.audio_set_mute(False)
+        if new.prerolled:
+            new.mediaplayer.set_pause(0)
+            new.prerolled = new.ready = False
+        self.layout.setCurrentWidget(new.frame)
+        self.activeIndex ^= 1
+        self.pending = None
+        if self.parkNext:
+            self.parkNext = False
+            old.mediaplayer.set_pause(1)
+            old.mediaplayer.audio_set_mute(True)
+            old.parked = True
+            if old.still is not None:
+                old.stillLeft = max(0, self.stillTimer.remainingTime())
+        else:
+            old.stop()
+        if new.still is None:
+            self.hideStill()
+        self.swapTimes.append(monotonic() - start)
+        del self.swapTimes[:-100]
+
+    def parkOnSwap(self):
+        """Park the visible item at the next swap instead of stopping it;
+        False when the deck cannot (single player, nothing playing)
+        """
+        if not self.double or self.active.path is None or self.standby.parked:
+            return False
+        self.parkNext = True
+        return True
+
+    def cancelPark(self):
+        """Drop a park asked for by parkOnSwap() that has not happened yet;
+        True when the visible item was to be parked and just plays on
+        """
+        parking, self.parkNext = self.parkNext, False
+        return parking
+
+    def resume(self):
+        """Show and unpause the parked item where it stopped, dropping the
+        visible one; False when nothing is parked
+        """
+        parked = next((slot for slot in self.slots if slot.parked), None)
+        if parked is None:
+            return False
+        current = self.active
+        parked.parked = False
+        self.layout.setCurrentWidget(parked.frame)
+        self.activeIndex = self.slots.index(parked)
+        self.pending = None
+        current.stop()
+        if parked.still is not None:
+            self.showStill(parked, parked.stillLeft)
+        else:
+            self.hideStill()
+            parked.mediaplayer.audio_set_mute(False)
+            parked.mediaplayer.set_pause(0)
+        return True
+
+    def onSlotEvent(self, idx, kind, stamp):
+        if kind == 'paused' and self.slots[idx].prerolled:
+            self.slots[idx].ready = True
+        if self.pending != idx:
+            return
+        if kind == 'vout':
+            self.swap()
+        elif kind == 'error':
+            # the new item will never show, keep the current one on screen.
+            # The sequencer only follows the visible slot: report the error
+            # there, once this event is through, so it still moves on. A
+            # park asked for stays, for the next item of the interruption.
+            self.pending = None
+            active = self.activeIndex
+            QTimer.singleShot(0, lambda: self.slot_event.emit(active, 'error', stamp))
+        elif kind == 'playing':
+            QTimer.singleShot(SWAP_FALLBACK_MS, lambda: self.pending == idx and self.swap())
+
+    # ---- MediaPlayer look-alike, forwarded to the visible slot ----
+    def is_playing(self):
+        return self.active.mediaplayer.is_playing()
+
+    def play(self):
+        return self.active.mediaplayer.play()
+
+    def pause(self):
+        self.active.mediaplayer.pause()
+
+    def set_pause(self, do_pause):
+        self.active.mediaplayer.set_pause(do_pause)
+
+    def stop(self):
+        self.pending = None
+        self.parkNext = False
+        self.hideStill()
+        for slot in self.slots:
+            slot.stop()
+
+    def audio_set_volume(self, volume):
+        for slot in self.slots:
+            slot.mediaplayer.audio_set_volume(volume)
+
+    def set_position(self, pos):
+        self.active.mediaplayer.set_position(pos)
+
+    def get_media(self):
+        """Media of the visible player, a new reference like libVLC's:
+        release() it when done
+        """
+        return self.active.mediaplayer.get_media()
@@ -0,0 +1,144 @@
+"""
+Poster frames for the media under the Advertisement/Contents paths.
+
+One JPEG per video, extracted with ffmpeg into a Thumbnail directory next to
+the media (<dir>/Thumbnail/<file name>.jpg), which the catalog and the
+manifest scanner already skip. The player paints the poster as soon as an
+item is opened and hides it when the video's first frame is out.
+
+Extraction runs as ffmpeg child processes, at most `workers` at a time and
+niced, fed from a thread pool; nothing is generated when ffmpeg is missing.
+"""
+
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from catalog import ADV, CONT, THUMBNAIL_DIR
+from logsetup import getLogger
+from manifest import walkMedia
+
+log = getLogger('posters')
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp')
+
+
+def posterPath(path):
+    head, name = os.path.split(path)
+    return os.path.join(head, THUMBNAIL_DIR, name + '.jpg')
+
+
+def extract(ffmpeg, src, dst, width, seek):
+    """Write the frame at `seek` seconds of src to dst; True on success
+    """
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    part = dst + '.part'
+    cmd = ['nice', '-n', '10', ffmpeg, '-nostdin', '-loglevel', 'error', '-y',
+           '-ss', str(seek), '-i', src, '-frames:v', '1',
+           '-vf', 'scale=%d:-2' % width, '-f', 'image2', '-c:v', 'mjpeg', part]
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60)
+    if result.returncode != 0 or not os.path.exists(part) or not os.path.getsize(part):
+        if os.path.exists(part):
+            os.unlink(part)
+        # shorter than seek: take the first frame instead
+        if seek:
+            return extract(ffmpeg, src, dst, width, 0)
+        return False
+    os.replace(part, dst)
+    return True
+
+
+class PosterJob:
+    """Keeps a poster next to every video of the catalog.
+
+    lookup() answers from disk; scanInBackground() fills in missing or
+    outdated posters and the catalog listener handles new entries.
+    """
+    def __init__(self, catalog, manifest=None, workers=2, width=1280, seek=1.0):
+        self.catalog = catalog
+        self.manifest = manifest
+        self.width = width
+        self.seek = seek
+        self.ffmpeg = shutil.which('ffmpeg')
+        self.executor = None
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.failed = set()  # (path, mtime) that ffmpeg could not decode
+        self.generated = 0
+        self.working = False
+
+    def lookup(self, path):
+        """Poster of path when there is one at least as new as the media
+        """
+        poster = posterPath(path)
+        try:
+            if os.stat(poster).st_mtime_ns >= os.stat(path).st_mtime_ns:
+                return poster
+        except OSError:
+            pass
+        return None
+
+    def wanted(self, path, mtime):
+        if path.lower().endswith(IMAGE_EXTS) or (path, mtime) in self.failed:
+            return False
+        if self.manifest is not None:
+            entry = self.manifest.get(path)
+            if entry is not None and not entry.vcodec:
+                return False  # audio only, or nothing playable
+        return self.lookup(path) is None
+
+    def submit(self, paths):
+        if not self.working:
+            return
+        for path in paths:
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            with self.lock:
+                if path in self.pending or not self.wanted(path, mtime):
+                    continue
+                self.pending.add(path)
+            self.executor.submit(self.generate, path, mtime)
+
+    def generate(self, path, mtime):
+        try:
+            if self.working and extract(self.ffmpeg, path, posterPath(path), self.width, self.seek):
+                self.generated += 1
+            elif self.working:
+                self.failed.add((path, mtime))
+        except (OSError, subprocess.SubprocessError) as e:
+            log.warning('poster failed', path=path, error=e)
+            self.failed.add((path, mtime))
+        finally:
+            with self.lock:
+                self.pending.discard(path)
+
+    def onCatalogChange(self, kind, key):
+        """Catalog listener: posters for new or changed entries
+        """
+        if kind in (ADV, CONT):
+            self.submit(self.catalog.peek(kind, key))
+
+    def start(self):
+        if self.ffmpeg is None:
+            log.info('ffmpeg not found, no posters are generated')
+            return
+        self.working = True
+        self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix='Poster')
+        self.catalog.addListener(self.onCatalogChange)
+
+    def scanInBackground(self, roots):
+        def run():
+            self.submit(path for path, mtime, size in walkMedia(roots))
+        thread = threading.Thread(target=run, name='PosterScan', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.working = False
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
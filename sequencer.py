@@ -0,0 +1,273 @@
+"""
+Event driven playlist sequencing and preemption.
+
+Instead of polling is_playing(), the sequencer advances when the visible
+player reports MediaPlayerEndReached or MediaPlayerEncounteredError and
+pre-rolls the item after that on the standby player. The time between the
+end of one item and the Playing event of the next is kept as the
+inter-item gap metric.
+
+Queue events interrupt the rotation with a priority. A rotation item that
+gets interrupted is parked paused on its player and resumed from the same
+position once the interruption is over, without re-opening it.
+"""
+
+from time import monotonic
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+
+class GapStats:
+    """Inter-item gap metric, in seconds
+    """
+    def __init__(self, keep=100):
+        self.keep = keep
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = None
+        self.recent = []
+
+    def add(self, gap):
+        self.count += 1
+        self.total += gap
+        self.max = max(self.max, gap)
+        self.last = gap
+        self.recent.append(gap)
+        del self.recent[:-self.keep]
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def summary(self):
+        return {'count': self.count, 'last': self.last, 'mean': self.mean(), 'max': self.max}
+
+
+def weightedOrder(groups, weights):
+    """Interleave the files of groups (name -> files) by smooth weighted
+    round robin: a group of weight 3 gets three turns for every turn of a
+    group of weight 1, spread over the cycle. Each turn plays the group's
+    next file; one cycle plays every file at least once.
+    """
+    groups = {name: list(files) for name, files in groups.items() if files}
+    if not groups:
+        return []
+    weight = {name: max(1, weights.get(name, 1)) for name in groups}
+    total = sum(weight.values())
+    current = dict.fromkeys(groups, 0)
+    position = dict.fromkeys(groups, 0)
+    order = []
+    # enough turns for the group that needs the most cycles to get through its files
+    turns = total * max(-(-len(files) // weight[name]) for name, files in groups.items())
+    for i in range(turns):
+        for name in groups:
+            current[name] += weight[name]
+        pick = max(sorted(groups), key=lambda name: current[name])
+        current[pick] -= total
+        files = groups[pick]
+        order.append(files[position[pick] % len(files)])
+        position[pick] += 1
+    return order
+
+
+class Sequencer(QObject):
+    """Plays `items` in order (looping) on a VideoDeck.
+
+    play_item / preroll_item are connected to Player.open_file and
+    Player.preroll_file. interrupt() plays other items before the rotation
+    continues, preempting lower priority ones.
+    """
+    play_item = pyqtSignal(str)
+    preroll_item = pyqtSignal(str)
+    # AID whose cached MediaList is played as one interruption item
+    play_list = pyqtSignal(str)
+    # the rotation wrapped around; a slot may setItems() before the next cycle
+    cycle_end = pyqtSignal()
+
+    def __init__(self, deck, metrics=None, parent=None):
+        super().__init__(parent)
+        self.deck = deck
+        self.metrics = metrics
+        self.items = []
+        self.durations = []
+        self.index = -1
+        self.loop = True
+        self.running = False
+        self.endedAt = None
+        self.gaps = GapStats()
+        self.errors = 0
+        # interruption being played: remaining (signal, item) and its priority
+        self.interruption = []
+        self.priority = None
+        self.queued = None      # (items, priority) waiting for the current interruption
+        self.parked = False     # rotation item paused on the deck
+        self.resumedAt = None
+        self.resumes = GapStats()
+        # item -> True for items to pass over (stills that do not decode)
+        self.skip = None
+        deck.slot_event.connect(self.onSlotEvent)
+
+    def setItems(self, items, loop=True, durations=None):
+        """durations: known length (ms, or None) of each item, from the manifest
+        """
+        self.items = list(items)
+        self.durations = list(durations) if durations is not None else [None] * len(self.items)
+        self.loop = loop
+        if self.index >= len(self.items):
+            self.index = -1
+
+    def start(self):
+        self.running = True
+        if self.priority is None:
+            self.advance()
+        # otherwise the rotation starts once the interruption is over
+
+    def stop(self):
+        self.running = False
+
+    def interrupt(self, items, priority):
+        """Play items now, unless something of higher priority is playing;
+        then they follow it. The rotation is parked and resumes afterwards.
+        """
+        self.preempt([(self.play_item, item) for item in items if not self.skipped(item)], priority)
+
+    def interruptList(self, aid, priority):
+        """Like interrupt() with the MediaList of an AID
+        """
+        self.preempt([(self.play_list, aid)], priority)
+
+    def preempt(self, items, priority):
+        if not items:
+            return
+        if self.priority is not None and priority < self.priority:
+            self.queued = (items, priority)
+            return
+        if self.priority is None and self.running and not self.parked:
+            # keep the rotation item paused where it is, on its own player
+            self.parked = self.deck.parkOnSwap()
+        self.interruption = items
+        self.priority = priority
+        self.playNext()
+
+    def playNext(self):
+        signal, item = self.interruption.pop(0)
+        signal.emit(item)
+
+    def interruptionDone(self):
+        """Next item of the interruption, the queued one, or back to the
+        rotation; False when there is nothing to play
+        """
+        if self.interruption:
+            self.playNext()
+            return True
+        if self.queued is not None:
+            (self.interruption, self.priority), self.queued = self.queued, None
+            self.playNext()
+            return True
+        self.priority = None
+        if self.parked:
+            self.parked = False
+            if self.deck.cancelPark():
+                # every interruption item failed before a swap: the
+                # rotation item was never parked and is still playing
+                self.endedAt = None
+                return True
+            if self.deck.resume():
+                self.resumedAt = monotonic()
+                after = self.upcoming()
+                if after is not None:
+                    self.preroll_item.emit(self.items[after])
+                return True
+        return False
+
+    def skipped(self, item):
+        return self.skip is not None and self.skip(item)
+
+    def upcoming(self):
+        nxt = self.index
+        for _ in self.items:
+            nxt += 1
+            if nxt >= len(self.items):
+                if not self.loop:
+                    return None
+                nxt = 0
+            if not self.skipped(self.items[nxt]):
+                return nxt
+        return None
+
+    def following(self, count):
+        """Up to count rotation items after the current one
+        """
+        if not self.items:
+            return []
+        start = self.index + 1
+        ahead = self.items[start:start + count]
+        if self.loop:
+            while len(ahead) < min(count, len(self.items)):
+                ahead += self.items[:count - len(ahead)]
+        return ahead
+
+    def advance(self):
+        nxt = self.upcoming()
+        if nxt is not None and nxt <= self.index:
+            # next cycle, from the first item of a possibly rebuilt rotation
+            self.index = -1
+            self.cycle_end.emit()
+            nxt = self.upcoming()
+        if nxt is None:
+            self.running = False
+            return
+        self.index = nxt
+        self.play_item.emit(self.items[nxt])
+        after = self.upcoming()
+        if after is not None and after != nxt:
+            self.preroll_item.emit(self.items[after])
+
+    def onSlotEvent(self, idx, kind, stamp):
+        if kind == 'playing':
+            if self.resumedAt is not None and idx == self.deck.activeIndex:
+                self.resumes.add(stamp - self.resumedAt)
+                if self.metrics is not None:
+                    self.metrics.observe('shelter_resume_seconds', self.resumes.last)
+                self.resumedAt = None
+            if self.endedAt is not None and stamp >= self.endedAt:
+                self.gaps.add(stamp - self.endedAt)
+                if self.metrics is not None:
+                    self.metrics.observe('shelter_gap_seconds', self.gaps.last)
+                self.endedAt = None
+            return
+        if kind not in ('end', 'error') or idx != self.deck.activeIndex:
+            # events of a pre-rolled standby or parked item do not end the current one
+            return
+        if kind == 'error':
+            self.errors += 1
+        self.endedAt = stamp
+        if self.priority is not None and self.interruptionDone():
+            return
+        if self.running:
+            self.advance()
+        else:
+            self.endedAt = None
+
+    def cycleLength(self):
+        """Length of one pass through the items in ms, counting only the
+        items with a known duration
+        """
+        return sum(d for item, d in zip(self.items, self.durations) if d and not self.skipped(item))
+
+    def remaining(self):
+        """ms left in the rotation after the current item, None if unknown
+        """
+        start = self.index + 1
+        rest = [d for item, d in zip(self.items[start:], self.durations[start:]) if not self.skipped(item)]
+        if not rest or None in rest:
+            return None
+        return sum(rest)
+
+    def lastGap(self):
+        """Gap of the last transition, or time since the last end while the
+        next item has not started yet
+        """
+        if self.endedAt is not None:
+            return monotonic() - self.endedAt
+        return self.gaps.last
@@ -0,0 +1,215 @@
+"""
+Long-run memory soak of the player, without a display or libVLC: the stub
+`vlc` module (vlcstub) plays every item for a few milliseconds on the
+offscreen Qt platform.
+
+    python soak.py [--items 5000] [--max-rss-growth-mb 16] [--output soak.json]
+
+A Shelter and one Player rotate through a synthetic Advertisement tree while
+advertisement and content events interrupt the rotation every few items.
+After a warm-up the resident set size (/proc/self/statm), the tracemalloc
+total, the number of unreleased stub Media and the number of their Python
+objects still alive are taken as the baseline; at the end the growth of
+each is checked against its threshold, the largest tracemalloc differences
+are listed and the exit status is 1 when a threshold was exceeded.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import vlcstub
+vlcstub.install()
+
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QApplication
+
+import logsetup
+from benchmark import buildTree, gitCommit
+from catalog import ADV, CONT
+from media_player import Player, Shelter, configFile
+
+
+def rssBytes():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def writeConfig(root, adv, cont, queueBase):
+    path = os.path.join(root, 'soak_config.ini')
+    with open(path, 'w') as f:
+        f.write('[ADVERTISEMENT]\npath = %s\nmsgqueueid = %d\n\n'
+                '[CONTENTS]\npath = %s\nmsgqueueid = %d\n\n'
+                '[MANIFEST]\npath = %s\nautoscan = no\n\n'
+                '[PLAYER]\ndoublebuffer = yes\nrotation = yes\n\n'
+                '[POSTERS]\nenabled = no\n\n'
+                '[METRICS]\nport = 0\nstatsinterval = 50\n'
+                % (adv, queueBase, cont, queueBase + 1, os.path.join(root, 'manifest.sqlite')))
+    return path
+
+
+class Soak:
+    """Counts started items and takes the memory samples
+    """
+    def __init__(self, app, shelter, player, args):
+        self.app = app
+        self.shelter = shelter
+        self.player = player
+        self.args = args
+        self.played = 0
+        self.baseline = None
+        self.final = None
+        self.samples = []
+        self.started = time.monotonic()
+        player.deck.slot_event.connect(self.onSlotEvent)
+
+    def sample(self):
+        gc.collect()
+        traced, peak = tracemalloc.get_traced_memory()
+        return {
+            'items': self.played,
+            'seconds': time.monotonic() - self.started,
+            'rss': rssBytes(),
+            'traced': traced,
+            'media_held': vlcstub.Media.held,
+            'media_live': vlcstub.Media.live,
+            'snapshot': tracemalloc.take_snapshot(),
+        }
+
+    def onSlotEvent(self, idx, kind, stamp):
+        if kind != 'playing':
+            return
+        self.played += 1
+        if self.played % self.args.event_every == 0:
+            self.event()
+        if self.played == self.args.warmup:
+            # the AID lists are cached for good once built: all of them
+            # belong to the baseline, not to the growth
+            for aid in self.shelter.catalog.entries(ADV):
+                self.shelter.mediaLists.get(aid)
+            self.baseline = self.sample()
+        if self.played % self.args.sample_every == 0:
+            sample = self.sample()
+            del sample['snapshot']
+            self.samples.append(sample)
+            print('%7d items  rss %7.1f MB  traced %7.1f MB  media %d held %d live' % (
+                self.played, sample['rss'] / 2 ** 20, sample['traced'] / 2 ** 20,
+                sample['media_held'], sample['media_live']))
+        if self.played >= self.args.warmup + self.args.items:
+            self.final = self.sample()
+            self.app.quit()
+
+    def event(self):
+        """An advertisement or content event, as the queues would deliver it
+        """
+        catalog = self.shelter.catalog
+        if random.random() < 0.5:
+            self.player.plistwk.syncEventHndl(random.choice(catalog.entries(ADV)))
+        else:
+            self.player.plistwk.syncContentHndl(random.choice(catalog.entries(CONT)))
+
+
+def compare(baseline, final, args):
+    growth = {
+        'rss': final['rss'] - baseline['rss'],
+        'traced': final['traced'] - baseline['traced'],
+        'media_held': final['media_held'] - baseline['media_held'],
+        'media_live': final['media_live'] - baseline['media_live'],
+    }
+    limits = {
+        'rss': args.max_rss_growth_mb * 2 ** 20,
+        'traced': args.max_traced_growth_mb * 2 ** 20,
+        'media_held': args.max_media_growth,
+        'media_live': args.max_media_growth,
+    }
+    failed = [name for name in growth if growth[name] > limits[name]]
+    top = [str(stat) for stat in final['snapshot'].compare_to(baseline['snapshot'], 'lineno')[:args.top]]
+    return growth, limits, failed, top
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=5000, help='items to play after the warm-up')
+    parser.add_argument('--warmup', type=int, default=500, help='items played before the baseline')
+    parser.add_argument('--cids', type=int, default=100, help='CID directories (one AID per ten)')
+    parser.add_argument('--duration', type=float, default=0.01, help='stub media length in seconds')
+    parser.add_argument('--event-every', type=int, default=7, help='items between queue events')
+    parser.add_argument('--sample-every', type=int, default=500, help='items between memory samples')
+    parser.add_argument('--max-rss-growth-mb', type=float, default=16.0)
+    parser.add_argument('--max-traced-growth-mb', type=float, default=4.0)
+    parser.add_argument('--max-media-growth', type=int, default=8, help='unreleased or live Media allowed to add up')
+    parser.add_argument('--top', type=int, default=10, help='tracemalloc differences to list')
+    parser.add_argument('--output', help='write the JSON report here')
+    args = parser.parse_args()
+
+    vlcstub.DEFAULT_DURATION = args.duration
+    random.seed(0)
+    tracemalloc.start()
+
+    root = tempfile.mkdtemp(prefix='shelter-soak-')
+    shelter = None
+    try:
+        adv, cont = buildTree(root, args.cids)
+        # private System V queues, removed again below
+        path = writeConfig(root, adv, cont, 0x5a000000 + os.getpid() % 0x10000 * 2)
+        # the player logs through the queue, as in production
+        logsetup.configure(path)
+        config = configFile(path)
+
+        app = QApplication(sys.argv)
+        shelter = Shelter(config)
+        player = Player(shelter, config.getScreens()[0], debug=True)
+        shelter.start()
+        soak = Soak(app, shelter, player, args)
+        # a stuck player never reaches the item count
+        QTimer.singleShot(int(1000 * (args.warmup + args.items) * (args.duration + 0.2)), app.quit)
+        app.exec_()
+        player.deck.stop()
+    finally:
+        if shelter is not None:
+            shelter.stop()
+            for pump in shelter.reactor.pumps:
+                pump.mq.remove()
+        shutil.rmtree(root, ignore_errors=True)
+
+    if soak.final is None:
+        print('soak stopped after %d items' % soak.played)
+        sys.exit(1)
+    growth, limits, failed, top = compare(soak.baseline, soak.final, args)
+    print('largest tracemalloc differences since the warm-up:')
+    for line in top:
+        print('  ' + line)
+    for name in growth:
+        print('%-10s growth %12d  limit %12d  %s' % (name, growth[name], limits[name],
+                                                    'FAIL' if name in failed else 'ok'))
+
+    report = {
+        'commit': gitCommit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'items': soak.played,
+        'seconds': soak.final['seconds'],
+        'growth': growth,
+        'limits': limits,
+        'failed': failed,
+        'samples': soak.samples,
+        'top': top,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Cold start helpers: a phase timeline measured from process start, and the
+splash shown on every screen until its first video frame.
+"""
+
+import os
+import time
+from time import monotonic
+
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QPixmap
+from PyQt5.QtWidgets import QSplashScreen
+
+from logsetup import getLogger
+
+log = getLogger('startup')
+
+
+def processStart():
+    """monotonic() time at which this process was started (Linux), so the
+    timeline includes interpreter start-up and imports
+    """
+    try:
+        with open('/proc/self/stat') as f:
+            # starttime is field 22, after the parenthesised command name
+            fields = f.read().rsplit(')', 1)[1].split()
+        started = int(fields[19]) / os.sysconf('SC_CLK_TCK')
+        age = time.clock_gettime(time.CLOCK_BOOTTIME) - started
+        return monotonic() - age
+    except (OSError, ValueError, IndexError, AttributeError):
+        return monotonic()
+
+
+class StartupTimeline:
+    """Named phases in the order they completed, in seconds since start
+    """
+    def __init__(self, start=None):
+        self.start = processStart() if start is None else start
+        self.phases = []
+        self.reported = False
+
+    def mark(self, phase, t=None):
+        self.phases.append((phase, (monotonic() if t is None else t) - self.start))
+
+    def report(self):
+        if self.reported:
+            return
+        self.reported = True
+        last = 0.0
+        for phase, at in self.phases:
+            log.info('startup phase', phase=phase, at=round(at, 3), delta=round(at - last, 3))
+            last = at
+
+    def samples(self):
+        return [({'phase': phase}, at) for phase, at in self.phases]
+
+
+def showSplash(path, qscreen):
+    """Show the image at path full screen on qscreen right away; None when
+    no (readable) splash image is configured
+    """
+    if not path:
+        return None
+    pixmap = QPixmap(path)
+    if pixmap.isNull():
+        log.warning('cannot load splash image', path=path)
+        return None
+    geometry = qscreen.geometry()
+    splash = QSplashScreen(pixmap.scaled(geometry.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation),
+                           Qt.WindowStaysOnTopHint)
+    splash.move(geometry.topLeft())
+    splash.show()
+    return splash
@@ -0,0 +1,163 @@
+"""
+Still images (JPEG, PNG, ...) shown through Qt instead of libVLC.
+
+A still does not need the media pipeline or a video window: it is decoded
+once, scaled to the screen and painted into a label on top of the video
+frames. Decoded images are kept in a byte-bounded LRU; the player
+prefetches the stills coming up in the rotation on a worker thread so a
+slideshow transition only converts a ready image to a pixmap.
+
+Animated GIFs stay with libVLC.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QImage, QImageReader
+
+from logsetup import getLogger
+
+log = getLogger('stills')
+
+STILL_EXTS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def isStill(path):
+    return path.lower().endswith(STILL_EXTS)
+
+
+def decode(path, size):
+    """path decoded straight to fit size (JPEGs are scaled while decoding);
+    a null QImage when it cannot be read
+    """
+    reader = QImageReader(path)
+    reader.setAutoTransform(True)
+    source = reader.size()
+    if source.isValid():
+        reader.setScaledSize(source.scaled(size, Qt.KeepAspectRatio))
+    image = reader.read()
+    if image.isNull():
+        log.warning('cannot decode still', path=path, error=reader.errorString())
+    return image
+
+
+def imageBytes(image):
+    return image.sizeInBytes() if hasattr(image, 'sizeInBytes') else image.byteCount()
+
+
+class StillCache:
+    """(path, size) -> decoded QImage, at most maxBytes of pixels, least
+    recently shown out first. QImage (unlike QPixmap) may be built off the
+    GUI thread, so prefetch() decodes on a worker.
+    """
+    def __init__(self, maxBytes=64 * 1024 ** 2, workers=1):
+        self.maxBytes = maxBytes
+        self.entries = OrderedDict()  # key -> (mtime, image)
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.pending = dict()  # key -> Future
+        self.failed = dict()  # path -> mtime of a file that did not decode
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='Still')
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+
+    def key(self, path, size):
+        return (path, size.width(), size.height())
+
+    def get(self, path, size):
+        """Decoded image of path for size, from the cache, a running
+        prefetch, or decoded now
+        """
+        key = self.key(path, size)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return QImage()
+        with self.lock:
+            if self.failed.get(path) == mtime:
+                return QImage()
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == mtime:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            future = self.pending.get(key)
+        if future is not None:
+            future.result()
+            with self.lock:
+                entry = self.entries.get(key)
+            if entry is not None and entry[0] == mtime:
+                self.hits += 1
+                return entry[1]
+        self.misses += 1
+        image = decode(path, size)
+        self.put(key, mtime, image)
+        return image
+
+    def prefetch(self, paths, size):
+        for path in paths:
+            key = self.key(path, size)
+            with self.lock:
+                if key in self.entries or key in self.pending or path in self.failed:
+                    continue
+                self.pending[key] = self.executor.submit(self.load, key, path, size)
+
+    def load(self, key, path, size):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            self.put(key, mtime, decode(path, size))
+            self.prefetched += 1
+        except OSError:
+            pass
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+
+    def hasFailed(self, path):
+        """path did not decode and has not changed since
+        """
+        with self.lock:
+            mtime = self.failed.get(path)
+        if mtime is None:
+            return False
+        try:
+            return os.stat(path).st_mtime_ns == mtime
+        except OSError:
+            return True
+
+    def put(self, key, mtime, image):
+        if image.isNull():
+            # not decoded again until the file changes
+            with self.lock:
+                self.failed[key[0]] = mtime
+            return
+        size = imageBytes(image)
+        with self.lock:
+            self.failed.pop(key[0], None)
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= imageBytes(old[1])
+            self.entries[key] = (mtime, image)
+            self.bytes += size
+            # the newest entry stays even when it alone exceeds maxBytes
+            while self.bytes > self.maxBytes and len(self.entries) > 1:
+                evicted, (m, img) = self.entries.popitem(last=False)
+                self.bytes -= imageBytes(img)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'prefetched': self.prefetched,
+                'failed': len(self.failed),
+            }
+
+    def stop(self):
+        self.executor.shutdown(wait=False)
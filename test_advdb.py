@@ -0,0 +1,49 @@
+import asyncio
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from advdb import AdvDatabase, sqliteConnect
+
+
+class SqliteStandInTest(unittest.TestCase):
+    """AdvDatabase on the sqlite3 stand-in: pooled connections are reused
+    by whichever executor thread runs the next query, and closed from the
+    caller's thread
+    """
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='advdb-test-')
+        self.path = os.path.join(self.dir, 'adv.sqlite')
+        db = sqlite3.connect(self.path)
+        db.execute('CREATE TABLE adv (aid TEXT, name TEXT)')
+        db.executemany('INSERT INTO adv VALUES (?, ?)', [('%d' % i, 'ad %d' % i) for i in range(10)])
+        db.commit()
+        db.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def queries(self, connect, count=50):
+        db = AdvDatabase(params={'database': self.path}, connect=connect, maxconn=2)
+
+        async def many():
+            return await asyncio.gather(
+                *(db.query('SELECT name FROM adv WHERE aid = ?', ('%d' % (i % 10),)) for i in range(count)),
+                return_exceptions=True)
+        try:
+            return db, asyncio.run(many())
+        finally:
+            db.close()
+
+    def test_pooled_connections_move_between_threads(self):
+        db, results = self.queries(sqliteConnect)
+        self.assertEqual(results, [[('ad %d' % (i % 10),)] for i in range(50)])
+        self.assertEqual(db.stats.errors, 0)
+        self.assertLessEqual(db.stats.connects, 2)
+        self.assertEqual(db.stats.queries, 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
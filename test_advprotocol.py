@@ -0,0 +1,59 @@
+import unittest
+
+from advprotocol import AdListHistory, applyMessage
+
+
+class AdListHistoryTest(unittest.TestCase):
+    """A client applying what since() sends ends up with the server's list,
+    from a delta when its version is still in the history and from a
+    snapshot otherwise
+    """
+    def setUp(self):
+        self.history = AdListHistory(keep=4)
+        self.history.update(['/ftp/%d.mp4' % i for i in range(40)])
+
+    def client(self):
+        """(epoch, version, items) of a client holding the current list
+        """
+        msg = self.history.snapshot()
+        return msg['epoch'], msg['version'], applyMessage([], msg)
+
+    def test_delta_round_trip(self):
+        epoch, version, items = self.client()
+        self.history.update(items[2:] + ['/ftp/new.mp4'])
+        self.history.update(items[3:] + ['/ftp/new.mp4', '/ftp/other.mp4'])
+
+        msg = self.history.since(version, epoch)
+        self.assertEqual(msg['type'], 'delta')
+        self.assertEqual(msg['base'], version)
+        self.assertEqual(msg['version'], self.history.version)
+        self.assertEqual(msg['remove'], items[:3])
+        self.assertEqual(msg['add'], ['/ftp/new.mp4', '/ftp/other.mp4'])
+        self.assertEqual(applyMessage(items, msg), self.history.items)
+        self.assertIsNone(self.history.since(self.history.version, epoch))
+
+    def test_client_older_than_the_history_gets_a_snapshot(self):
+        epoch, version, items = self.client()
+        for i in range(6):
+            self.history.update(self.history.items[1:] + ['/ftp/late%d.mp4' % i])
+
+        msg = self.history.since(version, epoch)
+        self.assertEqual(msg['type'], 'snapshot')
+        self.assertEqual(applyMessage(items, msg), self.history.items)
+
+    def test_epoch_change_forces_a_snapshot(self):
+        epoch, version, items = self.client()
+        self.history.update(items + ['/ftp/new.mp4'])
+
+        msg = self.history.since(version, epoch + '-earlier')
+        self.assertEqual(msg['type'], 'snapshot')
+        self.assertEqual(msg['epoch'], self.history.epoch)
+        self.assertEqual(applyMessage(items, msg), self.history.items)
+
+    def test_histories_created_together_have_their_own_epoch(self):
+        epochs = set(AdListHistory().epoch for i in range(100))
+        self.assertEqual(len(epochs), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
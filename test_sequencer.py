@@ -0,0 +1,84 @@
+import os
+import time
+import unittest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import vlcstub
+vlcstub.install()
+
+from PyQt5.QtWidgets import QApplication, QFrame, QStackedLayout, QWidget
+
+from playerdeck import VideoDeck
+from sequencer import Sequencer
+
+app = QApplication.instance() or QApplication([])
+
+
+class DeckSequencerTest(unittest.TestCase):
+    """Sequencer on a double VideoDeck driven by the stub player: an item
+    that fails to open on the standby slot ends the current one
+    """
+    def setUp(self):
+        self.instance = vlcstub.Instance()
+        self.window = QWidget()
+        layout = QStackedLayout(self.window)
+        frames = [QFrame(), QFrame()]
+        for frame in frames:
+            layout.addWidget(frame)
+        self.deck = VideoDeck(self.instance, layout, frames)
+        self.sequencer = Sequencer(self.deck)
+        self.opened = []
+        self.sequencer.play_item.connect(self.open)
+        vlcstub.UNPLAYABLE.add('bad')
+
+    def tearDown(self):
+        self.sequencer.stop()
+        self.deck.stop()
+        vlcstub.UNPLAYABLE.discard('bad')
+
+    def open(self, path):
+        self.opened.append(path)
+        self.deck.load(self.instance.media_new(path), path)
+
+    def waitFor(self, predicate, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while not predicate() and time.monotonic() < deadline:
+            app.processEvents()
+            time.sleep(0.001)
+        return predicate()
+
+    def test_rotation_goes_on_after_an_unplayable_item(self):
+        self.sequencer.setItems(['a', 'bad', 'c'])
+        self.sequencer.start()
+        self.assertTrue(self.waitFor(lambda: self.opened.count('c') >= 2), self.opened)
+        self.assertGreaterEqual(self.sequencer.errors, 1)
+
+    def test_failed_interruption_ends_without_rotation(self):
+        self.sequencer.interrupt(['bad'], 2)
+        self.assertTrue(self.waitFor(lambda: self.sequencer.priority is None))
+        self.assertEqual(self.sequencer.errors, 1)
+        # later, lower priority events play again
+        self.sequencer.interrupt(['ad'], 1)
+        self.assertTrue(self.waitFor(lambda: 'ad' in self.opened and self.sequencer.priority is None))
+        self.assertIsNone(self.sequencer.queued)
+
+    def test_failed_interruption_keeps_the_rotation_item(self):
+        vlcstub.DEFAULT_DURATION, duration = 0.3, vlcstub.DEFAULT_DURATION
+        try:
+            self.sequencer.setItems(['a', 'b'])
+            self.sequencer.start()
+            self.assertTrue(self.waitFor(lambda: self.deck.active.path == 'a' and self.deck.pending is None))
+            self.sequencer.interrupt(['bad'], 2)
+            self.assertTrue(self.waitFor(lambda: self.sequencer.priority is None))
+            # 'a' was never parked: it plays on and the rotation continues
+            self.assertNotIn('b', self.opened)
+            self.assertEqual(self.deck.active.path, 'a')
+            self.assertFalse(self.sequencer.parked)
+            self.assertTrue(self.waitFor(lambda: 'b' in self.opened))
+        finally:
+            vlcstub.DEFAULT_DURATION = duration
+
+
+if __name__ == '__main__':
+    unittest.main()
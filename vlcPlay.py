@@ -1,8 +1,8 @@
 import os
 import subprocess
 import threading
+import time
 import ctypes
-from time import sleep
 
 import vlc
 import glob
@@ -12,6 +12,10 @@ import json
 import pickle
 import websockets  # 클라이언트 접속이 되면 호출된다.
 
+import logsetup
+
+log = logsetup.getLogger('vlcPlay')
+
 class VlcPlayer:
     '''
     args: VLC인스턴스 생성옵션
@@ -36,7 +40,7 @@ class VlcPlayer:
             # vlc_instance = vlc.Instance(vlc_arguments)
             # self.media = vlc_instance.media_player_new()
 
-            print('---')
+            log.debug('default media player')
         # instance = vlc.Instance('--qt-fullscreen-screennumber=0','-f')
         # self.media = instance.media_player_new()
 
@@ -143,16 +147,31 @@ class VlcPlayer:
 
 
 def my_call_back(event):
-    print("콜백함수호출: 종료호출")
+    log.debug('ad ended')
     global keywork
-    if keywork.conStatus == 1 :
-        keywork.conStatus = 0
-    else :
+    # runs on the libVLC event thread: only update the state and wake the
+    # worker, never call back into the player from here
+    with keywork.cond:
         keywork.adStatus = 0
+        keywork.cond.notify()
+
+
+def content_call_back(event):
+    global keywork
+    with keywork.cond:
+        keywork.conStatus = 0
+        keywork.cond.notify()
+
+
+def resumed_call_back(event):
+    global keywork
+    if keywork.resumedAt is not None:
+        log.info('ad resumed', ms=round((time.monotonic() - keywork.resumedAt) * 1000, 1))
+        keywork.resumedAt = None
 
 
 async def accept(websocket, path):
-    print('accepted', websocket.origin, websocket.id)
+    log.info('client accepted', origin=websocket.origin, id=websocket.id)
     while True:
         data = await websocket.recv()  # 클라이언트로부터 메시지를 대기한다.
         recvdata = json.loads(data)
@@ -161,7 +180,7 @@ async def accept(websocket, path):
 
         #if you receive '0' data from client once, add client socket into Advertiser client list
         #advertise mode ready to client
-        print(data)
+        log.debug('message received', data=data)
 
         keywork.sendMedia(recvMsg)
 
@@ -171,6 +190,9 @@ class KeyWorker(threading.Thread):
         self.name = name
         self.adStatus = 0  # 0 = 종료, 1 = 재생중, 2 = 일시중지(컨텐츠 재생)
         self.conStatus = 0
+        # signalled by the end/error callback and by sendMedia
+        self.cond = threading.Condition()
+        self.resumedAt = None
 
     def run(self):
         self.playAd()
@@ -184,40 +206,47 @@ class KeyWorker(threading.Thread):
             for path, subdirs, files in os.walk(path):
                 for name in files:
                     fn = os.path.join(path, name)
-                    print(fn)
                     media_list.append(fn)
-            print(media_list)
+            log.info('ad rotation', path=path, files=len(media_list))
 
             for var in media_list:
+                with self.cond:
+                    self.adStatus = 1
                 player.play(var)
-                self.adStatus = 1
                 while True:
-                    if self.adStatus == 2:
-                        if self.conStatus == 0:
-                            player.play(var)
-                            self.adStatus = 1
-                            print(var)
-                        else:
-                            sleep(1)
-                            pass
-                    elif self.adStatus == 0:
-                        break
-                    else:
-                        sleep(1)
-                        pass
+                    # sleep until the player reports an end/error or the
+                    # interrupting content has finished
+                    with self.cond:
+                        while self.adStatus == 1 or (self.adStatus == 2 and self.conStatus == 1):
+                            self.cond.wait()
+                        if self.adStatus == 0:
+                            break
+                        self.adStatus = 1
+                    # the ad was parked paused on its own player: continue
+                    # where it stopped instead of opening it again
+                    contentPlayer.stop()
+                    self.resumedAt = time.monotonic()
+                    player.resume()
+                    log.debug('ad continued', path=var)
 
 
     def sendMedia(self, msg):
         self.msg = "CID-"+msg
-        self.adStatus = 2
-        self.conStatus = 1
 
         path = '/home/soobin/development/LL_Docker_Setup/data/shelter/Contents/'+self.msg+"/Video/*"
         content = glob.glob(path)
+        if not content:
+            # nothing to play instead: the ad must not stay paused
+            log.warning('no content files', cid=self.msg, path=path)
+            return
+        with self.cond:
+            if self.adStatus == 1:
+                player.media.set_pause(1)
+                self.adStatus = 2
+            self.conStatus = 1
         for var in content:
-            player.play(var)
-        print(path)
-        print(self.msg)
+            contentPlayer.play(var)
+        log.info('content', cid=self.msg, path=path, files=len(content))
 
 
 async def main():
@@ -226,9 +255,20 @@ async def main():
 
 
 if "__main__" == __name__:
-    player = VlcPlayer()
+    logsetup.configure()
 
-    player.add_callback(vlc.EventType.MediaPlayerStopped, my_call_back)
+    # ads and contents on separate players, so an interrupted ad can stay
+    # parked (paused at its position) while the content plays
+    player = VlcPlayer()
+    contentPlayer = VlcPlayer()
+
+    # EndReached/EncounteredError rather than Stopped: replacing the media
+    # with set_mrl() also stops the player and must not count as an end
+    player.add_callback(vlc.EventType.MediaPlayerEndReached, my_call_back)
+    player.add_callback(vlc.EventType.MediaPlayerEncounteredError, my_call_back)
+    player.add_callback(vlc.EventType.MediaPlayerPlaying, resumed_call_back)
+    contentPlayer.add_callback(vlc.EventType.MediaPlayerEndReached, content_call_back)
+    contentPlayer.add_callback(vlc.EventType.MediaPlayerEncounteredError, content_call_back)
 
     keywork = KeyWorker('keyWorker')
     keywork.start()
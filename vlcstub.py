@@ -0,0 +1,456 @@
+"""
+Stand-in for the python-vlc module, for benchmarks and soak runs on hosts
+without a display or libVLC.
+
+    import vlcstub
+    vlcstub.install()      # before anything imports vlc
+
+Media "play" on a timer: play() fires MediaPlayerPlaying and
+MediaPlayerVout after `startup` seconds and MediaPlayerEndReached after the
+media's duration, from a background thread like libVLC does; media whose
+mrl is in UNPLAYABLE fire MediaPlayerEncounteredError instead.
+
+Media and MediaList are reference counted like their libVLC counterparts
+(players and lists retain what they hold, get_media() returns a new
+reference); Media.held counts media not released yet, which is what leaks
+natively when a release() is missing. Media.event_manager() is memoized
+like in python-vlc, so every Media it was called on stays alive
+(Media.live).
+"""
+
+import functools
+import os
+import sys
+import threading
+
+# seconds from play() to the Playing/Vout events, and default media length
+STARTUP_DELAY = 0.005
+DEFAULT_DURATION = 0.05
+# mrls that fail to open: play() ends in MediaPlayerEncounteredError
+UNPLAYABLE = set()
+
+
+class _Enum(int):
+    @property
+    def value(self):
+        return int(self)
+
+
+def _enum(name, **members):
+    return type(name, (), {k: _Enum(v) for k, v in members.items()})
+
+
+EventType = _enum('EventType',
+                  MediaParsedChanged=3,
+                  MediaPlayerPlaying=260, MediaPlayerPaused=261, MediaPlayerStopped=262,
+                  MediaPlayerEndReached=265, MediaPlayerEncounteredError=266,
+                  MediaPlayerVout=274, MediaListPlayerPlayed=1024)
+Meta = _enum('Meta', Title=0, Artist=1)
+PlaybackMode = _enum('PlaybackMode', default=0, loop=1, repeat=2)
+MediaParseFlag = _enum('MediaParseFlag', local=0, network=1, fetch_local=2)
+MediaParsedStatus = _enum('MediaParsedStatus', skipped=1, failed=2, timeout=3, done=4)
+TrackType = _enum('TrackType', unknown=-1, audio=0, video=1, ext=2)
+State = _enum('State', NothingSpecial=0, Opening=1, Buffering=2, Playing=3, Paused=4,
+              Stopped=5, Ended=6, Error=7)
+
+
+class Event:
+    def __init__(self, etype):
+        self.type = etype
+
+
+class EventManager:
+    """Like python-vlc: one callback per event type
+    """
+    def __init__(self):
+        self.callbacks = dict()
+
+    def event_attach(self, etype, callback, *args, **kwargs):
+        self.callbacks[int(etype)] = (callback, args, kwargs)
+
+    def event_detach(self, etype):
+        self.callbacks.pop(int(etype), None)
+
+    def fire(self, etype):
+        entry = self.callbacks.get(int(etype))
+        if entry is not None:
+            callback, args, kwargs = entry
+            callback(Event(etype), *args, **kwargs)
+
+
+class memoize_parameterless:
+    """Like python-vlc: caches the result per object, which keeps every
+    object it was called on alive
+    """
+    def __init__(self, func):
+        self.func = func
+        self.cache = dict()
+
+    def __call__(self, obj):
+        try:
+            return self.cache[obj]
+        except KeyError:
+            value = self.cache[obj] = self.func(obj)
+            return value
+
+    def __get__(self, obj, objtype=None):
+        return functools.partial(self.__call__, obj)
+
+
+class MediaStats:
+    def __init__(self):
+        self.read_bytes = 0
+        self.input_bitrate = 0.0
+        self.demux_read_bytes = 0
+        self.demux_bitrate = 0.0
+        self.demux_corrupted = 0
+        self.demux_discontinuity = 0
+        self.decoded_video = 0
+        self.decoded_audio = 0
+        self.displayed_pictures = 0
+        self.lost_pictures = 0
+        self.played_abuffers = 0
+        self.lost_abuffers = 0
+
+
+class _Refcounted:
+    lock = threading.Lock()
+
+    def __init__(self):
+        self.refs = 1
+
+    def retain(self):
+        with _Refcounted.lock:
+            if self.refs <= 0:
+                raise RuntimeError('%r retained after its last release' % self)
+            self.refs += 1
+
+    def release(self):
+        with _Refcounted.lock:
+            if self.refs <= 0:
+                raise RuntimeError('%r released too often' % self)
+            self.refs -= 1
+            last = self.refs == 0
+        if last:
+            self.free()
+
+    def free(self):
+        pass
+
+
+class Media(_Refcounted):
+    live = 0  # Python objects
+    held = 0  # native references not released yet
+
+    def __init__(self, mrl, duration=None):
+        super().__init__()
+        Media.live += 1
+        Media.held += 1
+        self.mrl = mrl
+        self.duration = DEFAULT_DURATION if duration is None else duration
+        self.options = []
+        self.events = EventManager()
+        self.parsed = 0
+        self.released = False
+
+    def __del__(self):
+        Media.live -= 1
+
+    def add_option(self, option):
+        self.options.append(option)
+
+    @memoize_parameterless
+    def event_manager(self):
+        return self.events
+
+    def parse(self):
+        self.parsed = MediaParsedStatus.done
+
+    def parse_with_options(self, flags, timeout):
+        def done():
+            self.parsed = MediaParsedStatus.done
+            self.events.fire(EventType.MediaParsedChanged)
+        threading.Timer(0.001, done).start()
+        return 0
+
+    def get_parsed_status(self):
+        return self.parsed
+
+    def get_meta(self, meta):
+        return os.path.basename(self.mrl) if int(meta) == Meta.Title else None
+
+    def get_duration(self):
+        return int(self.duration * 1000)
+
+    def get_mrl(self):
+        return self.mrl
+
+    def tracks_get(self):
+        return iter(())
+
+    def get_stats(self, stats):
+        return True
+
+    def free(self):
+        with _Refcounted.lock:
+            Media.held -= 1
+        self.released = True
+
+
+class MediaPlayer:
+    def __init__(self, instance=None):
+        self.media = None
+        self.events = EventManager()
+        self.state = State.NothingSpecial
+        self.timers = []
+        self.lock = threading.Lock()
+        self.muted = False
+        self.volume = 100
+        self.position = 0.0
+        self.time = 0
+        self.listPlayer = None  # MediaListPlayer driving this player
+
+    def event_manager(self):
+        return self.events
+
+    def set_media(self, media):
+        self.stop()
+        if media is not None:
+            media.retain()
+        old, self.media = self.media, media
+        if old is not None:
+            old.release()
+
+    def get_media(self):
+        if self.media is not None:
+            self.media.retain()
+        return self.media
+
+    def set_mrl(self, mrl):
+        media = Media(mrl)
+        self.set_media(media)
+        media.release()
+
+    def set_xwindow(self, wid):
+        pass
+
+    set_hwnd = set_nsobject = set_xwindow
+
+    def schedule(self, delay, fn):
+        timer = threading.Timer(delay, fn)
+        timer.daemon = True
+        with self.lock:
+            self.timers.append(timer)
+        timer.start()
+
+    def play(self):
+        if self.media is None:
+            return -1
+        paused = ':start-paused' in self.media.options
+        media = self.media
+
+        def started():
+            if self.media is not media:
+                return
+            if media.mrl in UNPLAYABLE:
+                self.state = State.Error
+                self.events.fire(EventType.MediaPlayerEncounteredError)
+                return
+            self.state = State.Paused if paused else State.Playing
+            self.events.fire(EventType.MediaPlayerPlaying)
+            self.events.fire(EventType.MediaPlayerVout)
+            if paused:
+                # :start-paused holds the first frame, like libVLC
+                self.events.fire(EventType.MediaPlayerPaused)
+            else:
+                self.schedule(media.duration, ended)
+
+        def ended():
+            if self.media is not media or self.state != State.Playing:
+                return
+            self.state = State.Ended
+            self.events.fire(EventType.MediaPlayerEndReached)
+            if self.listPlayer is not None:
+                self.listPlayer.next()
+
+        self.schedule(STARTUP_DELAY, started)
+        return 0
+
+    def set_pause(self, do_pause):
+        if do_pause:
+            self.state = State.Paused
+        elif self.state == State.Paused and self.media is not None:
+            self.state = State.NothingSpecial
+            self.media.options = [o for o in self.media.options if o != ':start-paused']
+            self.play()
+
+    def pause(self):
+        self.set_pause(self.state == State.Playing)
+
+    def stop(self):
+        with self.lock:
+            timers, self.timers = self.timers, []
+        for timer in timers:
+            timer.cancel()
+        if self.state not in (State.NothingSpecial, State.Stopped):
+            self.state = State.Stopped
+            self.events.fire(EventType.MediaPlayerStopped)
+
+    def is_playing(self):
+        return 1 if self.state == State.Playing else 0
+
+    def get_state(self):
+        return self.state
+
+    def audio_set_mute(self, mute):
+        self.muted = bool(mute)
+
+    def audio_set_volume(self, volume):
+        self.volume = volume
+        return 0
+
+    def set_position(self, pos):
+        self.position = pos
+
+    def get_time(self):
+        return self.time
+
+    def set_time(self, ms):
+        self.time = ms
+
+    def get_length(self):
+        return self.media.get_duration() if self.media is not None else -1
+
+    def release(self):
+        self.stop()
+        self.set_media(None)
+
+
+class MediaList(_Refcounted):
+    def __init__(self, items=()):
+        super().__init__()
+        self.items = []
+        for media in items:
+            self.add_media(media)
+
+    def add_media(self, media):
+        media.retain()
+        self.items.append(media)
+        return 0
+
+    def count(self):
+        return len(self.items)
+
+    def item_at_index(self, i):
+        media = self.items[i]
+        media.retain()
+        return media
+
+    def lock(self):
+        pass
+
+    def unlock(self):
+        pass
+
+    def free(self):
+        items, self.items = self.items, []
+        for media in items:
+            media.release()
+
+
+class MediaListPlayer:
+    """Walks a MediaList on its MediaPlayer; MediaListPlayerPlayed when the
+    last item ended (never in loop mode)
+    """
+    def __init__(self, instance=None):
+        self.events = EventManager()
+        self.player = None
+        self.list = None
+        self.mode = PlaybackMode.default
+        self.index = -1
+
+    def event_manager(self):
+        return self.events
+
+    def set_media_player(self, player):
+        self.player = player
+
+    def set_media_list(self, mediaList):
+        self.stop()
+        mediaList.retain()
+        old, self.list = self.list, mediaList
+        if old is not None:
+            old.release()
+        self.index = -1
+
+    def set_playback_mode(self, mode):
+        self.mode = mode
+
+    def play_item_at_index(self, i):
+        self.index = i
+        self.player.listPlayer = self
+        self.player.set_media(self.list.items[i])
+        return self.player.play()
+
+    def play(self):
+        if self.list is None or not self.list.count():
+            return -1
+        return self.play_item_at_index(0)
+
+    def next(self):
+        if self.mode == PlaybackMode.repeat:
+            self.play_item_at_index(self.index)
+        elif self.index + 1 < self.list.count():
+            self.play_item_at_index(self.index + 1)
+        elif self.mode == PlaybackMode.loop:
+            self.play_item_at_index(0)
+        else:
+            self.player.listPlayer = None
+            self.events.fire(EventType.MediaListPlayerPlayed)
+
+    def stop(self):
+        if self.player is not None and self.player.listPlayer is self:
+            self.player.listPlayer = None
+            self.player.stop()
+
+    def release(self):
+        self.stop()
+        if self.list is not None:
+            self.list.release()
+            self.list = None
+
+
+class Instance:
+    def __init__(self, *args):
+        self.args = args
+
+    def media_new(self, mrl, *options):
+        media = Media(mrl)
+        media.options.extend(options)
+        return media
+
+    def media_player_new(self, uri=None):
+        return MediaPlayer(self)
+
+    def media_list_new(self, mrls=None):
+        return MediaList()
+
+    def media_list_player_new(self):
+        return MediaListPlayer(self)
+
+    def release(self):
+        pass
+
+
+def libvlc_media_event_manager(media):
+    """The media's event manager without the memo of Media.event_manager()
+    """
+    return media.events
+
+
+def install():
+    """Register this module as `vlc` in sys.modules
+    """
+    module = sys.modules[__name__]
+    sys.modules['vlc'] = module
+    return module
@@ -3,8 +3,12 @@ import json
 import pickle
 import websockets
 
+import logsetup
+
+log = logsetup.getLogger('websocket')
+
 async def accept(websocket, path):
-    print('accepted', websocket.origin, websocket.id)
+    log.info('client accepted', origin=websocket.origin, id=websocket.id)
     while True:
         data = await websocket.recv()  # 클라이언트로부터 메시지를 대기한다.
         recvdata = json.loads(data)
@@ -12,15 +16,16 @@ async def accept(websocket, path):
 
         # if you receive '0' data from client once, add client socket into Advertiser client list
         # advertise mode ready to client
-        print(data)
+        log.debug('message received', data=data)
 
         # keywork.sendMedia(recvMsg)
 
 
 async def websockermain():
-    print('run websocker')
+    log.info('websocket server started', port=5001)
     async with websockets.serve(accept, "localhost", 5001):
         await asyncio.Future()
 
 if "__main__" == __name__:
+    logsetup.configure()
     asyncio.run(websockermain())
\ No newline at end of file